@@ -1,44 +1,133 @@
 # AvanzareMk2.py
 import os
+import json
+import time
+import asyncio
+import hashlib
 import discord
 from discord.ext import commands
-from bot.cogs import auth  # bot/cogs/auth.py の AuthCog
-from bot.config import BOT_TOKEN
-import threading
+from bot.config import BOT_TOKEN, CACHE_PROFILE, CLUSTER_WORKERS
+from bot.storage import storage
+from bot.log import setup_logging, get_logger
+from bot.cache import bot_options, rss_mb
+from bot.cluster import cluster
+
+STARTED_AT = time.perf_counter()
+log = get_logger("bot")
+COGS_DIR = os.path.join(os.path.dirname(__file__), "bot", "cogs")
+
 # ===============================
 # Bot 作成
 # ===============================
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+# メンバーキャッシュ・起動時チャンク・メッセージキャッシュは CACHE_PROFILE で切り替え
+if cluster.enabled:
+    # クラスタのワーカー: 受け持ちのシャードだけに接続する
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_ids=cluster.shard_ids,
+        shard_count=cluster.shard_count,
+        **bot_options(intents),
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, **bot_options(intents))
 
 GUILD_ID = os.environ.get("TEST_GUILD_ID")  # ギルド同期用（任意）
+FORCE_SYNC = os.environ.get("FORCE_SYNC") == "1"  # ハッシュが同じでも同期する
+
+def elapsed(since: float) -> str:
+    return f"{(time.perf_counter() - since) * 1000:.0f}ms"
 
 # ===============================
-# on_ready
+# Cog ロード（bot/cogs/ 以下を全部、並行で）
 # ===============================
-@bot.event
-async def on_ready():
-    print(f"[Bot] Logged in as {bot.user}")
+async def load_cogs():
+    names = sorted(
+        f"bot.cogs.{file[:-3]}"
+        for file in os.listdir(COGS_DIR)
+        if file.endswith(".py") and not file.startswith("_")
+    )
+    results = await asyncio.gather(
+        *(bot.load_extension(name) for name in names),
+        return_exceptions=True,
+    )
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            log.error("Cog ロード失敗 %s: %r", name, result)
+    # /help はコマンドツリーから作ってキャッシュしているので作り直させる
+    bot.dispatch("help_invalidate")
+    return names
 
-    # Cog ロード
-    try:
-        await bot.load_extension("bot.cogs.auth")
-        print("[Bot] AuthCog ロード完了")
-    except Exception as e:
-        print(f"[Bot] Cog ロード失敗: {e}")
+# ===============================
+# コマンド同期（ツリーが変わったときだけ）
+# ===============================
+def tree_hash(guild) -> str:
+    commands_ = [cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands(guild=guild)]
+    commands_.sort(key=lambda c: (c.get("type", 1), c["name"]))
+    data = json.dumps(commands_, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+async def sync_commands():
+    guild = discord.Object(id=int(GUILD_ID)) if GUILD_ID else None
+    key = GUILD_ID or "global"
+    sync_state = storage.open("sync_state", {})
+
+    digest = tree_hash(guild)
+    if not FORCE_SYNC and sync_state.get(key) == digest:
+        log.info("コマンドに変更なし、同期をスキップ")
+        return
 
-    # コマンド同期
     try:
-        if GUILD_ID:
-            guild = discord.Object(id=int(GUILD_ID))
-            await bot.tree.sync(guild=guild)
-            print(f"[Bot] ギルド {GUILD_ID} にコマンド同期完了")
-        else:
-            await bot.tree.sync()
-            print("[Bot] グローバルコマンド同期完了")
-    except Exception as e:
-        print(f"[Bot] コマンド同期失敗: {e}")
+        await bot.tree.sync(guild=guild)
+    except discord.HTTPException as e:
+        log.error("コマンド同期失敗: %s", e)
+        return
+
+    bot.dispatch("help_invalidate")
+    sync_state[key] = digest
+    storage.mark_dirty("sync_state", key)
+    if GUILD_ID:
+        log.info("ギルド %s にコマンド同期完了", GUILD_ID)
+    else:
+        log.info("グローバルコマンド同期完了")
+
+# ===============================
+# setup_hook（起動時に 1 回だけ。再接続では呼ばれない）
+# ===============================
+@bot.event
+async def setup_hook():
+    if cluster.enabled:
+        # Cog がストアや他のワーカーからの中継を使う前につないでおく
+        await cluster.bus.connect()
+        # 他のワーカーが書いたストアの変更をメモリに反映する
+        cluster.bus.on("store.update", lambda data, frame: storage.apply(data))
+        log.info("ワーカー %d 起動 シャード %s", cluster.worker_id, cluster.shard_ids)
+
+    # Cog が import 時に open() するストアを先に読んでおく（ループの中でディスク・同期通信を待たない）
+    await storage.preload()
+
+    phase = time.perf_counter()
+    names = await load_cogs()
+    log.info("Cog ロード完了 %d 個 (%s)", len(names), elapsed(phase))
+
+    if cluster.primary:
+        phase = time.perf_counter()
+        await sync_commands()
+        log.info("コマンド同期フェーズ (%s)", elapsed(phase))
+    log.info("キャッシュ: %s / メモリ %s", CACHE_PROFILE, rss_mb())
+
+# ===============================
+# on_ready
+# ===============================
+@bot.event
+async def on_ready():
+    members = sum(len(g.members) for g in bot.guilds)
+    log.info(
+        "Logged in as %s (起動から %s) キャッシュ: %s / ギルド %d / メンバー %d / メモリ %s",
+        bot.user, elapsed(STARTED_AT), CACHE_PROFILE, len(bot.guilds), members, rss_mb(),
+    )
 
 # ===============================
 # 起動
@@ -46,4 +135,16 @@ async def on_ready():
 if __name__ == "__main__":
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN が設定されていません")
-    bot.run(BOT_TOKEN)
+    setup_logging()
+    if CLUSTER_WORKERS > 1 and not cluster.enabled:
+        # ランチャー: Discord には接続せず、ワーカーの起動とストレージを受け持つ
+        from bot.launcher import run_cluster
+        run_cluster(os.path.abspath(__file__))
+    else:
+        try:
+            # discord.py のログも同じキュー経由で出す（独自のハンドラは付けさせない）
+            bot.run(BOT_TOKEN, log_handler=None)
+        finally:
+            # 書き込み待ちのデータを保存（ワーカーならランチャーへ送る）
+            storage.close_sync()
+            log.info("データ保存完了 %s", storage.stats())
@@ -0,0 +1,256 @@
+"""
+ベンチマーク用の Discord オブジェクトの代わり。
+
+Cog が使う属性・メソッドだけを持つ。REST にあたる操作は RecordingHTTP を通り、
+指定した遅延をかけてから記録される（Discord には接続しない）。
+"""
+import time
+import random
+import asyncio
+import itertools
+
+# 上位ビット（時刻部分）を乱数にして、ギルドがシャードに散らばるようにする（シャード = (id >> 22) % 数）
+_ids = itertools.count(1)
+_rng = random.Random(0)
+
+
+def new_id() -> int:
+    return (_rng.getrandbits(40) << 22) | (next(_ids) & ((1 << 22) - 1))
+
+
+# --------------------------
+# REST の代わり
+# --------------------------
+class RecordingHTTP:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = []  # (操作名, 対象 ID, 完了時刻)
+
+    async def call(self, action: str, target_id: int):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append((action, target_id, time.perf_counter()))
+
+    def count(self, action: str = None) -> int:
+        if action is None:
+            return len(self.calls)
+        return sum(1 for c in self.calls if c[0] == action)
+
+
+# --------------------------
+# Discord オブジェクト
+# --------------------------
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeRole:
+    def __init__(self, guild, name: str = "role"):
+        self.id = new_id()
+        self.guild = guild
+        self.name = name
+
+    def is_default(self) -> bool:
+        return False
+
+
+class FakeUser:
+    def __init__(self, name: str = "user", bot: bool = False):
+        self.id = new_id()
+        self.name = name
+        self.display_name = name
+        self.display_avatar = FakeAsset()
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild, http: RecordingHTTP, name: str = "member"):
+        super().__init__(name)
+        self.guild = guild
+        self.http = http
+        self.roles = []
+
+    def get_role(self, role_id: int):
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def add_roles(self, *roles, reason=None):
+        await self.http.call("add_roles", self.id)
+        self.roles.extend(r for r in roles if r not in self.roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.http.call("remove_roles", self.id)
+        self.roles = [r for r in self.roles if r not in roles]
+
+    async def edit(self, roles=None, reason=None):
+        await self.http.call("edit_member", self.id)
+
+    async def timeout(self, until, reason=None):
+        await self.http.call("timeout", self.id)
+
+    async def send(self, content=None, **kwargs):
+        await self.http.call("dm", self.id)
+
+
+def read_files(files):
+    """アップロードの代わりに discord.File を最後まで読む"""
+    for file in files or ():
+        while file.fp.read(64 * 1024):
+            pass
+
+
+class FakeWebhook:
+    def __init__(self, channel, name: str, user):
+        self.channel = channel
+        self.name = name
+        self.user = user
+
+    async def send(self, content=None, **kwargs):
+        await self.channel.http.call("webhook_send", self.channel.id)
+        read_files(kwargs.get("files"))
+        return FakePartialMessage(self.channel, new_id())
+
+    async def edit_message(self, message_id: int, **kwargs):
+        await self.channel.http.call("webhook_edit", message_id)
+
+    async def delete_message(self, message_id: int):
+        await self.channel.http.call("webhook_delete", message_id)
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.channel.http.call("edit_message", self.id)
+
+    async def delete(self):
+        await self.channel.http.call("delete_message", self.id)
+
+
+class FakeChannel:
+    def __init__(self, guild, http: RecordingHTTP, name: str = "general"):
+        self.id = new_id()
+        self.guild = guild
+        self.http = http
+        self.name = name
+        self.category = None
+        self._webhooks = []
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, **kwargs):
+        await self.http.call("channel_send", self.id)
+        read_files(kwargs.get("files"))
+        return FakePartialMessage(self, new_id())
+
+    async def webhooks(self):
+        return list(self._webhooks)
+
+    async def create_webhook(self, name: str):
+        await self.http.call("create_webhook", self.id)
+        webhook = FakeWebhook(self, name, self.guild.me)
+        self._webhooks.append(webhook)
+        return webhook
+
+    def get_partial_message(self, message_id: int):
+        return FakePartialMessage(self, message_id)
+
+    async def delete_messages(self, messages):
+        await self.http.call("bulk_delete", self.id)
+
+
+class FakeGuild:
+    def __init__(self, http: RecordingHTTP, me, name: str = "guild"):
+        self.id = new_id()
+        self.http = http
+        self.me = me
+        self.name = name
+        self.unavailable = False
+        self.channels = {}
+        self.members = {}
+        self.roles = {}
+
+    def add_channel(self, name: str = "general") -> FakeChannel:
+        channel = FakeChannel(self, self.http, name)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_member(self, name: str = "member") -> FakeMember:
+        member = FakeMember(self, self.http, name)
+        self.members[member.id] = member
+        return member
+
+    def add_role(self, name: str = "role") -> FakeRole:
+        role = FakeRole(self, name)
+        self.roles[role.id] = role
+        return role
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_member(self, member_id: int):
+        return self.members.get(member_id)
+
+    def get_role(self, role_id: int):
+        return self.roles.get(role_id)
+
+    async def fetch_member(self, member_id: int):
+        await self.http.call("fetch_member", member_id)
+        return self.members[member_id]
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, author, content: str):
+        self.id = new_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.embeds = []
+        self.reference = None
+
+    async def delete(self):
+        await self.channel.http.call("delete_message", self.id)
+
+
+# --------------------------
+# Bot の代わり
+# --------------------------
+class FakeBot:
+    def __init__(self, http: RecordingHTTP):
+        self.http = http
+        self.user = FakeUser("hunyaBOT", bot=True)
+        self.guilds = []
+        self.latency = 0.0
+        self.cached_messages = []
+        self._channels = {}
+
+    @property
+    def users(self):
+        return [m for g in self.guilds for m in g.members.values()]
+
+    def add_guild(self, name: str = "guild") -> FakeGuild:
+        guild = FakeGuild(self.http, self.user, name)
+        self.guilds.append(guild)
+        return guild
+
+    def add_channel(self, guild: FakeGuild, name: str = "general") -> FakeChannel:
+        channel = guild.add_channel(name)
+        self._channels[channel.id] = channel
+        return channel
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_guild(self, guild_id: int):
+        return next((g for g in self.guilds if g.id == guild_id), None)
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
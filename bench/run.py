@@ -0,0 +1,385 @@
+"""
+オフラインのベンチマーク（Discord には接続しない）。
+
+    python -m bench.run                       # 全部
+    python -m bench.run listeners relay       # 一部だけ
+    python -m bench.run --out bench.json      # 結果を JSON で保存
+    python -m bench.run --baseline old.json   # 前の結果との差分も出す
+
+結果は標準出力に JSON で出す（Bot のログは標準エラーへ回す）。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+from bench.fakes import RecordingHTTP, FakeBot, FakeMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("listeners", "relay", "auth")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_env(data_dir: str):
+    """bot.config を読む前に、ベンチ用の設定にしておく"""
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "STORAGE_BACKEND": "json",
+        "WEB_HOST": "127.0.0.1",
+        "PORT": str(free_port()),
+        "METRICS_PORT": "0",
+        "CLIENT_ID": "bench",
+        "CLIENT_SECRET": "bench",
+        "REDIRECT_URI": "http://127.0.0.1",
+    })
+    # bot.config は sys.argv[1] を .env の名前として読むので、引数を見せない
+    del sys.argv[1:]
+
+
+def percentiles(samples_ms) -> dict:
+    if not samples_ms:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples_ms)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": round(ordered[-1], 3)}
+
+
+async def wait_until(predicate, timeout: float = 30.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("ベンチの待ち合わせがタイムアウトしました")
+        await asyncio.sleep(0.001)
+
+
+# --------------------------
+# on_message（invite_watch + global_chat）
+# --------------------------
+async def bench_listeners(args) -> dict:
+    from bot.pipeline import pipeline
+    from bot.cogs.message_pipeline import MessagePipelineCog
+    from bot.cogs.global_chat import GlobalChatCog, global_data
+    from bot.cogs.invite_watch import InviteWatch, invite_cfg, default_cfg
+
+    http = RecordingHTTP()
+    bot = FakeBot(http)
+    channels, authors = [], []
+    for g in range(args.guilds):
+        guild = bot.add_guild(f"guild{g}")
+        channels.append(bot.add_channel(guild))
+        authors.append([guild.add_member(f"user{g}-{m}") for m in range(20)])
+        invite_cfg[str(guild.id)] = dict(default_cfg(), enabled=True, url_watch=True, allow=["example.com"])
+    global_data["bench"] = [f"{ch.guild.id}:{ch.id}" for ch in channels]
+
+    listener = MessagePipelineCog(bot)
+    watch = InviteWatch(bot)
+    chat = GlobalChatCog(bot)
+    await watch.cog_load()
+    await chat.cog_load()
+
+    contents = [
+        ("clean", "こんにちは、今日のイベントは何時からですか？"),
+        ("clean", "了解です。あとで確認します"),
+        ("allowed_url", "資料はこちら https://example.com/docs/guide"),
+        ("invite", "参加してね discord[.]gg/abcdef"),
+        ("url", "見て https://spam.example.net/free"),
+    ]
+    weights = (45, 35, 10, 5, 5)
+    rng = random.Random(args.seed)
+
+    samples = []
+    kinds = {}
+    started = time.perf_counter()
+    for _ in range(args.messages):
+        i = rng.randrange(len(channels))
+        kind, content = rng.choices(contents, weights)[0]
+        kinds[kind] = kinds.get(kind, 0) + 1
+        message = FakeMessage(channels[i], rng.choice(authors[i]), content)
+        t = time.perf_counter()
+        await listener.on_message(message)
+        samples.append((time.perf_counter() - t) * 1000)
+        if len(samples) % 500 == 0:
+            # 中継・削除のワーカーにも時間を渡す（実際の Gateway と同じく合間がある）
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    # まとめ削除の待ち時間が過ぎてから REST の呼び出し数を数える
+    await asyncio.sleep(watch.actions.window + 0.2)
+    await wait_until(lambda: all(s["depth"] == 0 for s in chat.relay.stats().values()))
+    stages = pipeline.stats()
+
+    await chat.cog_unload()
+    await watch.cog_unload()
+    del global_data["bench"]
+    for ch in channels:
+        invite_cfg.pop(str(ch.guild.id), None)
+
+    return {
+        "messages": args.messages,
+        "guilds": args.guilds,
+        "mix": kinds,
+        "messages_per_sec": round(args.messages / elapsed, 1),
+        "dispatch": percentiles(samples),
+        "stages": {
+            name: {"count": s["count"], "avg_ms": round(s["total_ms"] / s["count"], 4) if s["count"] else 0.0}
+            for name, s in stages.items()
+        },
+        "rest_calls": {
+            action: http.count(action)
+            for action in ("webhook_send", "channel_send", "bulk_delete", "delete_message", "timeout", "dm")
+        },
+        "moderation": watch.actions.stats(),
+    }
+
+
+# --------------------------
+# グローバルチャットの配送遅延（N チャンネル）
+# --------------------------
+async def bench_relay(args) -> list:
+    from bot.pipeline import pipeline
+    from bot.cogs.global_chat import GlobalChatCog, global_data
+
+    results = []
+    for n in args.channels:
+        http = RecordingHTTP(latency=args.latency)
+        bot = FakeBot(http)
+        channels = [bot.add_channel(bot.add_guild(f"guild{g}")) for g in range(n)]
+        global_data["bench"] = [f"{ch.guild.id}:{ch.id}" for ch in channels]
+        chat = GlobalChatCog(bot)
+        await chat.cog_load()
+        source = channels[0]
+        author = source.guild.add_member("sender")
+        expected = n - 1
+
+        # 1 通目で Webhook を作るので、計測から外す
+        await pipeline.dispatch(FakeMessage(source, author, "warmup"))
+        await wait_until(lambda: http.count("webhook_send") >= expected)
+
+        # 1 通ずつ: 送信から最後の中継先に届くまで
+        samples = []
+        for i in range(args.relay_messages):
+            sent_before = len(http.calls)
+            t = time.perf_counter()
+            await pipeline.dispatch(FakeMessage(source, author, f"message {i}"))
+            await wait_until(lambda: len(http.calls) - sent_before >= expected)
+            samples.append((http.calls[-1][2] - t) * 1000)
+
+        # まとめて: バースト全体を捌き終わるまで（遅れた分はまとめて送られる）
+        def handled():
+            return sum(s["sent"] + s["merged"] + s["dropped"] for s in chat.relay.stats().values())
+
+        calls_before = len(http.calls)
+        handled_before = handled()
+        t = time.perf_counter()
+        for i in range(args.burst):
+            await pipeline.dispatch(FakeMessage(source, author, f"burst {i}"))
+        await wait_until(lambda: handled() - handled_before >= expected * args.burst)
+        burst_ms = (time.perf_counter() - t) * 1000
+
+        stats = chat.relay.stats().values()
+        results.append({
+            "channels": n,
+            "latency_ms": args.latency * 1000,
+            "fanout": percentiles(samples),
+            "burst_messages": args.burst,
+            "burst_ms": round(burst_ms, 3),
+            "burst_posts": len(http.calls) - calls_before,
+            "merged": sum(s["merged"] for s in stats),
+            "dropped": sum(s["dropped"] for s in stats),
+        })
+
+        await chat.cog_unload()
+        del global_data["bench"]
+    return results
+
+
+# --------------------------
+# OAuth コールバック（ローカルのトークンサーバー相手）
+# --------------------------
+async def start_token_stub(latency: float):
+    from aiohttp import web
+
+    async def token(request):
+        await request.post()
+        if latency:
+            await asyncio.sleep(latency)
+        return web.json_response({"access_token": "bench", "token_type": "Bearer"})
+
+    app = web.Application()
+    app.router.add_post("/api/oauth2/token", token)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}/api/oauth2/token"
+
+
+async def bench_auth(args) -> dict:
+    import aiohttp
+    import bot.cogs.auth as auth
+    from bot.web import server
+
+    stub, token_url = await start_token_stub(args.latency)
+    auth.TOKEN_URL = token_url
+
+    http = RecordingHTTP(latency=args.latency)
+    bot = FakeBot(http)
+    guild = bot.add_guild()
+    role = guild.add_role("verified")
+    members = [guild.add_member(f"user{i}") for i in range(args.callbacks)]
+
+    cog = auth.AuthCog(bot)
+    cog.auto_roles[str(guild.id)] = str(role.id)
+    await cog.cog_load()
+    base = f"http://{server.host}:{server.port}/callback"
+
+    limit = asyncio.Semaphore(args.concurrency)
+    samples = []
+    results = {}
+
+    async def one(session, i, member):
+        async with limit:
+            t = time.perf_counter()
+            async with session.get(base, params={"code": f"code{i}", "state": f"{member.id}:{guild.id}"}) as resp:
+                text = await resp.text()
+            samples.append((time.perf_counter() - t) * 1000)
+            key = "ok" if text.startswith("✅ 認証完了") else "other"
+            results[key] = results.get(key, 0) + 1
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session, i, m) for i, m in enumerate(members)))
+        elapsed = time.perf_counter() - started
+
+    await cog.cog_unload()
+    await server.stop()
+    await stub.cleanup()
+
+    return {
+        "callbacks": args.callbacks,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency * 1000,
+        "callbacks_per_sec": round(args.callbacks / elapsed, 1),
+        "callback": percentiles(samples),
+        "results": results,
+        "token": {
+            "requests": cog.token_stats["requests"],
+            "retries": cog.token_stats["retries"],
+            "avg_ms": round(cog.token_stats["total_ms"] / max(1, cog.token_stats["requests"]), 3),
+        },
+        "rest_calls": {action: http.count(action) for action in ("fetch_member", "add_roles")},
+    }
+
+
+# --------------------------
+# 結果の比較
+# --------------------------
+def compare(current, baseline, path=""):
+    """数値の項目だけ、前の結果からの変化率（%）を返す"""
+    if isinstance(current, dict) and isinstance(baseline, dict):
+        out = {}
+        for key, value in current.items():
+            if key in baseline:
+                diff = compare(value, baseline[key])
+                if diff not in (None, {}, []):
+                    out[key] = diff
+        return out
+    if isinstance(current, list) and isinstance(baseline, list):
+        return [compare(c, b) for c, b in zip(current, baseline)]
+    if isinstance(current, (int, float)) and isinstance(baseline, (int, float)) and baseline:
+        return round((current - baseline) / baseline * 100, 1)
+    return None
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from bot.storage import storage
+    from bot.outbound import outbound
+
+    benches = {"listeners": bench_listeners, "relay": bench_relay, "auth": bench_auth}
+    results = {}
+    for name in args.scenarios:
+        print(f"[bench] {name} 開始", file=sys.stderr)
+        results[name] = await benches[name](args)
+
+    outbound.stop()
+    await storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hunyaBOT のオフラインベンチマーク")
+    parser.add_argument("scenarios", nargs="*", help=f"実行するもの（{', '.join(SCENARIOS)}。省略で全部）")
+    parser.add_argument("--messages", type=int, default=20000, help="listeners: 流すメッセージ数")
+    parser.add_argument("--guilds", type=int, default=10, help="listeners: ギルド数（全部同じネットワーク）")
+    parser.add_argument("--channels", type=lambda s: [int(n) for n in s.split(",")], default=[10, 50, 200],
+                        help="relay: ネットワークのチャンネル数（カンマ区切り）")
+    parser.add_argument("--relay-messages", type=int, default=50, help="relay: 1 通ずつ測る回数")
+    parser.add_argument("--burst", type=int, default=200, help="relay: まとめて流すメッセージ数")
+    parser.add_argument("--callbacks", type=int, default=500, help="auth: コールバック数")
+    parser.add_argument("--concurrency", type=int, default=50, help="auth: 同時リクエスト数")
+    parser.add_argument("--latency", type=float, default=0.005, help="偽の REST・トークンサーバーの遅延（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="結果の JSON を保存するファイル")
+    parser.add_argument("--baseline", help="比較する前回の結果（JSON）")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(sorted(unknown))}")
+    args.scenarios = list(dict.fromkeys(args.scenarios)) or list(SCENARIOS)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        prepare_env(data_dir)
+        # Bot のログで JSON が崩れないように、計測中の print は標準エラーへ
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        report["change_pct"] = compare(results, base.get("results", {}))
+        report["meta"]["baseline_commit"] = base.get("meta", {}).get("commit")
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import io
+import time
+import asyncio
+import tempfile
+import threading
+
+import aiohttp
+import discord
+
+from bot.metrics import registry
+from bot.log import get_logger
+
+log = get_logger("attachments")
+
+CHUNK_SIZE = 64 * 1024
+BURST_SECONDS = 10  # レート上限の何秒分までまとめて使えるか
+
+ATTACHMENT_BYTES = registry.counter(
+    "hunya_relay_attachment_bytes_total",
+    "グローバルチャットの添付ファイルのバイト数（downloaded / uploaded / linked）",
+    ("kind",),
+)
+
+
+# --------------------------
+# 1 回だけダウンロードした添付ファイル
+# --------------------------
+class SharedAttachment:
+    """
+    小さいものはメモリ、大きいものは一時ファイルに置く（SpooledTemporaryFile）。
+
+    中継先ごとに to_file() で読み出し口を作り、データ自体はコピーしない。
+    アップロードは別スレッドで読まれることがあるので、読み出しはロックして位置を指定する。
+    どこからも参照されなくなったら一時ファイルごと消える。
+    """
+
+    def __init__(self, filename: str, content_type: str, spool_bytes: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self.lock = threading.Lock()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        # 一時ファイルへの書き込みも 64KB ずつなのでループ上で行う
+        self.spool.write(chunk)
+        self.size += len(chunk)
+
+    def read_at(self, pos: int, size: int) -> bytes:
+        with self.lock:
+            self.spool.seek(pos)
+            return self.spool.read(size)
+
+    def to_file(self) -> discord.File:
+        return discord.File(AttachmentReader(self), filename=self.filename)
+
+    def close(self):
+        self.spool.close()
+
+
+class AttachmentReader(io.RawIOBase):
+    """SharedAttachment を自分の位置で読む（discord.File に渡す用）"""
+
+    def __init__(self, source: SharedAttachment):
+        super().__init__()
+        self.source = source
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.source.read_at(self.pos, len(buffer))
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.source.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+
+# --------------------------
+# ネットワークごとのバイト数制限
+# --------------------------
+class ByteBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: int) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+# --------------------------
+# 添付ファイルの中継方法を決める
+# --------------------------
+class AttachmentRelay:
+    """
+    添付ファイルごとに「1 回ダウンロードして全中継先にアップロード」か
+    「CDN のリンクを貼る」かを決める。
+
+    リンクにするもの: max_bytes より大きい・types に無い種類・ネットワークの
+    アップロード量（サイズ × 中継先の数）が rate を超える・ダウンロード失敗。
+    """
+
+    def __init__(self, max_bytes: int, spool_bytes: int, types, rate: float):
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.types = tuple(types)
+        self.rate = rate
+        self.buckets = {}  # ネットワーク名 -> ByteBucket
+        self.session = None
+        self.counters = {
+            "downloaded_bytes": 0,
+            "uploaded_bytes": 0,
+            "linked_bytes": 0,
+            "linked": 0,
+            "rate_limited": 0,
+            "failures": 0,
+        }
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def allowed_type(self, content_type) -> bool:
+        return bool(content_type) and content_type.startswith(self.types)
+
+    def bucket(self, network: str) -> ByteBucket:
+        bucket = self.buckets.get(network)
+        if bucket is None:
+            bucket = self.buckets[network] = ByteBucket(self.rate, self.rate * BURST_SECONDS)
+        return bucket
+
+    async def prepare(self, network: str, attachments, targets: int):
+        """(アップロードする SharedAttachment のタプル, リンクにする URL のリスト)"""
+        files, links = [], []
+        for attachment in attachments:
+            upload = attachment.size * targets
+            if attachment.size > self.max_bytes or not self.allowed_type(attachment.content_type):
+                shared = None
+            elif not self.bucket(network).take(upload):
+                self.counters["rate_limited"] += 1
+                shared = None
+            else:
+                shared = await self.fetch(attachment)
+
+            if shared is None:
+                links.append(attachment.url)
+                self.counters["linked"] += 1
+                self.counters["linked_bytes"] += upload
+                ATTACHMENT_BYTES.inc(upload, ("linked",))
+            else:
+                files.append(shared)
+        return tuple(files), links
+
+    async def fetch(self, attachment):
+        await self.start()
+        shared = SharedAttachment(attachment.filename, attachment.content_type, self.spool_bytes)
+        try:
+            async with self.session.get(attachment.url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    shared.write(chunk)
+                    if shared.size > self.max_bytes:
+                        raise ValueError("サイズ上限を超えました")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            shared.close()
+            self.counters["failures"] += 1
+            log.warning("添付ファイルの取得失敗 %s: %s", attachment.filename, e)
+            return None
+
+        self.counters["downloaded_bytes"] += shared.size
+        ATTACHMENT_BYTES.inc(shared.size, ("downloaded",))
+        return shared
+
+    def uploaded(self, files):
+        size = sum(f.size for f in files)
+        self.counters["uploaded_bytes"] += size
+        ATTACHMENT_BYTES.inc(size, ("uploaded",))
+
+    def stats(self):
+        # ダウンロード 1 回で済んだ分（中継先ごとに取得していた場合との差）
+        saved = max(0, self.counters["uploaded_bytes"] - self.counters["downloaded_bytes"])
+        return dict(self.counters, saved_download_bytes=saved)
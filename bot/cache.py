@@ -0,0 +1,111 @@
+import os
+import sys
+import asyncio
+
+import discord
+from discord.state import ChunkRequest
+
+from bot.config import CACHE_PROFILE, MESSAGE_CACHE_SIZE
+
+PROFILES = {
+    # 全メンバーをキャッシュし、起動時にチャンクで取得する（discord.py の既定）
+    "full": {"members": True, "chunk": True, "messages": 1000},
+    # メンバーは持たない。メッセージ・インタラクションに付いてくる情報と fetch で足りる
+    "lean": {"members": False, "chunk": False, "messages": 100},
+}
+
+
+def bot_options(intents: discord.Intents, profile: str = CACHE_PROFILE) -> dict:
+    """commands.Bot に渡すキャッシュ関係の引数"""
+    if profile not in PROFILES:
+        raise RuntimeError(f"CACHE_PROFILE が不正です: {profile}（full / lean）")
+    p = PROFILES[profile]
+    messages = int(MESSAGE_CACHE_SIZE) if MESSAGE_CACHE_SIZE is not None else p["messages"]
+    return {
+        "member_cache_flags": (
+            discord.MemberCacheFlags.from_intents(intents) if p["members"] else discord.MemberCacheFlags.none()
+        ),
+        "chunk_guilds_at_startup": p["chunk"],
+        "max_messages": messages or None,
+    }
+
+
+async def get_or_fetch_member(guild: discord.Guild, member_id: int) -> discord.Member:
+    """キャッシュに無ければ REST で取る（lean では常に REST）。いなければ discord.NotFound"""
+    return guild.get_member(member_id) or await guild.fetch_member(member_id)
+
+
+# --------------------------
+# メンバーをページごとに受け取る
+# --------------------------
+class MemberChunkStream(ChunkRequest):
+    """
+    ゲートウェイのメンバーチャンク（1 回 1000 人まで）を、届いた順にキューで受け取る。
+    guild.chunk() と違って全員分を溜めないし、キャッシュにも入れない。
+    """
+
+    def __init__(self, guild: discord.Guild):
+        super().__init__(guild.id, guild.shard_id, asyncio.get_running_loop(), guild._state._get_guild, cache=False)
+        self.queue = asyncio.Queue()
+        self.received = 0
+
+    def add_members(self, members):
+        self.received += len(members)
+        self.queue.put_nowait(members)
+
+    def done(self):
+        super().done()
+        self.queue.put_nowait(None)
+
+
+async def iter_member_pages(guild: discord.Guild, page_size: int, timeout: float = 30.0):
+    """
+    メンバーを page_size 人ずつ返す。キャッシュ済みならそれを、無ければゲートウェイの
+    チャンクを届いた順に使う（1 人ずつの fetch_member はしない）。順番は決まっていない。
+    """
+    if guild.chunked:
+        members = list(guild.members)
+        for i in range(0, len(members), page_size):
+            yield members[i:i + page_size]
+        return
+
+    state = guild._state
+    request = MemberChunkStream(guild)
+    state._chunk_requests[request.nonce] = request
+    try:
+        await state.chunker(guild.id, nonce=request.nonce)
+        page = []
+        # チャンクの間が timeout 秒空いたら asyncio.TimeoutError
+        while (members := await asyncio.wait_for(request.queue.get(), timeout)) is not None:
+            page.extend(members)
+            while len(page) >= page_size:
+                yield page[:page_size]
+                page = page[page_size:]
+        if page:
+            yield page
+        # 再接続でリクエストが打ち切られたときも done() が呼ばれるので、数で見分ける
+        # （取得中の参加・退出の分は許す）
+        if guild.member_count and request.received < guild.member_count * 0.98:
+            raise ConnectionError(f"メンバーの取得が途中で切れました ({request.received}/{guild.member_count})")
+    finally:
+        state._chunk_requests.pop(request.nonce, None)
+
+
+def rss_bytes() -> int:
+    """現在の常駐メモリ（取れない環境では最大値、それも無理なら 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux は KiB
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_mb() -> str:
+    return f"{rss_bytes() / 1024 / 1024:.1f}MB"
@@ -0,0 +1,47 @@
+from bot.config import CLUSTER_WORKERS, CLUSTER_SOCKET, CLUSTER_WORKER_ID, CLUSTER_SHARD_COUNT
+from bot.ipc import IpcClient
+
+
+# --------------------------
+# このプロセスの受け持ち
+# --------------------------
+class Cluster:
+    """
+    クラスタモードで、このワーカーがどのシャード（＝どのギルド）を受け持つか。
+
+    シャード s はワーカー s % workers が受け持つ。クラスタモードでないときは
+    全ギルドを自分が持っている扱いになり、bus は None。
+    """
+
+    def __init__(self, worker_id, workers: int, shard_count: int, path: str):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.shard_count = shard_count
+        self.bus = IpcClient(path, worker_id) if worker_id is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_id is not None
+
+    @property
+    def primary(self) -> bool:
+        """Web サーバー・コマンド同期など、1 プロセスだけで行う処理の担当"""
+        return not self.enabled or self.worker_id == 0
+
+    @property
+    def shard_ids(self):
+        return list(range(self.worker_id, self.shard_count, self.workers))
+
+    def worker_for_guild(self, guild_id: int) -> int:
+        return ((guild_id >> 22) % self.shard_count) % self.workers
+
+    def owns_guild(self, guild_id: int) -> bool:
+        return not self.enabled or self.worker_for_guild(guild_id) == self.worker_id
+
+
+cluster = Cluster(
+    int(CLUSTER_WORKER_ID) if CLUSTER_WORKER_ID is not None else None,
+    CLUSTER_WORKERS,
+    CLUSTER_SHARD_COUNT,
+    CLUSTER_SOCKET,
+)
@@ -1,36 +1,322 @@
-import os
-import json
+import time
+import math
 import asyncio
 import aiohttp
 from urllib.parse import quote
-import threading
+from email.utils import parsedate_to_datetime
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 from discord.ui import Button, View
-from flask import Flask, request
-
-from bot.config import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI
+from aiohttp import web
+
+from bot.config import (
+    CLIENT_ID,
+    CLIENT_SECRET,
+    REDIRECT_URI,
+    OAUTH_POOL_SIZE,
+    OAUTH_TIMEOUT,
+    OAUTH_MAX_RETRIES,
+    AUTH_CODE_TTL,
+    AUTH_CODE_MAX,
+    AUTH_BUTTON_TIMEOUT,
+    AUTH_SWEEP_CONCURRENCY,
+    AUTH_SWEEP_PAGE_SIZE,
+)
+from bot.storage import storage
+from bot.timers import DeadlineScheduler
+from bot.outbound import outbound, AUTH
+from bot.metrics import registry
+from bot.web import server
+from bot.log import get_logger
+from bot.cache import get_or_fetch_member, iter_member_pages
+from bot.cluster import cluster
 
 OWNER_ID = 123456789012345678  # 自分の Discord ID に変更
-DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
+TOKEN_URL = "https://discord.com/api/oauth2/token"
+
+log = get_logger("auth")
+
+CALLBACK_SECONDS = registry.histogram("hunya_oauth_callback_seconds", "OAuth コールバックの処理時間", ("result",))
+TOKEN_SECONDS = registry.histogram("hunya_oauth_token_seconds", "トークン交換の時間")
+TOKEN_RETRIES = registry.counter("hunya_oauth_token_retries_total", "トークン交換の再試行（429 / 5xx）")
+TOKEN_FAILURES = registry.counter("hunya_oauth_token_failures_total", "access_token を取得できなかったトークン交換")
+SWEEP_CHANGES = registry.counter("hunya_auth_sweep_changes_total", "/auth_sweep でのロールの付け外し", ("change", "result"))
+
+SWEEP_REPORT_INTERVAL = 5.0  # 進み具合の表示を更新する間隔（秒）
+EXPIRY_RETRY_DELAY = 60.0  # ギルドがまだキャッシュに無いときにロール解除をやり直すまでの秒数
+EXPIRY_GIVE_UP = 86400.0   # 本来の期限からこれだけ過ぎても見つからなければ諦める
+
+# --------------------------
+# 再試行の待ち時間
+# --------------------------
+def retry_after_seconds(value, fallback: float) -> float:
+    """
+    Retry-After ヘッダー（秒数 か HTTP 日付）を秒にする。
+    読めない値・過去の日付のときは fallback（計算したバックオフ）
+    """
+    if not value:
+        return fallback
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return fallback
+    if not math.isfinite(delay) or delay < 0:
+        return fallback
+    return delay
 
-AUTO_ROLES_PATH = os.path.join(DATA_DIR, "auto_roles.json")
-AUTH_CODES_PATH = os.path.join(DATA_DIR, "auth_codes.json")
 
 # --------------------------
-# JSON ユーティリティ
+# 認証待ちコードの保管
 # --------------------------
-def load_json(path, default):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return default
+class AuthCodeStore:
+    """
+    "user:guild" -> {"code", "expires", "consumed"}。
+
+    期限切れは purge() で消し、件数が max_size を超えたら古いものから捨てる。
+    consumed の間に同じユーザーのコールバックが来ても、トークン交換はしない。
+    """
+
+    def __init__(self, data: dict, ttl: float, max_size: int):
+        self.data = data
+        self.ttl = ttl
+        self.max_size = max_size
+        self.purge()
+
+    def save(self, key: str):
+        storage.mark_dirty("auth_codes", key)
+
+    def get(self, key: str, now: float = None):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if (now or time.time()) >= entry["expires"]:
+            del self.data[key]
+            self.save(key)
+            return None
+        return entry
+
+    def claim(self, key: str, code: str) -> str:
+        """
+        コールバックを受け付ける。
+        "new": 新規（トークン交換へ） / "pending": 同じコードを処理中 / "consumed": 認証済み
+        """
+        entry = self.get(key)
+        if entry is not None:
+            if entry["consumed"]:
+                return "consumed"
+            if entry["code"] == code:
+                return "pending"
+
+        # 末尾に入れ直して「古い順」を保つ
+        self.data.pop(key, None)
+        self.data[key] = {"code": code, "expires": time.time() + self.ttl, "consumed": False}
+        self.save(key)
+        while len(self.data) > self.max_size:
+            oldest = next(iter(self.data))
+            del self.data[oldest]
+            self.save(oldest)
+        return "new"
+
+    def consume(self, key: str):
+        entry = self.data.get(key)
+        if entry is not None:
+            entry["consumed"] = True
+            self.save(key)
+
+    def release(self, key: str):
+        """失敗したらやり直せるように消す"""
+        if self.data.pop(key, None) is not None:
+            self.save(key)
+
+    def purge(self) -> int:
+        now = time.time()
+        # 古い形式（コード文字列だけ）のものも消す
+        expired = [
+            key for key, entry in self.data.items()
+            if not isinstance(entry, dict) or now >= entry["expires"]
+        ]
+        for key in expired:
+            del self.data[key]
+            self.save(key)
+        return len(expired)
+
+
+# --------------------------
+# 認証ロールの一括見直し
+# --------------------------
+class AuthSweep:
+    """
+    ギルドのメンバー全員を認証済みの記録と照らして、認証後ロールを付け外しする。
+
+    メンバーはゲートウェイのチャンクを届いた順に page_size 人ずつ処理し
+    （1 人ずつ fetch_member しない・全員分を溜めない）、ページごとに進み具合を storage に保存する。
+    チャンクの順番は決まっていないので、中断後の再開は最初から見直す
+    （付け外し済みの人は変更が無いので、REST は残りの分だけ）。
+    付け外しは concurrency 本のワーカーで outbound の AUTH に流し、
+    OAuth 完了時のロール付与を長く待たせない。
+
+    認証の記録はこの機能の追加後の分しか無いので、記録を始める前から
+    ロールを持っている人は、最初の見直しで認証済みとして記録する（外さない）。
+
+    最後まで全員を確認できた回は、今回見かけなかった（抜けた）人の記録のうち
+    今回の開始より前のものを消す。記録は認証のたびに増え、JSON では毎回全体を書き直すため。
+    """
+
+    CHANGES = {"add": "added", "remove": "removed", "record": "recorded"}
+
+    def __init__(self, cog, guild: discord.Guild, state: dict, concurrency: int, page_size: int, report=None):
+        self.cog = cog
+        self.guild = guild
+        self.key = str(guild.id)
+        self.state = state
+        state.setdefault("recorded", 0)
+        state.setdefault("pruned", 0)
+        self.role = guild.get_role(state["role"])
+        self.concurrency = concurrency
+        self.page_size = page_size
+        # 記録を始める前のロール保持者を、認証済みとして取り込む回か
+        self.seeding = not cog.has_verified_history(guild.id)
+        # report(text) は進み具合の表示（コマンドの応答の編集など）
+        self.report = report
+        self.reported = 0.0
+
+    @staticmethod
+    def new_state(role_id: int, dry_run: bool, remove: bool) -> dict:
+        return {
+            "role": role_id, "dry_run": dry_run, "remove": remove, "status": "running",
+            "total": 0, "checked": 0, "added": 0, "removed": 0, "recorded": 0, "failed": 0, "pruned": 0,
+            "started": time.time(), "updated": time.time(),
+        }
+
+    def save(self):
+        self.state["updated"] = time.time()
+        storage.mark_dirty("auth_sweeps", self.key)
+
+    # ---------- 判定 ----------
+    def plan(self, member: discord.Member):
+        """"add" / "remove" / "record"（認証済みとして記録）/ None"""
+        if member.bot:
+            return None
+        key = f"{self.guild.id}:{member.id}"
+        verified = key in self.cog.verified
+        has_role = member.get_role(self.role.id) is not None
+        if verified and not has_role:
+            return "add"
+        # ボタン認証の猶予中の人は自動解除に任せる
+        if verified or not has_role or key in self.cog.expiry.entries:
+            return None
+        if self.seeding:
+            return "record"
+        if self.state["remove"]:
+            return "remove"
+        return None
+
+    # ---------- 実行 ----------
+    async def run(self):
+        if self.role is None:
+            self.state["status"] = "failed"
+            self.save()
+            await self.show(force=True)
+            return
+
+        # 再開でも最初から見直す。付け外し済みの数はそのまま、数えるだけのものは数え直す
+        self.state["checked"] = 0
+        self.state["total"] = self.guild.member_count or 0
+        if self.state["dry_run"]:
+            self.state.update(added=0, removed=0, recorded=0, pruned=0)
+        started = time.time()
+        seen = set()  # 今回見かけたメンバー（抜けた人の記録を消すため）
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        try:
+            async for page in iter_member_pages(self.guild, self.page_size):
+                for member in page:
+                    seen.add(member.id)
+                    change = self.plan(member)
+                    if change is None:
+                        continue
+                    if self.state["dry_run"]:
+                        self.state[self.CHANGES[change]] += 1
+                    elif change == "record":
+                        self.cog.record_verified(self.guild.id, member.id)
+                        self.state["recorded"] += 1
+                    else:
+                        await queue.put((change, member))
+                # ページ分の付け外しが終わってから進み具合を保存する
+                await queue.join()
+                self.state["checked"] += len(page)
+                self.state["total"] = max(self.state["total"], self.state["checked"])
+                self.save()
+                await self.show()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        # チャンクが一部届かなかった回（iter_member_pages は 98% で通す）は、いる人を消しかねないので消さない
+        if len(seen) >= (self.guild.member_count or 0):
+            self.state["pruned"] = self.cog.prune_verified(self.guild.id, seen, started, self.state["dry_run"])
+        if not self.state["dry_run"]:
+            self.cog.mark_verified_history(self.guild.id)
+        self.state["status"] = "done"
+        self.save()
+        log.info("認証ロールの見直し完了 %s", self.progress(), extra={"guild": self.guild.id})
+        await self.show(force=True)
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            change, member = await queue.get()
+            try:
+                if change == "add":
+                    func = lambda: member.add_roles(self.role, reason="認証ロールの見直し（認証済み）")
+                else:
+                    func = lambda: member.remove_roles(self.role, reason="認証ロールの見直し（未認証）")
+                await outbound.run(AUTH, self.guild.id, func)
+                self.state[self.CHANGES[change]] += 1
+                SWEEP_CHANGES.inc(1, (change, "ok"))
+            except discord.HTTPException as e:
+                self.state["failed"] += 1
+                SWEEP_CHANGES.inc(1, (change, "failed"))
+                log.warning("ロールの付け外し失敗: %s", e, extra={"guild": self.guild.id, "user": member.id})
+            finally:
+                queue.task_done()
+
+    # ---------- 進み具合 ----------
+    def progress(self) -> str:
+        return self.describe(self.state)
+
+    @staticmethod
+    def describe(state: dict) -> str:
+        status = {"running": "実行中", "done": "完了", "cancelled": "中止", "failed": "ロールが見つかりません"}
+        head = "🔎 確認のみ" if state["dry_run"] else "🔁 認証ロールの見直し"
+        text = (
+            f"{head}（{status.get(state['status'], state['status'])}）\n"
+            f"確認: {state['checked']}/{state['total']} / 付与: {state['added']} / "
+            f"解除: {state['removed']} / 失敗: {state['failed']}"
+        )
+        if state.get("recorded"):
+            text += f"\n認証済みとして記録: {state['recorded']}（記録を始める前からロールを持っていた人）"
+        if state.get("pruned"):
+            text += f"\n抜けた人の認証記録の削除: {state['pruned']}"
+        return text
+
+    async def show(self, force: bool = False):
+        if self.report is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.reported < SWEEP_REPORT_INTERVAL:
+            return
+        self.reported = now
+        try:
+            await self.report(self.progress())
+        except discord.HTTPException:
+            # インタラクションの期限（15 分）切れ。以降は /auth_sweep_status で見る
+            self.report = None
 
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
 
 # --------------------------
 # AuthCog
@@ -38,21 +324,99 @@ def save_json(path, data):
 class AuthCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.auth_codes = self.load_auth_codes()
-        self.start_flask()
+        self.auto_roles = storage.open("auto_roles", {})
+        self.auth_codes = AuthCodeStore(storage.open("auth_codes", {}), AUTH_CODE_TTL, AUTH_CODE_MAX)
+        # OAuth で認証できた人（"guild:member" -> unix 時刻）。/auth_sweep の判定に使う
+        self.verified = storage.open("auth_verified", {})
+        # 最初の /auth_sweep で、それまでのロール保持者を取り込み済みのギルド（guild_id -> unix 時刻）
+        self.verified_history = storage.open("auth_verified_history", {})
+        # /auth_sweep の進み具合（guild_id -> 状態）と、動いているもの（guild_id -> Task）
+        self.sweep_states = storage.open("auth_sweeps", {})
+        self.sweeps = {}
+        # ボタン認証で付与したロールの自動解除（"guild:member" -> {"deadline", "role"}）
+        self.expiry = DeadlineScheduler(
+            "auth_expiry", self.expire_roles, owns=self.owns_key, ready=self.bot.wait_until_ready
+        )
+        self.session = None
+        # トークン交換の統計
+        self.token_stats = {"requests": 0, "failures": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    async def cog_load(self):
+        # discord.com への接続を使い回す（毎回の TCP+TLS ハンドシェイクを避ける）
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=OAUTH_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=OAUTH_TIMEOUT),
+        )
+        # クラスタでは Web サーバーは 1 つだけ。他のワーカーのギルドは IPC で渡す
+        if cluster.primary:
+            server.add_route("GET", "/callback", self.callback)
+            await server.start()
+        if cluster.enabled:
+            cluster.bus.on("auth.callback", self.on_remote_callback)
+        self.purge_auth_codes.start()
+        self.expiry.start()
+        self.resume_task = asyncio.create_task(self.resume_sweeps())
+
+    async def cog_unload(self):
+        # 実行中の見直しは状態を running のまま残し、次の起動で続きから
+        self.resume_task.cancel()
+        for task in self.sweeps.values():
+            task.cancel()
+        self.expiry.stop()
+        self.purge_auth_codes.cancel()
+        if cluster.enabled:
+            cluster.bus.off("auth.callback")
+        server.remove_route("GET", "/callback")
+        if self.session:
+            await self.session.close()
+
+    @staticmethod
+    def owns_key(key: str) -> bool:
+        """ "guild:member" のギルドをこのワーカーが受け持っているか"""
+        return cluster.owns_guild(int(key.split(":")[0]))
 
     # ---------- データ管理 ----------
-    def load_auto_roles(self):
-        return load_json(AUTO_ROLES_PATH, {})
-
-    def save_auto_roles(self, data):
-        save_json(AUTO_ROLES_PATH, data)
-
-    def load_auth_codes(self):
-        return load_json(AUTH_CODES_PATH, {})
-
-    def save_auth_codes(self):
-        save_json(AUTH_CODES_PATH, self.auth_codes)
+    def save_auto_roles(self, guild_id: int):
+        storage.mark_dirty("auto_roles", str(guild_id))
+
+    @tasks.loop(seconds=60)
+    async def purge_auth_codes(self):
+        removed = self.auth_codes.purge()
+        if removed:
+            log.info("期限切れの認証コード %d 件を削除", removed)
+
+    # ---------- 認証未完了ロールの解除 ----------
+    async def expire_roles(self, batch):
+        async def expire(key, entry):
+            guild_id, member_id = map(int, key.split(":"))
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild.unavailable:
+                # 再接続直後・障害中でまだキャッシュに無い。捨てずに後でもう一度
+                self.retry_expiry(key, entry)
+                return
+            role = guild.get_role(int(entry["role"]))
+            if not role:
+                return
+            try:
+                member = await get_or_fetch_member(guild, member_id)
+                if role in member.roles:
+                    await outbound.run(
+                        AUTH, guild_id, lambda: member.remove_roles(role, reason="認証未完了のため自動解除")
+                    )
+                    log.info("%s に付与したロールを自動解除", member, extra={"guild": guild_id, "user": member_id})
+            except discord.HTTPException as e:
+                log.warning("ロール解除失敗: %s", e, extra={"guild": guild_id, "user": member_id})
+
+        await asyncio.gather(*(expire(key, entry) for key, entry in batch))
+
+    def retry_expiry(self, key: str, entry: dict):
+        data = {k: v for k, v in entry.items() if k != "deadline"}
+        due = data.setdefault("due", entry["deadline"])
+        if time.time() - due > EXPIRY_GIVE_UP:
+            # その間ずっと見つからない = Bot が抜けたギルド
+            log.info("ギルドが見つからないためロール解除を中止", extra={"guild": key.split(":")[0]})
+            return
+        self.expiry.schedule(key, time.time() + EXPIRY_RETRY_DELAY, **data)
 
     # ---------- OAuth URL ----------
     def make_oauth_url(self, user_id: int, guild_id: int) -> str:
@@ -71,7 +435,7 @@ class AuthCog(commands.Cog):
     @app_commands.command(name="auth_button", description="ボタンで認証")
     async def auth_button(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        role_id = self.load_auto_roles().get(str(interaction.guild.id))
+        role_id = self.auto_roles.get(str(interaction.guild.id))
         if not role_id:
             await interaction.followup.send("⚠️ このサーバーに認証後付与ロールが設定されていません", ephemeral=True)
             return
@@ -81,116 +445,313 @@ class AuthCog(commands.Cog):
             await interaction.followup.send("⚠️ ロールが見つかりません", ephemeral=True)
             return
 
+        cog = self
+
         class AuthView(View):
             def __init__(self):
                 super().__init__(timeout=None)
 
             @discord.ui.button(label="認証", style=discord.ButtonStyle.primary)
-            async def auth_button_inner(self, button: Button, btn_interaction: discord.Interaction):
+            async def auth_button_inner(self, btn_interaction: discord.Interaction, button: Button):
                 await btn_interaction.response.defer(ephemeral=True)
                 member = btn_interaction.user
-                await member.add_roles(role, reason="ボタン認証開始")
+                await outbound.run(
+                    AUTH, member.guild.id, lambda: member.add_roles(role, reason="ボタン認証開始")
+                )
                 await btn_interaction.followup.send(
-                    f"✅ 認証用ロールを付与しました。60秒以内に認証されない場合は解除されます",
+                    f"✅ 認証用ロールを付与しました。{AUTH_BUTTON_TIMEOUT}秒以内に認証されない場合は解除されます",
                     ephemeral=True
                 )
-                print(f"[auth_button] {member} にロール {role.name} 付与")
+                log.info(
+                    "%s にロール %s 付与", member, role.name,
+                    extra={"guild": member.guild.id, "user": member.id, "handler": "auth_button"},
+                )
 
-                await asyncio.sleep(60)
-                if role in member.roles:
-                    try:
-                        await member.remove_roles(role, reason="認証未完了のため自動解除")
-                        print(f"[auth_button] {member} に付与したロールを自動解除")
-                    except Exception as e:
-                        print(f"[auth_button] ロール解除失敗: {e}")
+                # 解除はスケジューラに任せて、ここではすぐ終わる
+                cog.expiry.schedule(
+                    f"{member.guild.id}:{member.id}",
+                    time.time() + AUTH_BUTTON_TIMEOUT,
+                    role=role.id,
+                )
 
         await interaction.followup.send("🔐 認証ボタンを押してください", view=AuthView(), ephemeral=True)
 
+    # ---------- トークン交換 ----------
+    async def exchange_token(self, code: str) -> dict:
+        """429 / 5xx は Retry-After か指数バックオフで OAUTH_MAX_RETRIES 回まで再試行"""
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": f"{REDIRECT_URI}/callback",
+        }
+        started = time.perf_counter()
+        self.token_stats["requests"] += 1
+        try:
+            for attempt in range(OAUTH_MAX_RETRIES + 1):
+                async with self.session.post(
+                    TOKEN_URL,
+                    data=data,
+                    headers={"Content-Type": "application/x-www-form-urlencoded"},
+                ) as resp:
+                    if resp.status != 429 and resp.status < 500:
+                        try:
+                            body = await resp.json(content_type=None)
+                        except ValueError:
+                            # プロキシのエラーページ（HTML）など
+                            return {"error": f"HTTP {resp.status}: JSON ではない応答"}
+                        return body if isinstance(body, dict) else {"error": f"HTTP {resp.status}: 不正な応答"}
+                    if attempt == OAUTH_MAX_RETRIES:
+                        return {"error": f"HTTP {resp.status}"}
+                    delay = retry_after_seconds(resp.headers.get("Retry-After"), 0.5 * 2 ** attempt)
+
+                self.token_stats["retries"] += 1
+                TOKEN_RETRIES.inc()
+                await asyncio.sleep(min(delay, 10.0))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {"error": repr(e)}
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            TOKEN_SECONDS.observe(elapsed / 1000)
+            self.token_stats["total_ms"] += elapsed
+            self.token_stats["max_ms"] = max(self.token_stats["max_ms"], elapsed)
+
     # ---------- OAuth 完了処理 ----------
     async def handle_oauth(self, code: str, user_id: int, guild_id: int):
-        async with aiohttp.ClientSession() as session:
-            token_resp = await session.post(
-                "https://discord.com/api/oauth2/token",
-                data={
-                    "client_id": CLIENT_ID,
-                    "client_secret": CLIENT_SECRET,
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": f"{REDIRECT_URI}/callback",
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-            )
-            token_data = await token_resp.json()
-            access_token = token_data.get("access_token")
-            if not access_token:
-                print(f"[handle_oauth] access_token取得失敗: {token_data}")
-                return
+        token_data = await self.exchange_token(code)
+        access_token = token_data.get("access_token")
+        if not access_token:
+            self.token_stats["failures"] += 1
+            TOKEN_FAILURES.inc()
+            log.warning("access_token取得失敗: %s", token_data, extra={"guild": guild_id, "user": user_id})
+            return False
 
         guild = self.bot.get_guild(guild_id)
         if not guild:
-            return
+            return False
         try:
-            member = await guild.fetch_member(user_id)
+            member = await get_or_fetch_member(guild, user_id)
         except discord.NotFound:
-            return
+            return False
 
-        role_id = self.load_auto_roles().get(str(guild_id))
+        role_id = self.auto_roles.get(str(guild_id))
         if not role_id:
-            return
+            return False
 
         role = guild.get_role(int(role_id))
         if not role:
-            return
+            return False
 
+        # 認証できたので自動解除を取り消す
+        self.expiry.cancel(f"{guild_id}:{user_id}")
         if role not in member.roles:
-            await member.add_roles(role, reason="OAuth認証完了")
-        print(f"[handle_oauth] {member} の認証完了、ロール維持/付与完了")
+            await outbound.run(AUTH, guild_id, lambda: member.add_roles(role, reason="OAuth認証完了"))
+        self.record_verified(guild_id, user_id)
+        log.info("%s の認証完了、ロール維持/付与完了", member, extra={"guild": guild_id, "user": user_id})
+        return True
 
     # ---------- 管理コマンド ----------
     @app_commands.command(name="set_auth_role", description="認証後に付与するロールを設定")
     async def set_auth_role(self, interaction: discord.Interaction, role: discord.Role):
         await interaction.response.defer(ephemeral=True)
-        data = self.load_auto_roles()
-        data[str(interaction.guild.id)] = str(role.id)
-        self.save_auto_roles(data)
+        self.auto_roles[str(interaction.guild.id)] = str(role.id)
+        self.save_auto_roles(interaction.guild.id)
         await interaction.followup.send(f"✅ 認証後ロールを **{role.name}** に設定しました", ephemeral=True)
-        print(f"[set_auth_role] ギルド {interaction.guild.id} にロール {role.id} 設定完了")
-
-    # ---------- Flask サーバー ----------
-    def start_flask(self):
-        app = Flask(__name__)
+        log.info(
+            "認証後ロールを %s に設定", role.id,
+            extra={"guild": interaction.guild.id, "user": interaction.user.id},
+        )
 
-        @app.route("/callback")
-        def callback():
-            code = request.args.get("code")
-            state = request.args.get("state")
-            if not code or not state:
-                return "❌ 認証に失敗しました"
+    # ---------- 認証済みの記録 ----------
+    def record_verified(self, guild_id: int, user_id: int):
+        key = f"{guild_id}:{user_id}"
+        self.verified[key] = int(time.time())
+        storage.mark_dirty("auth_verified", key)
+
+    def prune_verified(self, guild_id: int, seen, before: float, dry_run: bool = False) -> int:
+        """guild_id の記録のうち、seen にいない人の before より前の記録を消す（dry_run なら数えるだけ）"""
+        prefix = f"{guild_id}:"
+        stale = [
+            key for key, verified_at in self.verified.items()
+            if key.startswith(prefix) and verified_at < before and int(key[len(prefix):]) not in seen
+        ]
+        if not dry_run:
+            for key in stale:
+                del self.verified[key]
+                storage.mark_dirty("auth_verified", key)
+        return len(stale)
+
+    def has_verified_history(self, guild_id: int) -> bool:
+        return str(guild_id) in self.verified_history
+
+    def mark_verified_history(self, guild_id: int):
+        if not self.has_verified_history(guild_id):
+            self.verified_history[str(guild_id)] = int(time.time())
+            storage.mark_dirty("auth_verified_history", str(guild_id))
+
+    # ---------- 認証ロールの一括見直し ----------
+    def start_sweep(self, guild: discord.Guild, report=None):
+        sweep = AuthSweep(
+            self, guild, self.sweep_states[str(guild.id)],
+            AUTH_SWEEP_CONCURRENCY, AUTH_SWEEP_PAGE_SIZE, report,
+        )
+        task = asyncio.create_task(sweep.run())
+        self.sweeps[guild.id] = task
+        task.add_done_callback(lambda t: self.sweep_done(guild.id, t))
+        return sweep
+
+    def sweep_done(self, guild_id: int, task: asyncio.Task):
+        if self.sweeps.get(guild_id) is task:
+            del self.sweeps[guild_id]
+        if not task.cancelled() and task.exception() is not None:
+            log.error("認証ロールの見直しで例外", exc_info=task.exception(), extra={"guild": guild_id})
+
+    async def resume_sweeps(self):
+        await self.bot.wait_until_ready()
+        for guild_id, state in list(self.sweep_states.items()):
+            guild = self.bot.get_guild(int(guild_id))
+            if state["status"] != "running" or guild is None or guild.id in self.sweeps:
+                continue
+            log.info("認証ロールの見直しを再開 %s", AuthSweep.describe(state), extra={"guild": guild.id})
+            self.start_sweep(guild)
+
+    @app_commands.command(name="auth_sweep", description="メンバー全員の認証後ロールを認証記録に合わせる")
+    @app_commands.describe(
+        dry_run="変更せずに件数だけ数える",
+        remove_unverified="OAuth 認証の記録が無い人からロールを外す",
+        resume="中止・中断した見直しを前回の設定で再開する",
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    async def auth_sweep(
+        self,
+        interaction: discord.Interaction,
+        dry_run: bool = False,
+        remove_unverified: bool = False,
+        resume: bool = False,
+    ):
+        await interaction.response.defer(ephemeral=True)
+        guild = interaction.guild
+        if guild.id in self.sweeps:
+            state = self.sweep_states[str(guild.id)]
+            await interaction.followup.send("⚠️ 実行中です\n" + AuthSweep.describe(state), ephemeral=True)
+            return
 
-            try:
-                user_id_str, guild_id_str = state.split(":")
-                user_id = int(user_id_str)
-                guild_id = int(guild_id_str)
-            except:
-                return "❌ state 不正"
-
-            self.auth_codes[f"{user_id}:{guild_id}"] = code
-            self.save_auth_codes()
-
-            # 非同期タスクで Bot 側に通知
-            asyncio.run_coroutine_threadsafe(
-                self.handle_oauth(code, user_id, guild_id),
-                self.bot.loop
+        state = self.sweep_states.get(str(guild.id))
+        if not (resume and state and state["status"] in ("running", "cancelled")):
+            role_id = self.auto_roles.get(str(guild.id))
+            role = guild.get_role(int(role_id)) if role_id else None
+            if not role:
+                await interaction.followup.send("⚠️ このサーバーに認証後付与ロールが設定されていません", ephemeral=True)
+                return
+            if role >= guild.me.top_role:
+                await interaction.followup.send("⚠️ Bot より上のロールは付け外しできません", ephemeral=True)
+                return
+            state = AuthSweep.new_state(role.id, dry_run, remove_unverified)
+            self.sweep_states[str(guild.id)] = state
+
+        state["status"] = "running"
+        storage.mark_dirty("auth_sweeps", str(guild.id))
+        text = AuthSweep.describe(state)
+        if state["remove"] and not self.has_verified_history(guild.id):
+            text += (
+                "\nℹ️ 認証の記録はこの機能の追加後の分しか無いため、初回は今ロールを持っている人を"
+                "認証済みとして記録し、ロールは外しません。次回から記録の無い人を外します。"
             )
+        # 最初の応答を送ってから始める（進み具合の編集が先に届かないように）
+        await interaction.followup.send(text, ephemeral=True)
+        if guild.id in self.sweeps:
+            return
+        self.start_sweep(guild, report=lambda text: interaction.edit_original_response(content=text))
+        log.info(
+            "認証ロールの見直し開始 dry_run=%s remove=%s", state["dry_run"], state["remove"],
+            extra={"guild": guild.id, "user": interaction.user.id},
+        )
 
-            return "✅ 認証完了しました。Discordに戻ってください。"
-
-        def run_flask():
-            port = int(os.environ.get("PORT", 10000))
-            app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
+    @app_commands.command(name="auth_sweep_status", description="認証後ロールの見直しの進み具合")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def auth_sweep_status(self, interaction: discord.Interaction):
+        state = self.sweep_states.get(str(interaction.guild.id))
+        text = AuthSweep.describe(state) if state else "まだ実行していません"
+        await interaction.response.send_message(text, ephemeral=True)
+
+    @app_commands.command(name="auth_sweep_cancel", description="認証後ロールの見直しを中止")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def auth_sweep_cancel(self, interaction: discord.Interaction):
+        guild_id = interaction.guild.id
+        task = self.sweeps.get(guild_id)
+        if task is None:
+            await interaction.response.send_message("実行中の見直しはありません", ephemeral=True)
+            return
+        task.cancel()
+        state = self.sweep_states[str(guild_id)]
+        state["status"] = "cancelled"
+        storage.mark_dirty("auth_sweeps", str(guild_id))
+        await interaction.response.send_message(
+            "⏹️ 中止しました（`resume` で再開できます）\n" + AuthSweep.describe(state), ephemeral=True
+        )
 
-        threading.Thread(target=run_flask, daemon=True).start()
-        print("[Flask] OAuth callback サーバー起動")
+    # ---------- OAuth コールバック ----------
+    async def callback(self, request: web.Request):
+        started = time.perf_counter()
+        result, text = await self.process_callback(request)
+        CALLBACK_SECONDS.observe(time.perf_counter() - started, (result,))
+        return web.Response(text=text)
+
+    async def process_callback(self, request: web.Request):
+        """(結果の種類, 表示する文) を返す"""
+        code = request.query.get("code")
+        state = request.query.get("state")
+        if not code or not state:
+            return "bad_request", "❌ 認証に失敗しました"
+        return await self.complete_oauth(code, state)
+
+    def on_remote_callback(self, data, frame):
+        return self.complete_oauth(data["code"], data["state"])
+
+    async def complete_oauth(self, code: str, state: str):
+        """process_callback の本体。他のワーカーから IPC で渡されたときもここに来る"""
+        try:
+            user_id_str, guild_id_str = state.split(":")
+            user_id = int(user_id_str)
+            guild_id = int(guild_id_str)
+        except ValueError:
+            return "bad_request", "❌ state 不正"
+
+        if not cluster.owns_guild(guild_id):
+            # コード・ロール・自動解除の状態はギルドを受け持つワーカーにある
+            try:
+                result, text = await cluster.bus.request(
+                    cluster.worker_for_guild(guild_id),
+                    "auth.callback",
+                    {"code": code, "state": state},
+                    timeout=OAUTH_TIMEOUT * (OAUTH_MAX_RETRIES + 1) + 5,
+                )
+            # 転送先で例外が起きたときは応答が None（TypeError）になる
+            except (ConnectionError, asyncio.TimeoutError, TypeError) as e:
+                log.warning("ワーカーへの転送失敗: %r", e, extra={"guild": guild_id, "user": user_id})
+                return "failed", "❌ 認証に失敗しました"
+            return result, text
+
+        key = f"{user_id}:{guild_id}"
+        status = self.auth_codes.claim(key, code)
+        if status == "consumed":
+            return "duplicate", "✅ 認証済みです。Discordに戻ってください。"
+        if status == "pending":
+            return "duplicate", "⏳ 認証処理中です。しばらくお待ちください。"
+
+        # 同じループ上なのでロール付与まで待ってから返す
+        try:
+            ok = await self.handle_oauth(code, user_id, guild_id)
+        except (aiohttp.ClientError, discord.HTTPException, ValueError) as e:
+            log.warning("認証処理失敗: %s", e, extra={"guild": guild_id, "user": user_id})
+            ok = False
+        if not ok:
+            self.auth_codes.release(key)
+            return "failed", "❌ 認証に失敗しました"
+
+        self.auth_codes.consume(key)
+        return "ok", "✅ 認証完了しました。Discordに戻ってください。"
 
 
 # --------------------------
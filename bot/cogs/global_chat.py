@@ -1,67 +1,209 @@
-import json
-import os
 import discord
 from discord.ext import commands
 
-DATA_DIR = "data"
+from bot.config import (
+    GLOBAL_RELAY_CONCURRENCY,
+    GLOBAL_RELAY_MODE,
+    GLOBAL_RELAY_QUEUE_SIZE,
+    GLOBAL_RELAY_MERGE_LIMIT,
+    GLOBAL_RELAY_MAP_MB,
+    GLOBAL_RELAY_MAP_TTL,
+    GLOBAL_ATTACHMENT_MAX_MB,
+    GLOBAL_ATTACHMENT_TYPES,
+    GLOBAL_ATTACHMENT_SPOOL_KB,
+    GLOBAL_ATTACHMENT_RATE_MB,
+)
+from bot.relay import RelayEngine, RelayMessage
+from bot.attachments import AttachmentRelay
+from bot.storage import storage
+from bot.pipeline import pipeline, MessageContext, RELAY
+from bot.cluster import cluster
 
-def load(name, default):
-    path = os.path.join(DATA_DIR, f"{name}.json")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return default
+def parse_identifier(identifier):
+    """ "guild:channel" -> (guild_id, channel_id) """
+    tg, tc = identifier.split(":")
+    return int(tg), int(tc)
 
-def save(name, data):
-    with open(os.path.join(DATA_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-global_data = load("global", {})
+global_data = storage.open("global", {})
 
 class GlobalChatCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.attachments = AttachmentRelay(
+            max_bytes=int(GLOBAL_ATTACHMENT_MAX_MB * 1024 * 1024),
+            spool_bytes=GLOBAL_ATTACHMENT_SPOOL_KB * 1024,
+            types=[t.strip() for t in GLOBAL_ATTACHMENT_TYPES.split(",") if t.strip()],
+            rate=GLOBAL_ATTACHMENT_RATE_MB * 1024 * 1024,
+        )
+        self.relay = RelayEngine(
+            bot,
+            mode=GLOBAL_RELAY_MODE,
+            concurrency=GLOBAL_RELAY_CONCURRENCY,
+            queue_size=GLOBAL_RELAY_QUEUE_SIZE,
+            merge_limit=GLOBAL_RELAY_MERGE_LIMIT,
+            map_bytes=int(GLOBAL_RELAY_MAP_MB * 1024 * 1024),
+            map_ttl=GLOBAL_RELAY_MAP_TTL,
+            attachments=self.attachments,
+        )
+        # (guild_id, channel_id) -> ネットワーク名
+        self.channel_index = {}
+        # (guild_id, channel_id) -> 中継先 (guild_id, channel_id) のタプル
+        self.routes = {}
+        self.rebuild_index()
+
+    # ===============================
+    # 逆引きインデックス
+    # ===============================
+    def rebuild_index(self):
+        members = {}
+        channel_index = {}
+        for name, chans in global_data.items():
+            keys = members.setdefault(name, [])
+            for identifier in chans:
+                try:
+                    key = parse_identifier(identifier)
+                except ValueError:
+                    continue
+                keys.append(key)
+                channel_index.setdefault(key, name)
+
+        routes = {}
+        for name, keys in members.items():
+            for key in keys:
+                targets = routes.setdefault(key, [])
+                for target in keys:
+                    if target != key and target not in targets:
+                        targets.append(target)
+
+        self.channel_index = channel_index
+        self.routes = {key: tuple(targets) for key, targets in routes.items()}
+
+    def on_global_changed(self, keys):
+        # 他のワーカーで /global_join などがあった
+        self.rebuild_index()
+
+    async def cog_load(self):
+        pipeline.register(RELAY, "global_chat", self.relay_message, self.applies)
+        storage.watch("global", self.on_global_changed)
+        if cluster.enabled:
+            cluster.bus.on("global.relay", self.on_remote_relay)
+            # コピーは各ワーカーが自分のチャンネルの分だけ覚えている
+            cluster.bus.on("global.edit", lambda data, frame: self.relay.edit_copies(**data))
+            cluster.bus.on("global.delete", lambda data, frame: self.relay.delete_copies(data["sources"]))
+
+    async def cog_unload(self):
+        pipeline.unregister("global_chat")
+        storage.unwatch("global", self.on_global_changed)
+        if cluster.enabled:
+            for op in ("global.relay", "global.edit", "global.delete"):
+                cluster.bus.off(op)
+        self.relay.close()
+        await self.attachments.close()
 
     # ===============================
     # メッセージ中継
     # ===============================
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
+    def applies(self, ctx: MessageContext) -> bool:
+        return (ctx.guild_id, ctx.channel_id) in self.routes
+
+    async def relay_message(self, ctx: MessageContext):
+        message = ctx.message
+        targets = self.routes.get((ctx.guild_id, ctx.channel_id))
+        if not targets:
             return
 
-        identifier = f"{message.guild.id}:{message.channel.id}"
+        local, remote = [], {}
+        for tg, tc in targets:
+            if cluster.owns_guild(tg):
+                local.append(tc)
+            else:
+                remote.setdefault(cluster.worker_for_guild(tg), []).append(tc)
 
-        for name, chans in global_data.items():
-            if identifier not in chans:
-                continue
+        item = RelayMessage(
+            username=f"{message.author.display_name}@{message.guild.name}",
+            avatar_url=message.author.display_avatar.url,
+            content=ctx.content,
+            source_id=message.id,
+        )
 
-            for target in chans:
-                if target == identifier:
-                    continue
+        # 他のワーカーが持っているチャンネルは、ワーカーごとに 1 回でまとめて渡す（添付はリンクで）
+        if remote:
+            remote_item = item._replace(links=tuple(attachment.url for attachment in message.attachments))
+            if remote_item.content or remote_item.links:
+                for worker_id, channel_ids in remote.items():
+                    cluster.bus.send(worker_id, "global.relay", {"channels": channel_ids, "item": remote_item})
 
-                tg, tc = map(int, target.split(":"))
-                guild = self.bot.get_guild(tg)
-                if not guild:
-                    continue
+        if not local:
+            return
+        if ctx.has_attachments:
+            # 1 回だけダウンロードして全中継先で使い回す。送れないものはリンクにする
+            network = self.channel_index.get((ctx.guild_id, ctx.channel_id))
+            files, links = await self.attachments.prepare(network, message.attachments, len(local))
+            item = item._replace(links=tuple(links), files=files)
+        if not item.content and not item.files and not item.links:
+            return
 
-                channel = guild.get_channel(tc)
-                if not channel:
-                    continue
+        # 中継先ごとのキューに積むだけなので、遅いサーバーがあっても待たない
+        for tc in local:
+            self.relay.submit(tc, item)
 
-                await channel.send(
-                    f"**{message.author.display_name}@{message.guild.name}**\n"
-                    f"{message.content}"
-                )
+    def on_remote_relay(self, data, frame):
+        item = RelayMessage(*data["item"])
+        for tc in data["channels"]:
+            self.relay.submit(tc, item)
+
+    # ===============================
+    # 編集・削除の反映（キャッシュに無いメッセージも拾えるよう raw イベントで受ける）
+    # ===============================
+    def is_relayed(self, guild_id, channel_id) -> bool:
+        return guild_id is not None and (guild_id, channel_id) in self.routes
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if not self.is_relayed(payload.guild_id, payload.channel_id):
+            return
+        data = payload.data
+        # 埋め込みの展開だけの更新（edited_timestamp が無い）や Bot・Webhook の投稿は無視
+        if "content" not in data or not data.get("edited_timestamp"):
+            return
+        author = data.get("author") or {}
+        if author.get("bot") or data.get("webhook_id"):
+            return
+
+        guild = self.bot.get_guild(payload.guild_id)
+        name = (data.get("member") or {}).get("nick") or author.get("global_name") or author.get("username")
+        edit = {
+            "source_id": payload.message_id,
+            "username": f"{name}@{guild.name if guild else ''}",
+            "content": data["content"],
+        }
+        if cluster.enabled:
+            cluster.bus.send("*", "global.edit", edit)
+        await self.relay.edit_copies(**edit)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if self.is_relayed(payload.guild_id, payload.channel_id):
+            await self.delete_copies([payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if self.is_relayed(payload.guild_id, payload.channel_id):
+            await self.delete_copies(list(payload.message_ids))
+
+    async def delete_copies(self, source_ids):
+        if cluster.enabled:
+            cluster.bus.send("*", "global.delete", {"sources": source_ids})
+        await self.relay.delete_copies(source_ids)
 
     # ===============================
     # /global_create
     # ===============================
     @discord.app_commands.command(name="global_create")
     async def global_create(self, interaction: discord.Interaction, name: str):
-        if name not in global_data:
-            global_data[name] = []
-            save("global", global_data)
+        # 他のワーカーでの同時の変更を上書きしないよう、値ではなく操作で変更する
+        if storage.change("global", name, "create"):
+            self.rebuild_index()
 
         await interaction.response.send_message(
             "✅ グローバルチャットを作成しました",
@@ -74,16 +216,49 @@ class GlobalChatCog(commands.Cog):
     @discord.app_commands.command(name="global_join")
     async def global_join(self, interaction: discord.Interaction, name: str):
         identifier = f"{interaction.guild.id}:{interaction.channel.id}"
-        chans = global_data.setdefault(name, [])
-
-        if identifier not in chans:
-            chans.append(identifier)
-            save("global", global_data)
+        if storage.change("global", name, "add", identifier):
+            self.rebuild_index()
 
         await interaction.response.send_message(
             "✅ グローバルチャットに参加しました",
             ephemeral=True
         )
 
+    # ===============================
+    # /global_stats
+    # ===============================
+    @discord.app_commands.command(name="global_stats")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def global_stats(self, interaction: discord.Interaction):
+        stats = self.relay.stats()
+        total = {"depth": 0, "sent": 0, "merged": 0, "dropped": 0, "failed": 0}
+        for s in stats.values():
+            for k in total:
+                total[k] += s[k]
+
+        backlog = sorted(stats.items(), key=lambda kv: kv[1]["depth"], reverse=True)[:5]
+        lines = [
+            f"中継先: {len(stats)} / 送信: {total['sent']} / まとめ: {total['merged']}",
+            f"キュー: {total['depth']} / 破棄: {total['dropped']} / 失敗: {total['failed']}",
+        ]
+        copies = self.relay.copy_stats()
+        lines.append(
+            f"記録中: {copies['sources']} 件 ({copies['bytes'] / 1024:.0f}KB) / "
+            f"編集反映: {copies['edited']} / 削除反映: {copies['deleted']}"
+        )
+        files = self.attachments.stats()
+        lines.append(
+            f"添付: 取得 {files['downloaded_bytes'] / 1048576:.1f}MB / "
+            f"送信 {files['uploaded_bytes'] / 1048576:.1f}MB / "
+            f"リンク {files['linked']} 件 ({files['linked_bytes'] / 1048576:.1f}MB) / "
+            f"制限 {files['rate_limited']}"
+        )
+        lines += [
+            f"<#{cid}> キュー {s['depth']} 破棄 {s['dropped']}"
+            for cid, s in backlog if s["depth"] or s["dropped"]
+        ]
+
+        await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(GlobalChatCog(bot))
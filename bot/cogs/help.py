@@ -1,66 +1,168 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
+from discord.ui import View, Button
 
+TITLE = "📘 Bot コマンド一覧"
+DESCRIPTION = "このBotで使用できるコマンド一覧です"
+FOOTER = "Avanzare Mk.2"
+COLOR = 0x5865F2
+
+# 埋め込みの上限（フィールド数・フィールドの値）。全体の 6000 文字はフッター分を残して数える
+MAX_FIELDS = 25
+MAX_FIELD_VALUE = 1024
+MAX_EMBED_CHARS = 5800
+
+# Cog ごとの見出し（この順に並べる）。無い Cog はクラス名で後ろに
+COG_TITLES = {
+    "AuthCog": "🔐 認証",
+    "RolePanelCog": "🎭 ロールパネル",
+    "TicketCog": "🎫 チケット",
+    "GlobalChatCog": "🌐 グローバルチャット",
+    "InviteWatch": "🛡️ 招待リンク・URL 監視",
+    "HelpCog": "📘 ヘルプ",
+}
+# コマンド以外の操作（ボタンなど）の説明
+COG_NOTES = {
+    "TicketCog": ["🎟️ ボタンでチケット作成", "❌ ボタンでチケットを閉じる"],
+}
+OTHER_TITLE = "📎 その他"
+
+
+# --------------------------
+# ページ送り
+# --------------------------
+class HelpPages(View):
+    def __init__(self, pages):
+        super().__init__(timeout=180)
+        self.pages = pages
+        self.index = 0
+        self.update()
+
+    def update(self):
+        self.prev_page.disabled = self.index == 0
+        self.next_page.disabled = self.index == len(self.pages) - 1
+
+    async def show(self, interaction: discord.Interaction, index: int):
+        self.index = index
+        self.update()
+        await interaction.response.edit_message(embed=self.pages[index], view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        await self.show(interaction, self.index - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        await self.show(interaction, self.index + 1)
+
+
+# --------------------------
+# HelpCog
+# --------------------------
 class HelpCog(commands.Cog):
+    """
+    /help の中身を bot.tree から作る。
+
+    (ロケール, 管理者か) ごとに 1 回だけ作って持っておき、呼び出しは辞書を引くだけ。
+    拡張のロード・アンロードやコマンド同期のときに "help_invalidate" イベントで作り直す。
+    """
+
     def __init__(self, bot):
         self.bot = bot
+        # (locale, admin) -> [Embed, ...]
+        self.cache = {}
+
+    @commands.Cog.listener()
+    async def on_help_invalidate(self):
+        self.cache.clear()
+
+    # ---------- 作成 ----------
+    @staticmethod
+    def visible(command: app_commands.Command, admin: bool) -> bool:
+        # 権限チェック付きのコマンドは管理者にだけ見せる
+        return admin or not (command.checks or command.default_permissions)
+
+    async def describe(self, command: app_commands.Command, locale: discord.Locale) -> str:
+        description = command.description
+        translator = self.bot.tree.translator
+        if translator is not None:
+            context = app_commands.TranslationContext(
+                app_commands.TranslationContextLocation.command_description, command
+            )
+            description = await translator.translate(
+                app_commands.locale_str(description), locale, context
+            ) or description
+        line = f"`/{command.qualified_name}`"
+        # 説明の無いコマンドは discord.py が "…" を入れる
+        if description and description != "…":
+            line += f" - {description}"
+        return line
+
+    async def sections(self, locale: discord.Locale, admin: bool):
+        """[(見出し, [行, ...]), ...] を Cog ごとに"""
+        by_cog = {}
+        for command in self.bot.tree.walk_commands():
+            if isinstance(command, app_commands.Group) or not self.visible(command, admin):
+                continue
+            cog = type(command.binding).__name__ if command.binding is not None else None
+            by_cog.setdefault(cog, []).append(await self.describe(command, locale))
+
+        order = list(COG_TITLES) + sorted(c for c in by_cog if c not in COG_TITLES and c is not None) + [None]
+        sections = []
+        for cog in order:
+            lines = by_cog.get(cog)
+            if not lines:
+                continue
+            lines.sort()
+            lines += COG_NOTES.get(cog, [])
+            sections.append((COG_TITLES.get(cog, cog or OTHER_TITLE), lines))
+        return sections
 
+    @staticmethod
+    def fields(title: str, lines):
+        """1 フィールドの上限を超える分は「（続き）」のフィールドに分ける"""
+        chunk, size, name = [], 0, title
+        for line in lines:
+            line = line[:MAX_FIELD_VALUE]
+            if chunk and size + len(line) + 1 > MAX_FIELD_VALUE:
+                yield name, "\n".join(chunk)
+                chunk, size, name = [], 0, f"{title}（続き）"
+            chunk.append(line)
+            size += len(line) + 1
+        if chunk:
+            yield name, "\n".join(chunk)
+
+    @staticmethod
+    def new_page() -> discord.Embed:
+        return discord.Embed(title=TITLE, description=DESCRIPTION, color=COLOR)
+
+    async def build(self, locale: discord.Locale, admin: bool):
+        pages = [self.new_page()]
+        for title, lines in await self.sections(locale, admin):
+            for name, value in self.fields(title, lines):
+                page = pages[-1]
+                if len(page.fields) >= MAX_FIELDS or len(page) + len(name) + len(value) > MAX_EMBED_CHARS:
+                    page = self.new_page()
+                    pages.append(page)
+                page.add_field(name=name, value=value, inline=False)
+
+        for i, page in enumerate(pages, 1):
+            page.set_footer(text=FOOTER if len(pages) == 1 else f"{FOOTER} ・ {i}/{len(pages)}")
+        return pages
+
+    # ---------- /help ----------
     @discord.app_commands.command(name="help", description="Botのコマンド一覧を表示します")
     async def help(self, interaction: discord.Interaction):
-        embed = discord.Embed(
-            title="📘 Bot コマンド一覧",
-            description="このBotで使用できるコマンド一覧です",
-            color=0x5865F2
-        )
-
-        # ===== 認証 =====
-        embed.add_field(
-            name="🔐 認証",
-            value=(
-                "`/auth` - 認証ボタンを表示\n"
-                "`/verify` - 認証を実行\n"
-                "`/set_auth_role` - 認証後に付与するロールを設定"
-            ),
-            inline=False
-        )
-
-        # ===== ロールパネル =====
-        embed.add_field(
-            name="🎭 ロールパネル",
-            value=(
-                "`/role_panel_create` - ロールパネルを作成\n"
-                "`/role_panel_add` - ロールを追加\n"
-                "`/role_panel_remove` - ロールを削除\n"
-                "`/role_panel_toggle` - ロールのON/OFF切り替え"
-            ),
-            inline=False
-        )
-
-        # ===== チケット =====
-        embed.add_field(
-            name="🎫 チケット",
-            value=(
-                "`/ticket_create` - チケットパネル作成\n"
-                "`/ticket_setup` - チケット設定\n"
-                "🎟️ ボタンでチケット作成\n"
-                "❌ ボタンでチケットを閉じる"
-            ),
-            inline=False
-        )
-
-        # ===== グローバルチャット =====
-        embed.add_field(
-            name="🌐 グローバルチャット",
-            value=(
-                "`/global_create` - グローバルチャット作成\n"
-                "`/global_join` - チャンネルを参加させる"
-            ),
-            inline=False
-        )
-
-        embed.set_footer(text="Avanzare Mk.2")
-
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        key = (interaction.locale, interaction.permissions.administrator)
+        pages = self.cache.get(key)
+        if pages is None:
+            pages = self.cache[key] = await self.build(*key)
+
+        if len(pages) == 1:
+            await interaction.response.send_message(embed=pages[0], ephemeral=True)
+        else:
+            await interaction.response.send_message(embed=pages[0], view=HelpPages(pages), ephemeral=True)
 
 async def setup(bot):
     await bot.add_cog(HelpCog(bot))
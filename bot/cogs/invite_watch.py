@@ -1,62 +1,266 @@
-import re, json, os
+import time
+import asyncio
 from datetime import datetime, timezone, timedelta
 import discord
 from discord.ext import commands
 
-DATA_DIR = "data"
-INVITE_REGEX = r"(discord\.gg|discord\.com\/invite)\/\S+"
-URL_REGEX = r"https?://[^\s]+"
+from bot.storage import storage
+from bot.pipeline import pipeline, MessageContext, MODERATION
+from bot.linkscan import scan, match_domain
+from bot.outbound import outbound, OutboundShed, MODERATION as REST_MODERATION
+from bot.metrics import registry
+from bot.log import get_logger
+from bot.config import (
+    MODERATION_WINDOW,
+    MODERATION_TIMEOUT_MINUTES,
+    MODERATION_DM_RATE,
+    MODERATION_DM_BURST,
+)
 
-def load(name, d):
-    p = f"{DATA_DIR}/{name}.json"
-    return json.load(open(p,"r",encoding="utf-8")) if os.path.exists(p) else d
+log = get_logger("invite_watch")
 
-def save(name, d):
-    json.dump(d, open(f"{DATA_DIR}/{name}.json","w",encoding="utf-8"),
-              indent=2, ensure_ascii=False)
+# ModerationActions.counters と同じもの（deleted / delete_calls / timeouts / ... の別）
+ACTIONS = registry.counter("hunya_moderation_actions_total", "招待リンク・URL 監視の操作", ("action",))
 
-invite_cfg = load("invite", {})
+invite_cfg = storage.open("invite", {})
+
+def default_cfg():
+    return {"enabled": False, "ignore": [], "url_watch": False, "allow": [], "block": []}
+
+# ===============================
+# ギルドごとの判定用データ（メッセージごとに作らない）
+# ===============================
+class GuildRules:
+    __slots__ = ("enabled", "url_watch", "ignore", "allow", "block")
+
+    def __init__(self, cfg: dict):
+        self.enabled = cfg.get("enabled", False)
+        self.url_watch = cfg.get("url_watch", False)
+        self.ignore = frozenset(cfg.get("ignore", ()))
+        self.allow = frozenset(cfg.get("allow", ()))
+        self.block = frozenset(cfg.get("block", ()))
+
+    @property
+    def active(self) -> bool:
+        return self.enabled or self.url_watch or bool(self.block)
+
+# ===============================
+# レート制御
+# ===============================
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# ===============================
+# モデレーション操作のまとめ役
+# ===============================
+class ModerationActions:
+    """
+    荒らしのときに REST を使い切らないよう、操作をまとめる。
+
+    - 削除: チャンネルごとに window 秒ためて、一括削除 1 回
+    - タイムアウト: 同じユーザーにはタイムアウト中にもう一度かけない
+    - 警告 DM: ギルドごとのトークンバケット + 同じユーザーには window 中 1 回
+    """
+
+    def __init__(self, window: float, timeout_minutes: int, dm_rate: float, dm_burst: int):
+        self.window = window
+        self.timeout_minutes = timeout_minutes
+        self.dm_rate = dm_rate
+        self.dm_burst = dm_burst
+        self.pending = {}      # channel_id -> (channel, [message_id, ...])
+        self.timed_out = {}    # (guild_id, user_id) -> タイムアウトが切れる monotonic 時刻
+        self.warned = {}       # (guild_id, user_id) -> 次に DM してよい monotonic 時刻
+        self.dm_buckets = {}   # guild_id -> TokenBucket
+        self.tasks = set()
+        self.counters = {
+            "deleted": 0,
+            "delete_calls": 0,
+            "timeouts": 0,
+            "timeouts_suppressed": 0,
+            "dms": 0,
+            "dms_suppressed": 0,
+            "failures": 0,
+        }
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+        ACTIONS.inc(amount, (name,))
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # ---------- 削除 ----------
+    def delete(self, message: discord.Message):
+        entry = self.pending.get(message.channel.id)
+        if entry is None:
+            entry = self.pending[message.channel.id] = (message.channel, [])
+            self.spawn(self.flush_later(message.channel.id))
+        entry[1].append(message.id)
+
+    async def flush_later(self, channel_id: int):
+        await asyncio.sleep(self.window)
+        channel, ids = self.pending.pop(channel_id)
+        # 一括削除は 1 回 100 件まで
+        for i in range(0, len(ids), 100):
+            chunk = ids[i:i + 100]
+            if len(chunk) == 1:
+                func = channel.get_partial_message(chunk[0]).delete
+            else:
+                objects = [discord.Object(id=m) for m in chunk]
+                func = lambda objects=objects: channel.delete_messages(objects)
+            if await self.call(channel.guild.id, func):
+                self.count("delete_calls")
+                self.count("deleted", len(chunk))
+
+    # ---------- タイムアウト ----------
+    def timeout(self, member: discord.Member, reason: str):
+        key = (member.guild.id, member.id)
+        now = time.monotonic()
+        if self.timed_out.get(key, 0) > now:
+            self.count("timeouts_suppressed")
+            return
+        self.prune(self.timed_out, now)
+        self.timed_out[key] = now + self.timeout_minutes * 60
+        self.count("timeouts")
+
+        until = datetime.now(timezone.utc) + timedelta(minutes=self.timeout_minutes)
+        self.spawn(self.call(member.guild.id, lambda: member.timeout(until, reason=reason)))
+
+    # ---------- 警告 DM ----------
+    def warn(self, member: discord.Member, text: str):
+        key = (member.guild.id, member.id)
+        now = time.monotonic()
+        bucket = self.dm_buckets.get(member.guild.id)
+        if bucket is None:
+            bucket = self.dm_buckets[member.guild.id] = TokenBucket(self.dm_rate, self.dm_burst)
+        if self.warned.get(key, 0) > now or not bucket.take():
+            self.count("dms_suppressed")
+            return
+        self.prune(self.warned, now)
+        self.warned[key] = now + self.window
+        self.count("dms")
+        self.spawn(self.call(member.guild.id, lambda: member.send(text)))
+
+    async def call(self, guild_id: int, func) -> bool:
+        # 他の Cog の送信より優先して流す
+        try:
+            await outbound.run(REST_MODERATION, guild_id, func)
+            return True
+        except (discord.HTTPException, OutboundShed) as e:
+            self.count("failures")
+            log.warning("操作失敗: %s", e, extra={"guild": guild_id})
+            return False
+
+    def prune(self, table: dict, now: float):
+        # 大きくなったときだけ期限切れを掃除する
+        if len(table) > 10000:
+            for key in [k for k, until in table.items() if until <= now]:
+                del table[key]
+
+    def stats(self):
+        return dict(self.counters, pending_channels=len(self.pending))
 
 class InviteWatch(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # guild_id(int) -> GuildRules（何か有効なギルドだけ）
+        self.rules = {}
+        self.actions = ModerationActions(
+            MODERATION_WINDOW,
+            MODERATION_TIMEOUT_MINUTES,
+            MODERATION_DM_RATE,
+            MODERATION_DM_BURST,
+        )
+        for gid, cfg in invite_cfg.items():
+            self.refresh(int(gid), cfg)
+
+    def refresh(self, guild_id: int, cfg: dict):
+        rules = GuildRules(cfg)
+        if rules.active:
+            self.rules[guild_id] = rules
+        else:
+            self.rules.pop(guild_id, None)
+
+    def update_cfg(self, guild_id: int):
+        """コマンド用。設定を取り出し、変更後に save_cfg() を呼ぶ"""
+        cfg = invite_cfg.setdefault(str(guild_id), default_cfg())
+        for key, value in default_cfg().items():
+            cfg.setdefault(key, value)
+        return cfg
+
+    def save_cfg(self, guild_id: int):
+        self.refresh(guild_id, invite_cfg[str(guild_id)])
+        storage.mark_dirty("invite", str(guild_id))
+
+    async def cog_load(self):
+        pipeline.register(MODERATION, "invite_watch", self.moderate, self.applies)
+
+    async def cog_unload(self):
+        pipeline.unregister("invite_watch")
 
     # ===== メッセージ監視 =====
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
-            return
+    def applies(self, ctx: MessageContext) -> bool:
+        # 監視を有効にしていないギルドは飛ばす
+        return ctx.guild_id in self.rules
 
-        gid = str(message.guild.id)
-        cfg = invite_cfg.setdefault(
-            gid, {"enabled": False, "ignore": [], "url_watch": False}
-        )
+    async def moderate(self, ctx: MessageContext) -> bool:
+        message = ctx.message
+        rules = self.rules[ctx.guild_id]
 
         # 例外チャンネル
-        if message.channel.id in cfg["ignore"]:
-            return
+        if ctx.channel_id in rules.ignore:
+            return False
+
+        result = scan(ctx.content)
 
         # 招待リンク監視
-        if cfg["enabled"] and re.search(INVITE_REGEX, message.content):
-            await message.delete()
-            until = datetime.now(timezone.utc) + timedelta(minutes=10)
-            await message.author.timeout(until, reason="招待リンク送信")
+        if rules.enabled and result.invites:
+            self.actions.delete(message)
+            ctx.deleted = True
+            self.actions.timeout(message.author, "招待リンク送信")
+            log.debug("招待リンクを削除", extra={"guild": ctx.guild_id, "channel": ctx.channel_id, "user": ctx.author_id})
+            return True
 
-        # URL監視
-        elif cfg["url_watch"] and re.search(URL_REGEX, message.content):
-            await message.delete()
-            await message.author.send("このチャンネルではURLは禁止されています")
+        # URL監視（許可ドメインは除外、禁止ドメインは URL監視が OFF でも削除）
+        # 招待リンク監視が OFF なら、scheme 付きの招待リンクも普通の URL として扱う
+        urls = result.urls if rules.enabled else result.invite_urls + result.urls
+        for host in urls:
+            if match_domain(host, rules.block) or (
+                rules.url_watch and not match_domain(host, rules.allow)
+            ):
+                self.actions.delete(message)
+                ctx.deleted = True
+                self.actions.warn(message.author, "このチャンネルではURLは禁止されています")
+                log.debug(
+                    "URL を削除 %s", host,
+                    extra={"guild": ctx.guild_id, "channel": ctx.channel_id, "user": ctx.author_id},
+                )
+                return True
+
+        return False
 
     # ===== 招待リンク ON/OFF =====
     @discord.app_commands.command(name="invite_watch")
     @discord.app_commands.checks.has_permissions(administrator=True)
     async def invite_watch(self, interaction: discord.Interaction, enabled: bool):
-        cfg = invite_cfg.setdefault(
-            str(interaction.guild.id),
-            {"enabled": False, "ignore": [], "url_watch": False}
-        )
+        cfg = self.update_cfg(interaction.guild.id)
         cfg["enabled"] = enabled
-        save("invite", invite_cfg)
+        self.save_cfg(interaction.guild.id)
         await interaction.response.send_message(
             f"招待リンク監視を {'有効' if enabled else '無効'} にしました",
             ephemeral=True
@@ -66,12 +270,9 @@ class InviteWatch(commands.Cog):
     @discord.app_commands.command(name="url_watch")
     @discord.app_commands.checks.has_permissions(administrator=True)
     async def url_watch(self, interaction: discord.Interaction, enabled: bool):
-        cfg = invite_cfg.setdefault(
-            str(interaction.guild.id),
-            {"enabled": False, "ignore": [], "url_watch": False}
-        )
+        cfg = self.update_cfg(interaction.guild.id)
         cfg["url_watch"] = enabled
-        save("invite", invite_cfg)
+        self.save_cfg(interaction.guild.id)
         await interaction.response.send_message(
             f"URL監視を {'有効' if enabled else '無効'} にしました",
             ephemeral=True
@@ -83,13 +284,10 @@ class InviteWatch(commands.Cog):
     async def invite_ignore_add(
         self, interaction: discord.Interaction, channel: discord.TextChannel
     ):
-        cfg = invite_cfg.setdefault(
-            str(interaction.guild.id),
-            {"enabled": False, "ignore": [], "url_watch": False}
-        )
+        cfg = self.update_cfg(interaction.guild.id)
         if channel.id not in cfg["ignore"]:
             cfg["ignore"].append(channel.id)
-        save("invite", invite_cfg)
+        self.save_cfg(interaction.guild.id)
         await interaction.response.send_message(
             f"{channel.mention} を例外チャンネルに追加しました",
             ephemeral=True
@@ -101,17 +299,50 @@ class InviteWatch(commands.Cog):
     async def invite_ignore_remove(
         self, interaction: discord.Interaction, channel: discord.TextChannel
     ):
-        cfg = invite_cfg.setdefault(
-            str(interaction.guild.id),
-            {"enabled": False, "ignore": [], "url_watch": False}
-        )
+        cfg = self.update_cfg(interaction.guild.id)
         if channel.id in cfg["ignore"]:
             cfg["ignore"].remove(channel.id)
-        save("invite", invite_cfg)
+        self.save_cfg(interaction.guild.id)
         await interaction.response.send_message(
             f"{channel.mention} を監視対象に戻しました",
             ephemeral=True
         )
 
+    # ===== 許可・禁止ドメイン =====
+    async def edit_domains(self, interaction: discord.Interaction, kind: str, domain: str, add: bool):
+        domain = domain.strip().lower().removeprefix("www.")
+        cfg = self.update_cfg(interaction.guild.id)
+        if add and domain not in cfg[kind]:
+            cfg[kind].append(domain)
+        elif not add and domain in cfg[kind]:
+            cfg[kind].remove(domain)
+        self.save_cfg(interaction.guild.id)
+
+        label = "許可" if kind == "allow" else "禁止"
+        await interaction.response.send_message(
+            f"`{domain}` を{label}ドメイン{'に追加' if add else 'から削除'}しました",
+            ephemeral=True
+        )
+
+    @discord.app_commands.command(name="url_allow_add")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def url_allow_add(self, interaction: discord.Interaction, domain: str):
+        await self.edit_domains(interaction, "allow", domain, True)
+
+    @discord.app_commands.command(name="url_allow_remove")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def url_allow_remove(self, interaction: discord.Interaction, domain: str):
+        await self.edit_domains(interaction, "allow", domain, False)
+
+    @discord.app_commands.command(name="url_block_add")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def url_block_add(self, interaction: discord.Interaction, domain: str):
+        await self.edit_domains(interaction, "block", domain, True)
+
+    @discord.app_commands.command(name="url_block_remove")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def url_block_remove(self, interaction: discord.Interaction, domain: str):
+        await self.edit_domains(interaction, "block", domain, False)
+
 async def setup(bot):
     await bot.add_cog(InviteWatch(bot))
@@ -0,0 +1,21 @@
+import discord
+from discord.ext import commands
+
+from bot.pipeline import pipeline
+
+class MessagePipelineCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    # ===============================
+    # 全 Cog 共通の on_message
+    # ===============================
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        # Bot・DM はここで 1 回だけ弾く
+        if message.author.bot or not message.guild:
+            return
+        await pipeline.dispatch(message)
+
+async def setup(bot):
+    await bot.add_cog(MessagePipelineCog(bot))
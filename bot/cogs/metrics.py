@@ -0,0 +1,113 @@
+import time
+import asyncio
+import discord
+from discord import app_commands
+from discord.ext import commands
+from aiohttp import web
+
+from bot.config import METRICS_HOST, METRICS_PORT
+from bot.metrics import registry
+from bot.web import WebServer
+from bot.cache import rss_bytes
+from bot.cluster import cluster
+
+LAG_INTERVAL = 0.5  # イベントループ遅延の計測間隔（秒）
+
+APP_COMMAND_SECONDS = registry.histogram(
+    "hunya_app_command_seconds", "スラッシュコマンドの処理時間（ハンドラの開始から終了まで）", ("command", "outcome")
+)
+LOOP_LAG = registry.histogram("hunya_event_loop_lag_seconds", "イベントループの遅延")
+
+class MetricsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # クラスタではワーカーごとに別のポート（METRICS_PORT + ワーカー番号）
+        port = METRICS_PORT + (cluster.worker_id or 0) if METRICS_PORT else 0
+        self.server = WebServer(METRICS_HOST, port, access_log=False)
+        self.lag_task = None
+        self.tree_hooks = None  # 差し替える前の (interaction_check, on_error)
+
+        registry.gauge("hunya_gateway_latency_seconds", "Gateway のレイテンシ", callback=self.gateway_latency)
+        registry.gauge("hunya_guilds", "参加しているギルド数", callback=lambda: len(self.bot.guilds))
+        registry.gauge("hunya_cached_users", "キャッシュ中のユーザー数", callback=lambda: len(self.bot.users))
+        registry.gauge(
+            "hunya_cached_members",
+            "キャッシュ中のメンバー数",
+            callback=lambda: sum(len(g.members) for g in self.bot.guilds),
+        )
+        registry.gauge(
+            "hunya_cached_messages", "キャッシュ中のメッセージ数",
+            callback=lambda: len(self.bot.cached_messages),
+        )
+        registry.gauge("hunya_resident_memory_bytes", "プロセスの常駐メモリ", callback=rss_bytes)
+
+    async def cog_load(self):
+        self.lag_task = asyncio.create_task(self.measure_lag())
+        self.hook_tree()
+        if METRICS_PORT:
+            self.server.add_route("GET", "/metrics", self.metrics)
+            await self.server.start()
+
+    async def cog_unload(self):
+        if self.lag_task:
+            self.lag_task.cancel()
+        if self.tree_hooks:
+            self.bot.tree.interaction_check, self.bot.tree.on_error = self.tree_hooks
+        await self.server.stop()
+
+    def gateway_latency(self):
+        latency = self.bot.latency
+        # 未接続のときは inf になる
+        return latency if latency == latency and latency != float("inf") else 0
+
+    # ===============================
+    # イベントループ遅延
+    # ===============================
+    async def measure_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            LOOP_LAG.observe(max(time.perf_counter() - started - LAG_INTERVAL, 0.0))
+
+    # ===============================
+    # スラッシュコマンド
+    # ===============================
+    def hook_tree(self):
+        """
+        ハンドラの前（interaction_check）で時刻を記録し、完了イベントと on_error で記録する。
+        interaction.created_at からだと Gateway の遅延や時計のずれも入るので使わない。
+        """
+        tree = self.bot.tree
+        self.tree_hooks = check, on_error = tree.interaction_check, tree.on_error
+
+        async def interaction_check(interaction: discord.Interaction) -> bool:
+            interaction.extras["started"] = time.perf_counter()
+            return await check(interaction)
+
+        async def on_tree_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+            outcome = "check_failed" if isinstance(error, app_commands.CheckFailure) else "error"
+            self.observe(interaction, interaction.command, outcome)
+            await on_error(interaction, error)
+
+        tree.interaction_check = interaction_check
+        tree.on_error = on_tree_error
+
+    @staticmethod
+    def observe(interaction: discord.Interaction, command, outcome: str):
+        started = interaction.extras.get("started")
+        if started is None or command is None:
+            return
+        APP_COMMAND_SECONDS.observe(time.perf_counter() - started, (command.qualified_name, outcome))
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        self.observe(interaction, command, "ok")
+
+    # ===============================
+    # /metrics
+    # ===============================
+    async def metrics(self, request: web.Request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+async def setup(bot):
+    await bot.add_cog(MetricsCog(bot))
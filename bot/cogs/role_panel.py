@@ -1,34 +1,194 @@
+import re
+import asyncio
 import discord
 from discord.ext import commands
-from discord.ui import View, Button
+from discord.ui import View, Button, Select, DynamicItem
 
-class RolePanelCog(commands.Cog):
-    def __init__(self, bot):
-        self.bot = bot
+from bot.config import ROLE_PANEL_DEBOUNCE
+from bot.outbound import outbound, AUTH
+from bot.metrics import registry
+from bot.log import get_logger
 
-    # ===============================
-    # ロールパネル View
-    # ===============================
-    class RolePanelView(View):
-        def __init__(self, roles):
-            super().__init__(timeout=None)
+MAX_SELECT_ROLES = 25  # セレクトメニューの選択肢の上限
+
+log = get_logger("role_panel")
+
+CHANGES = registry.counter("hunya_role_panel_changes_total", "ロールパネルで受け付けたロールの変更")
+EDITS = registry.counter("hunya_role_panel_edits_total", "ロールパネルの変更をまとめて呼んだ member.edit", ("result",))
+
+# ===============================
+# ロール変更のまとめ送信
+# ===============================
+class RoleUpdateBatcher:
+    """
+    メンバーごとに ROLE_PANEL_DEBOUNCE 秒だけ変更をためて、
+    1 回の member.edit(roles=...) にまとめる（連打による add/remove_roles の連発を防ぐ）。
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.pending = {}  # (guild_id, member_id) -> [member, add(set), remove(set)]
+        self.tasks = set()
+        self.clicks = 0   # 受け付けた変更の数（従来なら 1 回ずつ REST を呼んでいた）
+        self.edits = 0    # 実際に呼んだ member.edit の数
+        self.failures = 0
+
+    def entry(self, member: discord.Member):
+        key = (member.guild.id, member.id)
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = [member, set(), set()]
+            task = asyncio.create_task(self.flush_later(key))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        entry[0] = member
+        return entry
+
+    def has_role(self, member: discord.Member, role_id: int) -> bool:
+        """ためている変更も反映した上で、ロールを持っているか"""
+        entry = self.pending.get((member.guild.id, member.id))
+        if entry is not None:
+            if role_id in entry[1]:
+                return True
+            if role_id in entry[2]:
+                return False
+        return member.get_role(role_id) is not None
 
-            for role in roles:
-                button = Button(label=role.name)
+    def change(self, member: discord.Member, add=(), remove=()):
+        entry = self.entry(member)
+        for role_id in add:
+            entry[2].discard(role_id)
+            entry[1].add(role_id)
+            self.clicks += 1
+            CHANGES.inc()
+        for role_id in remove:
+            entry[1].discard(role_id)
+            entry[2].add(role_id)
+            self.clicks += 1
+            CHANGES.inc()
 
-                async def callback(interaction: discord.Interaction, r=role):
-                    if r in interaction.user.roles:
-                        await interaction.user.remove_roles(r)
-                    else:
-                        await interaction.user.add_roles(r)
+    async def flush_later(self, key):
+        await asyncio.sleep(self.delay)
+        member, add, remove = self.pending.pop(key)
+        # 待っている間に他で変わったかもしれないので最新のキャッシュを使う
+        # （lean でキャッシュが無ければ、最後のクリックに付いてきたメンバー情報）
+        member = member.guild.get_member(member.id) or member
 
-                    await interaction.response.send_message(
-                        "✅ ロールを更新しました",
-                        ephemeral=True
-                    )
+        current = {r.id for r in member.roles if not r.is_default()}
+        roles = (current | add) - remove
+        if roles == current:
+            return
+
+        try:
+            await outbound.run(AUTH, member.guild.id, lambda: member.edit(
+                roles=[discord.Object(id=role_id) for role_id in roles],
+                reason="ロールパネル",
+            ))
+            self.edits += 1
+            EDITS.inc(labels=("ok",))
+        except discord.HTTPException as e:
+            self.failures += 1
+            EDITS.inc(labels=("error",))
+            log.warning("%s のロール更新失敗: %s", member, e, extra={"guild": member.guild.id, "user": member.id})
+
+    def stats(self):
+        return {
+            "clicks": self.clicks,
+            "edits": self.edits,
+            "saved": self.clicks - self.edits - self.failures,
+            "failures": self.failures,
+            "pending": len(self.pending),
+        }
+
+
+role_updates = RoleUpdateBatcher(ROLE_PANEL_DEBOUNCE)
+registry.gauge(
+    "hunya_role_panel_calls_saved", "まとめたことで呼ばずに済んだ REST 呼び出しの数",
+    callback=lambda: role_updates.clicks - role_updates.edits - role_updates.failures,
+)
+registry.gauge("hunya_role_panel_pending", "変更をためているメンバー数", callback=lambda: len(role_updates.pending))
+
+# ===============================
+# ロールパネルのボタン
+# ===============================
+# custom_id にロール ID を入れておき、押されたときに復元する。
+# パネルごとの View をメモリに持たないので、再起動後もそのまま使える
+class RolePanelButton(DynamicItem[Button], template=r"role_panel:role:(?P<role_id>[0-9]+)"):
+    def __init__(self, role_id: int, label: str = None):
+        super().__init__(Button(label=label, custom_id=f"role_panel:role:{role_id}"))
+        self.role_id = role_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match: re.Match):
+        return cls(int(match["role_id"]), item.label)
+
+    async def callback(self, interaction: discord.Interaction):
+        role = interaction.guild.get_role(self.role_id)
+        if role is None:
+            await interaction.response.send_message("⚠️ ロールが見つかりません", ephemeral=True)
+            return
+
+        # 先に応答し、ロールの変更はまとめて後から送る
+        if role_updates.has_role(interaction.user, role.id):
+            role_updates.change(interaction.user, remove=[role.id])
+            text = f"✅ **{role.name}** を外しました"
+        else:
+            role_updates.change(interaction.user, add=[role.id])
+            text = f"✅ **{role.name}** を付与しました"
+
+        await interaction.response.send_message(text, ephemeral=True)
+
+# ===============================
+# ロールパネルのセレクトメニュー（6 個以上のロール用）
+# ===============================
+# 選択肢の value がロール ID。選ばれたものを付与し、選ばれなかったものを外す
+class RolePanelSelect(DynamicItem[Select], template=r"role_panel:select"):
+    def __init__(self, options=None):
+        super().__init__(
+            Select(
+                custom_id="role_panel:select",
+                placeholder="ロールを選択してください",
+                min_values=0,
+                max_values=max(len(options or []), 1),
+                options=options or [],
+            )
+        )
 
-                button.callback = callback
-                self.add_item(button)
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Select, match: re.Match):
+        return cls(item.options)
+
+    async def callback(self, interaction: discord.Interaction):
+        selected = {int(v) for v in self.item.values}
+        member = interaction.user
+        add, remove = [], []
+        for option in self.item.options:
+            role_id = int(option.value)
+            if interaction.guild.get_role(role_id) is None:
+                continue
+            has_role = role_updates.has_role(member, role_id)
+            if role_id in selected and not has_role:
+                add.append(role_id)
+            elif role_id not in selected and has_role:
+                remove.append(role_id)
+
+        if add or remove:
+            role_updates.change(member, add=add, remove=remove)
+
+        await interaction.response.send_message(
+            "✅ ロールを更新しました",
+            ephemeral=True
+        )
+
+class RolePanelCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        self.bot.add_dynamic_items(RolePanelButton, RolePanelSelect)
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(RolePanelButton, RolePanelSelect)
 
     # ===============================
     # /role_panel コマンド
@@ -45,9 +205,45 @@ class RolePanelCog(commands.Cog):
     ):
         roles = [r for r in [r1, r2, r3, r4, r5] if r]
 
+        view = View(timeout=None)
+        for role in roles:
+            view.add_item(RolePanelButton(role.id, role.name))
+
+        await interaction.response.send_message(
+            "ロールを選択してください",
+            view=view
+        )
+
+    # ===============================
+    # /role_panel_select コマンド
+    # ===============================
+    @discord.app_commands.command(name="role_panel_select")
+    @discord.app_commands.checks.has_permissions(manage_roles=True)
+    @discord.app_commands.describe(roles="ロールのメンションか ID をスペース区切りで（最大 25 個）")
+    async def role_panel_select(self, interaction: discord.Interaction, roles: str):
+        found = []
+        for role_id in re.findall(r"[0-9]{15,20}", roles):
+            role = interaction.guild.get_role(int(role_id))
+            if role and role not in found:
+                found.append(role)
+
+        if not found:
+            await interaction.response.send_message("⚠️ ロールが見つかりません", ephemeral=True)
+            return
+        if len(found) > MAX_SELECT_ROLES:
+            await interaction.response.send_message(
+                f"⚠️ ロールは {MAX_SELECT_ROLES} 個までです",
+                ephemeral=True
+            )
+            return
+
+        options = [discord.SelectOption(label=r.name, value=str(r.id)) for r in found]
+        view = View(timeout=None)
+        view.add_item(RolePanelSelect(options))
+
         await interaction.response.send_message(
             "ロールを選択してください",
-            view=self.RolePanelView(roles)
+            view=view
         )
 
 async def setup(bot):
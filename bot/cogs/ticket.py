@@ -1,39 +1,177 @@
+import asyncio
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
 
+from bot.outbound import outbound, OutboundShed, TICKET
+from bot.storage import storage
+from bot.log import get_logger
+
+log = get_logger("ticket")
+
+CATEGORY_NAME = "Tickets"
+
+# "guild:user" -> 開いているチケットのチャンネル ID
+open_tickets = storage.open("tickets", {})
+
 class TicketCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.categories = {}      # guild_id -> カテゴリ ID
+        self.category_locks = {}  # guild_id -> asyncio.Lock（カテゴリの二重作成防止）
+        self.creating = set()     # 作成中の (guild_id, user_id)
+        # チャンネル ID -> "guild:user"（閉じるときの逆引き）
+        self.owners = {channel_id: key for key, channel_id in open_tickets.items()}
+
+    async def cog_load(self):
+        # 1 つずつ登録すれば、どのパネル・チケットのボタンでも動く（再起動後も）
+        self.bot.add_view(self.TicketView(self))
+        self.bot.add_view(self.CloseView(self))
+
+    # ===============================
+    # カテゴリ（ギルドごとにキャッシュ）
+    # ===============================
+    async def get_category(self, guild: discord.Guild):
+        cat = guild.get_channel(self.categories.get(guild.id, 0))
+        if cat:
+            return cat
+
+        lock = self.category_locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            # 待っている間に他のクリックが作ったかもしれない
+            cat = guild.get_channel(self.categories.get(guild.id, 0))
+            if not cat:
+                cat = discord.utils.get(guild.categories, name=CATEGORY_NAME)
+            if not cat:
+                cat = await outbound.run(TICKET, guild.id, lambda: guild.create_category(CATEGORY_NAME))
+            self.categories[guild.id] = cat.id
+            return cat
+
+    # ===============================
+    # 開いているチケット
+    # ===============================
+    def find_ticket(self, guild: discord.Guild, user_id: int):
+        key = f"{guild.id}:{user_id}"
+        channel_id = open_tickets.get(key)
+        if channel_id is None:
+            return None
+        ch = guild.get_channel(channel_id)
+        if ch is None:
+            # 手動で消されていた
+            self.forget_ticket(channel_id)
+        return ch
+
+    def remember_ticket(self, guild_id: int, user_id: int, channel_id: int):
+        key = f"{guild_id}:{user_id}"
+        open_tickets[key] = channel_id
+        self.owners[channel_id] = key
+        storage.mark_dirty("tickets", key)
+
+    def forget_ticket(self, channel_id: int):
+        key = self.owners.pop(channel_id, None)
+        if key is not None and open_tickets.pop(key, None) is not None:
+            storage.mark_dirty("tickets", key)
 
+    def is_ticket(self, channel) -> bool:
+        return channel.id in self.owners or (
+            channel.category is not None and channel.category.name == CATEGORY_NAME
+        )
+
+    async def discard_channel(self, ch):
+        try:
+            await outbound.run(TICKET, ch.guild.id, ch.delete)
+        except (discord.HTTPException, OutboundShed) as e:
+            log.warning("作りかけのチケットを削除できませんでした: %s", e, extra={"guild": ch.guild.id})
+
+    @staticmethod
+    async def report_failure(i: discord.Interaction):
+        try:
+            await i.followup.send("⚠️ チケットを作成できませんでした。時間をおいて再度お試しください", ephemeral=True)
+        except discord.HTTPException:
+            pass
+
+    @staticmethod
+    def detached(view: View) -> View:
+        # cog_load で登録済みの View がクリックを受けるので、メッセージごとには保持させない
+        view.stop()
+        return view
+
+    # ===============================
+    # チケット作成ボタン
+    # ===============================
     class TicketView(View):
-        @discord.ui.button(label="🎫 チケット作成", style=discord.ButtonStyle.green)
+        def __init__(self, cog):
+            super().__init__(timeout=None)
+            self.cog = cog
+
+        @discord.ui.button(label="🎫 チケット作成", style=discord.ButtonStyle.green, custom_id="ticket:open")
         async def open(self, i: discord.Interaction, _):
-            cat = discord.utils.get(i.guild.categories, name="Tickets")
-            if not cat:
-                cat = await i.guild.create_category("Tickets")
-
-            ch = await i.guild.create_text_channel(
-                f"ticket-{i.user.name}",
-                category=cat,
-                overwrites={
-                    i.guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                    i.user: discord.PermissionOverwrite(read_messages=True)
-                }
-            )
-
-            class CloseView(View):
-                @discord.ui.button(label="❌ チケットを閉じる", style=discord.ButtonStyle.red)
-                async def close(self, inter: discord.Interaction, _):
-                    await inter.response.send_message("削除します", ephemeral=True)
-                    await ch.delete()
-
-            await ch.send(f"{i.user.mention} のチケット", view=CloseView())
-            await i.response.send_message("作成しました", ephemeral=True)
+            # 3 秒以内の応答期限に間に合わせるため、先に defer する
+            await i.response.defer(ephemeral=True, thinking=True)
+            cog = self.cog
+            key = (i.guild.id, i.user.id)
+
+            ch = cog.find_ticket(i.guild, i.user.id)
+            if ch:
+                await i.followup.send(f"すでに {ch.mention} があります", ephemeral=True)
+                return
+            if key in cog.creating:
+                await i.followup.send("作成中です", ephemeral=True)
+                return
+
+            cog.creating.add(key)
+            ch = None
+            try:
+                cat = await cog.get_category(i.guild)
+                ch = await outbound.run(TICKET, i.guild.id, lambda: i.guild.create_text_channel(
+                    f"ticket-{i.user.name}",
+                    category=cat,
+                    overwrites={
+                        i.guild.default_role: discord.PermissionOverwrite(read_messages=False),
+                        i.user: discord.PermissionOverwrite(read_messages=True)
+                    }
+                ))
+                view = cog.detached(cog.CloseView(cog))
+                await outbound.run(TICKET, i.guild.id, lambda: ch.send(f"{i.user.mention} のチケット", view=view))
+                cog.remember_ticket(i.guild.id, i.user.id, ch.id)
+            except (discord.HTTPException, OutboundShed) as e:
+                # defer 済みなので、何か返さないと「考え中」のまま残る。作りかけのチャンネルは消す
+                log.warning("チケット作成失敗: %s", e, extra={"guild": i.guild.id, "user": i.user.id})
+                if ch is not None:
+                    await cog.discard_channel(ch)
+                await cog.report_failure(i)
+                return
+            finally:
+                cog.creating.discard(key)
+
+            try:
+                await i.followup.send(f"作成しました {ch.mention}", ephemeral=True)
+            except discord.HTTPException as e:
+                # チケットはできているので残す（パネルを押し直せば「すでにあります」と出る）
+                log.warning("作成完了の通知失敗: %s", e, extra={"guild": i.guild.id, "user": i.user.id})
+
+    # ===============================
+    # チケットを閉じるボタン
+    # ===============================
+    class CloseView(View):
+        def __init__(self, cog):
+            super().__init__(timeout=None)
+            self.cog = cog
+
+        @discord.ui.button(label="❌ チケットを閉じる", style=discord.ButtonStyle.red, custom_id="ticket:close")
+        async def close(self, inter: discord.Interaction, _):
+            # ボタンが押されたチャンネル自体を消す（チケットごとの状態を持たない）
+            ch = inter.channel
+            if not self.cog.is_ticket(ch):
+                await inter.response.send_message("⚠️ チケットではありません", ephemeral=True)
+                return
+            await inter.response.send_message("削除します", ephemeral=True)
+            self.cog.forget_ticket(ch.id)
+            await outbound.run(TICKET, inter.guild.id, ch.delete)
 
     @discord.app_commands.command(name="ticket_panel")
     async def ticket_panel(self, interaction: discord.Interaction):
-        await interaction.response.send_message("チケット作成", view=self.TicketView())
+        await interaction.response.send_message("チケット作成", view=self.detached(self.TicketView(self)))
 
 async def setup(bot):
     await bot.add_cog(TicketCog(bot))
@@ -13,6 +13,97 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
+# トークン交換用 HTTP クライアント
+OAUTH_POOL_SIZE = int(os.getenv("OAUTH_POOL_SIZE", 20))
+OAUTH_TIMEOUT = float(os.getenv("OAUTH_TIMEOUT", 10.0))
+OAUTH_MAX_RETRIES = int(os.getenv("OAUTH_MAX_RETRIES", 3))
+# 認証待ちコードの有効期限（秒）と最大件数
+AUTH_CODE_TTL = float(os.getenv("AUTH_CODE_TTL", 600))
+AUTH_CODE_MAX = int(os.getenv("AUTH_CODE_MAX", 10000))
+# ボタン認証で付与したロールを、OAuth 未完了なら解除するまでの秒数
+AUTH_BUTTON_TIMEOUT = int(os.getenv("AUTH_BUTTON_TIMEOUT", 60))
+# /auth_sweep: 同時に付け外しするメンバー数と、進み具合を保存する件数の単位
+AUTH_SWEEP_CONCURRENCY = int(os.getenv("AUTH_SWEEP_CONCURRENCY", 4))
+AUTH_SWEEP_PAGE_SIZE = int(os.getenv("AUTH_SWEEP_PAGE_SIZE", 1000))
 
-# # ===== Flask =====
-# PORT = int(os.getenv("PORT", 5000))
+# ===== データ保存 =====
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# 変更をディスクに書き出すまでの待ち時間（秒）。この間の変更は 1 回にまとめる
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", 2.0))
+# "json": data/*.json / "sqlite": SQLITE_PATH（初回起動時に既存の JSON を取り込む）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR, "hunya.db"))
+
+# ===== グローバルチャット =====
+# 1メッセージあたりの同時送信数の上限（送信スケジューラの relay の枠もこの数になる）
+GLOBAL_RELAY_CONCURRENCY = int(os.getenv("GLOBAL_RELAY_CONCURRENCY", 16))
+# "webhook": チャンネルごとの Webhook で送信 / "send": Bot ユーザーとして送信
+GLOBAL_RELAY_MODE = os.getenv("GLOBAL_RELAY_MODE", "webhook")
+# 中継先ごとの送信キューの長さ（溢れたら古いものから破棄）
+GLOBAL_RELAY_QUEUE_SIZE = int(os.getenv("GLOBAL_RELAY_QUEUE_SIZE", 100))
+# 送信が遅れているとき 1 回の投稿にまとめる最大件数
+GLOBAL_RELAY_MERGE_LIMIT = int(os.getenv("GLOBAL_RELAY_MERGE_LIMIT", 10))
+# 編集・削除を反映するための「元メッセージ -> 中継先のコピー」の記録（上限 MB と保持秒数）
+GLOBAL_RELAY_MAP_MB = float(os.getenv("GLOBAL_RELAY_MAP_MB", 32))
+GLOBAL_RELAY_MAP_TTL = float(os.getenv("GLOBAL_RELAY_MAP_TTL", 86400))
+# 添付ファイル: これより大きいもの・対象外の種類は CDN のリンクで中継する
+GLOBAL_ATTACHMENT_MAX_MB = float(os.getenv("GLOBAL_ATTACHMENT_MAX_MB", 8))
+GLOBAL_ATTACHMENT_TYPES = os.getenv("GLOBAL_ATTACHMENT_TYPES", "image/,video/,audio/")
+# ダウンロードしたファイルをメモリに置く上限（超えたら一時ファイルへ）
+GLOBAL_ATTACHMENT_SPOOL_KB = int(os.getenv("GLOBAL_ATTACHMENT_SPOOL_KB", 512))
+# ネットワークごとのアップロード量の上限（MB/秒、中継先の数を掛けた量で数える）
+GLOBAL_ATTACHMENT_RATE_MB = float(os.getenv("GLOBAL_ATTACHMENT_RATE_MB", 4))
+
+# ===== 招待リンク・URL 監視 =====
+# 削除をまとめて一括削除するまでの待ち時間（秒）
+MODERATION_WINDOW = float(os.getenv("MODERATION_WINDOW", 1.0))
+MODERATION_TIMEOUT_MINUTES = int(os.getenv("MODERATION_TIMEOUT_MINUTES", 10))
+# 警告 DM の上限（ギルドごと、1 秒あたり / 最大連続数）
+MODERATION_DM_RATE = float(os.getenv("MODERATION_DM_RATE", 0.5))
+MODERATION_DM_BURST = int(os.getenv("MODERATION_DM_BURST", 5))
+
+# ===== ロールパネル =====
+# クリックをまとめてから 1 回でロールを更新するまでの待ち時間（秒）
+ROLE_PANEL_DEBOUNCE = float(os.getenv("ROLE_PANEL_DEBOUNCE", 1.5))
+
+# ===== REST 送信 =====
+# 全 Cog で共有する REST 操作の同時実行数（relay 以外に必ず空けておく分。relay はこれとは別に
+# GLOBAL_RELAY_CONCURRENCY まで）
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", 8))
+# グローバルチャット送信の待ち行列の上限（超えたら捨てる）
+OUTBOUND_RELAY_QUEUE_LIMIT = int(os.getenv("OUTBOUND_RELAY_QUEUE_LIMIT", 2000))
+
+# ===== Web（OAuth コールバック） =====
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", 10000))
+WEB_ACCESS_LOG = os.getenv("WEB_ACCESS_LOG", "0") == "1"
+
+# ===== メトリクス（Prometheus 形式、/metrics） =====
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))  # 0 で無効
+
+# ===== ログ =====
+# 全体のレベルと、ロガーごとのレベル（例: "invite_watch=DEBUG,relay=WARNING"）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json": 1 行 1 JSON / "text": 人が読む形式
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# DEBUG ログを出す割合（0〜1）。ホットパスの DEBUG で出力が溢れないように間引く
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", 0.1))
+
+# ===== キャッシュ =====
+# "full": メンバーを全部キャッシュ（起動時に取得） / "lean": キャッシュせず必要なときに取得
+CACHE_PROFILE = os.getenv("CACHE_PROFILE", "full")
+# メッセージキャッシュの件数。未設定ならプロファイルの既定値（full: 1000 / lean: 100）
+MESSAGE_CACHE_SIZE = os.getenv("MESSAGE_CACHE_SIZE")
+
+# ===== クラスタ（複数プロセス） =====
+# ワーカープロセス数。2 以上でランチャーがワーカーを起動し、シャードを分けて受け持たせる
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", 1))
+# シャード数。0 なら Discord の推奨値（ワーカー数より少なければワーカー数に合わせる）
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", 0))
+# プロセス間通信の Unix ソケット
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET", os.path.join(DATA_DIR, "cluster.sock"))
+# ランチャーがワーカーに渡す値（手で設定しない）
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID")
+CLUSTER_SHARD_COUNT = int(os.getenv("CLUSTER_SHARD_COUNT", 1))
@@ -0,0 +1,279 @@
+import os
+import json
+import socket
+import struct
+import asyncio
+import inspect
+import itertools
+
+from bot.log import get_logger
+
+log = get_logger("ipc")
+
+# フレーム = 4 バイトの長さ + JSON
+HEADER = struct.Struct("!I")
+# 1 つの接続に溜めてよい未送信バイト数（超えたら遅いワーカー宛てを捨てる）
+MAX_BUFFER = 16 * 1024 * 1024
+# ハブとの接続が切れたときの再接続の間隔（秒）。失敗するたびに倍にする
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+
+def encode(frame: dict) -> bytes:
+    body = json.dumps(frame, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+        body = await reader.readexactly(HEADER.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return json.loads(body)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("IPC の接続が切れました")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def request_sync(path: str, op: str, data=None, timeout: float = 10.0):
+    """
+    ループの外（import 時・終了時）用。ハブに 1 回だけ接続して応答を待つ。
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(encode({"op": op, "id": 0, "data": data}))
+        header = recv_exactly(sock, HEADER.size)
+        return json.loads(recv_exactly(sock, HEADER.unpack(header)[0])).get("data")
+
+
+async def call(handler, data, frame):
+    result = handler(data, frame)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+# --------------------------
+# ハブ（ランチャー側）
+# --------------------------
+class IpcHub:
+    """
+    ワーカー同士のメッセージを中継する。
+
+    - to がワーカー ID: そのワーカーへ
+    - to が "*": 送信元以外の全ワーカーへ
+    - to が無い: ハブ自身が on() で登録した処理で受ける（id 付きなら応答を返す）
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.workers = {}   # worker_id -> StreamWriter
+        self.handlers = {}  # op -> handler(data, frame)
+        self.server = None
+        self.dropped = 0
+
+    def on(self, op: str, handler):
+        self.handlers[op] = handler
+
+    async def start(self):
+        # 前回の残りのソケットファイルを消す
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server = await asyncio.start_unix_server(self.serve, path=self.path)
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for writer in list(self.workers.values()):
+            writer.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    # ---------- 送信 ----------
+    def write(self, writer: asyncio.StreamWriter, data: bytes) -> bool:
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > MAX_BUFFER:
+            self.dropped += 1
+            return False
+        writer.write(data)
+        return True
+
+    def send(self, worker_id, frame: dict) -> bool:
+        writer = self.workers.get(worker_id)
+        if writer is None:
+            self.dropped += 1
+            return False
+        return self.write(writer, encode(frame))
+
+    def broadcast(self, frame: dict, exclude=None):
+        data = encode(frame)
+        for worker_id, writer in list(self.workers.items()):
+            if worker_id != exclude:
+                self.write(writer, data)
+
+    # ---------- 受信 ----------
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                op = frame.get("op")
+                if op == "hello":
+                    worker_id = frame["from"]
+                    self.workers[worker_id] = writer
+                    log.info("ワーカー %s が接続", worker_id)
+                    continue
+
+                to = frame.get("to")
+                if to == "*":
+                    self.broadcast(frame, exclude=frame.get("from"))
+                elif to is not None:
+                    self.send(to, frame)
+                else:
+                    await self.handle(frame, writer)
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                log.warning("ワーカー %s が切断", worker_id)
+            writer.close()
+
+    async def handle(self, frame: dict, writer: asyncio.StreamWriter):
+        handler = self.handlers.get(frame.get("op"))
+        result = None
+        if handler is not None:
+            try:
+                result = await call(handler, frame.get("data"), frame)
+            except Exception:
+                log.exception("%s の処理失敗", frame.get("op"))
+        if "id" in frame:
+            self.write(writer, encode({"op": "reply", "reply_to": frame["id"], "data": result}))
+
+
+# --------------------------
+# クライアント（ワーカー側）
+# --------------------------
+class IpcClient:
+    def __init__(self, path: str, worker_id: int):
+        self.path = path
+        self.worker_id = worker_id
+        self.handlers = {}  # op -> handler(data, frame)
+        self.pending = {}   # 要求 ID -> Future
+        self.ids = itertools.count(1)
+        self.writer = None
+        self.task = None
+        self.tasks = set()
+        self.reconnect_task = None
+        self.closing = False
+        # 再接続したときに呼ぶ関数（切断中にためた送信を流すなど）
+        self.reconnected = []
+
+    def on(self, op: str, handler):
+        self.handlers[op] = handler
+
+    def off(self, op: str):
+        self.handlers.pop(op, None)
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.writer.write(encode({"op": "hello", "from": self.worker_id}))
+        self.task = asyncio.create_task(self.read_loop(reader))
+
+    def close(self):
+        self.closing = True
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+        if self.task:
+            self.task.cancel()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    # ---------- 送信 ----------
+    def send(self, to, op: str, data=None) -> bool:
+        """to: ワーカー ID / "*"（全員）/ None（ハブ）。書き込みは待たない"""
+        if not self.connected:
+            return False
+        self.writer.write(encode({"op": op, "from": self.worker_id, "to": to, "data": data}))
+        return True
+
+    async def request(self, to, op: str, data=None, timeout: float = 10.0):
+        if not self.connected:
+            raise ConnectionError("IPC に接続していません")
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode({"op": op, "from": self.worker_id, "to": to, "id": request_id, "data": data}))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    # ---------- 受信 ----------
+    async def read_loop(self, reader: asyncio.StreamReader):
+        while (frame := await read_frame(reader)) is not None:
+            if frame.get("op") == "reply":
+                future = self.pending.get(frame.get("reply_to"))
+                if future is not None and not future.done():
+                    future.set_result(frame.get("data"))
+                continue
+
+            handler = self.handlers.get(frame.get("op"))
+            if handler is None:
+                continue
+            # 遅い処理があっても受信を止めない
+            task = asyncio.create_task(self.run_handler(handler, frame))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        log.error("IPC の接続が切れました")
+        self.writer = None
+        # 返事が来なくなった要求は待たせずに失敗させる
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("IPC の接続が切れました"))
+        if not self.closing:
+            self.reconnect_task = asyncio.create_task(self.reconnect())
+
+    async def reconnect(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.closing:
+            await asyncio.sleep(delay)
+            try:
+                await self.connect()
+            except OSError as e:
+                log.warning("IPC 再接続失敗（%.1f 秒後に再試行）: %s", min(delay * 2, RECONNECT_MAX_DELAY), e)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            log.info("IPC に再接続しました")
+            for callback in self.reconnected:
+                try:
+                    callback()
+                except Exception:
+                    log.exception("再接続後の処理失敗")
+            return
+
+    async def run_handler(self, handler, frame: dict):
+        try:
+            result = await call(handler, frame.get("data"), frame)
+        except Exception:
+            log.exception("%s の処理失敗", frame.get("op"))
+            result = None
+        if "id" in frame and self.connected:
+            self.writer.write(encode({
+                "op": "reply", "from": self.worker_id, "to": frame.get("from"),
+                "reply_to": frame["id"], "data": result,
+            }))
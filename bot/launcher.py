@@ -0,0 +1,111 @@
+import os
+import sys
+import signal
+import asyncio
+
+import aiohttp
+
+from bot.config import BOT_TOKEN, CLUSTER_WORKERS, CLUSTER_SHARDS, CLUSTER_SOCKET
+from bot.ipc import IpcHub
+from bot.storage import storage
+from bot.log import get_logger
+
+log = get_logger("launcher")
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+RESTART_DELAY = 5.0  # ワーカーが落ちてから起動し直すまでの秒数
+
+
+async def recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["shards"]
+
+
+# --------------------------
+# ランチャー
+# --------------------------
+class Launcher:
+    """
+    ワーカープロセスを起動・監視し、IPC のハブとストレージの持ち主を兼ねる。
+    自分は Discord に接続しない。
+    """
+
+    def __init__(self, script: str, workers: int, shards: int, socket_path: str):
+        self.script = script
+        self.workers = workers
+        self.shards = shards
+        self.hub = IpcHub(socket_path)
+        self.hub.on("store.names", self.store_names)
+        self.hub.on("store.load", self.store_load)
+        self.hub.on("store.write", self.store_write)
+        self.procs = {}  # worker_id -> Process
+        self.stopping = asyncio.Event()
+
+    # ---------- ストレージ ----------
+    def store_names(self, data, frame):
+        return storage.names()
+
+    def store_load(self, data, frame):
+        return storage.open(data["name"], data["default"])
+
+    def store_write(self, data, frame):
+        # "ops"（リストへの追加・削除）は今のデータに適用するので、同時に来ても両方残る
+        storage.apply(data, mark=True)
+        # 書いたワーカー以外のメモリにも反映させる
+        self.hub.broadcast({"op": "store.update", "data": data}, exclude=frame.get("from"))
+
+    # ---------- ワーカー ----------
+    async def supervise(self, worker_id: int, shard_count: int):
+        env = dict(
+            os.environ,
+            CLUSTER_WORKERS=str(self.workers),
+            CLUSTER_WORKER_ID=str(worker_id),
+            CLUSTER_SHARD_COUNT=str(shard_count),
+        )
+        while not self.stopping.is_set():
+            proc = await asyncio.create_subprocess_exec(sys.executable, self.script, *sys.argv[1:], env=env)
+            self.procs[worker_id] = proc
+            log.info("ワーカー %d 起動 (pid %d)", worker_id, proc.pid)
+            code = await proc.wait()
+            if self.stopping.is_set():
+                break
+            log.error("ワーカー %d が終了 (code %s)、%.0f 秒後に再起動", worker_id, code, RESTART_DELAY)
+            try:
+                await asyncio.wait_for(self.stopping.wait(), RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self.stopping.set()
+        for proc in self.procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+
+    async def run(self):
+        shard_count = self.shards or await recommended_shards(BOT_TOKEN)
+        # どのワーカーにも 1 つはシャードがあるようにする
+        shard_count = max(shard_count, self.workers)
+        log.info("クラスタ起動 ワーカー %d / シャード %d", self.workers, shard_count)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        # ワーカーからの store.load にディスクを読まずに答えられるよう、先に全部読んでおく
+        await storage.preload()
+        await self.hub.start()
+        try:
+            await asyncio.gather(*(self.supervise(i, shard_count) for i in range(self.workers)))
+        finally:
+            # ワーカーが全部終わってから（終了時の書き込みを受け取ってから）止める
+            await self.hub.stop()
+
+
+def run_cluster(script: str):
+    try:
+        asyncio.run(Launcher(script, CLUSTER_WORKERS, CLUSTER_SHARDS, CLUSTER_SOCKET).run())
+    finally:
+        storage.close_sync()
+        log.info("データ保存完了 %s", storage.stats())
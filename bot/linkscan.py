@@ -0,0 +1,98 @@
+import re
+import unicodedata
+from typing import NamedTuple
+
+# 招待リンクのホスト（パス付きのときだけ招待とみなす）
+INVITE_HOSTS = {
+    "discord.gg": "",
+    "discord.com": "/invite/",
+    "discordapp.com": "/invite/",
+    "discord.me": "",
+    "discord.io": "",
+}
+
+# URL っぽいもの 1 回の走査で全部拾う。
+# scheme 付きはホストの形を問わない（IP・localhost・日本語ドメインなど）。
+# scheme が無いものは招待ホストそのものだけを拾う（招待の判定にしか使わないため）。
+# 任意のドメインの形（ラベルの繰り返し）にすると "a" * 2000 + "." のような文で
+# バックトラックが 2 乗になり、ループを数百 ms 止めるので使わない
+LINK_RE = re.compile(
+    r"(?P<scheme>https?://)(?P<authority>[^\s/?#<>]+)(?P<spath>[/?#][^\s<>]*)?"
+    r"|(?<![a-z0-9.-])(?P<host>(?:www\.)?(?:"
+    + "|".join(re.escape(host) for host in sorted(INVITE_HOSTS, key=len, reverse=True))
+    + r"))(?![a-z0-9-]|\.[a-z0-9])"
+    r"(?::[0-9]{1,5})?"
+    r"(?P<path>/[^\s<>]*)?"
+)
+# 文末の句読点・括弧はホストに含めない
+TRAILING = ".,;:!?)]}'\"、"
+
+# "discord[.]gg" "discord(dot)gg" などの書き換え
+OBFUSCATED_DOT_RE = re.compile(r"\s*(?:\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\))\s*")
+# ゼロ幅文字は消し、句点「。」はドットに
+CHAR_MAP = {**dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff")), ord("。"): "."}
+
+
+class ScanResult(NamedTuple):
+    invites: list      # 招待リンクのホスト
+    urls: list         # それ以外の URL のホスト
+    invite_urls: list  # 招待リンクのうち scheme 付きのもののホスト（招待監視 OFF なら URL 扱い）
+
+
+def normalize(content: str) -> str:
+    """全角・ゼロ幅文字・[.] などで隠したリンクを普通の形に戻す"""
+    if not content.isascii():
+        content = unicodedata.normalize("NFKC", content).translate(CHAR_MAP)
+    content = content.lower()
+    if "[" in content or "(" in content or "{" in content:
+        content = OBFUSCATED_DOT_RE.sub(".", content)
+    if "hxxp" in content:
+        content = content.replace("hxxp", "http")
+    return content
+
+
+def authority_host(authority: str) -> str:
+    """ "user@host:port" -> "host" """
+    host = authority.rpartition("@")[2]
+    if host.startswith("["):
+        # IPv6
+        return host[:host.find("]") + 1] if "]" in host else host
+    return host.partition(":")[0].rstrip(TRAILING)
+
+
+def scan(content: str) -> ScanResult:
+    invites, urls, invite_urls = [], [], []
+    if "." not in content and "dot" not in content and "://" not in content and content.isascii():
+        return ScanResult(invites, urls, invite_urls)
+
+    for m in LINK_RE.finditer(normalize(content)):
+        if m["scheme"]:
+            host = authority_host(m["authority"])
+            path = m["spath"] or ""
+        else:
+            host = m["host"]
+            path = m["path"] or ""
+        if host.startswith("www."):
+            host = host[4:]
+
+        prefix = INVITE_HOSTS.get(host)
+        if prefix is not None and path.startswith(prefix or "/") and len(path) > len(prefix or "/"):
+            invites.append(host)
+            if m["scheme"]:
+                invite_urls.append(host)
+        elif m["scheme"] and host:
+            urls.append(host)
+    return ScanResult(invites, urls, invite_urls)
+
+
+def match_domain(host: str, domains) -> bool:
+    """host かその親ドメインが domains（set）に含まれるか"""
+    if not domains:
+        return False
+    while True:
+        if host in domains:
+            return True
+        dot = host.find(".")
+        if dot < 0:
+            return False
+        host = host[dot + 1:]
@@ -0,0 +1,107 @@
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from bot.config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_DEBUG_SAMPLE, CLUSTER_WORKER_ID
+
+ROOT = "hunya"
+# extra= で渡せる項目（JSON のフィールドになる）。handler を省くと関数名が入る
+FIELDS = ("guild", "user", "channel")
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Cog・モジュールごとのロガー。レベルは LOG_LEVELS の name で変えられる"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+# --------------------------
+# 出力形式（書き込みスレッド側で実行）
+# --------------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name.removeprefix(f"{ROOT}."),
+            "handler": getattr(record, "handler", record.funcName),
+            "msg": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if CLUSTER_WORKER_ID is not None:
+            entry["worker"] = int(CLUSTER_WORKER_ID)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = " ".join(
+            f"{field}={getattr(record, field)}"
+            for field in FIELDS if getattr(record, field, None) is not None
+        )
+        return f"{text} ({context})" if context else text
+
+
+# --------------------------
+# DEBUG の間引き（キューに積む前に捨てる）
+# --------------------------
+class DebugSampler(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+def parse_levels(spec: str) -> dict:
+    """ "auth=DEBUG,relay=WARNING" -> {"auth": "DEBUG", "relay": "WARNING"} """
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+# --------------------------
+# 初期化
+# --------------------------
+def setup_logging(stream=None) -> logging.handlers.QueueListener:
+    """
+    ループ側はキューに積むだけにして、整形と書き込みは別スレッドで行う。
+    stdout が遅いパイプでも Gateway の処理が止まらない。
+    """
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in parse_levels(LOG_LEVELS).items():
+        # "discord" など Bot 以外のロガーもそのまま指定できる
+        logger = get_logger(name) if not name.startswith(("discord", "aiohttp")) else logging.getLogger(name)
+        logger.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # 終了時に残りを書き出す
+    atexit.register(listener.stop)
+    return listener
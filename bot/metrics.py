@@ -0,0 +1,134 @@
+import bisect
+
+# 秒単位のレイテンシ用の既定バケット
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# --------------------------
+# メトリクスの種類
+# --------------------------
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.samples()
+
+    def samples(self):
+        return ()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}  # ラベル値のタプル -> 値
+
+    def inc(self, amount: float = 1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Metric):
+    """set() で値を入れるか、callback で出力時に値を取る（戻り値は数値か {ラベル: 値}）"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value: float, labels=()):
+        self.values[labels] = value
+
+    def samples(self):
+        values = self.values
+        if self.callback is not None:
+            try:
+                result = self.callback()
+            except Exception:
+                return
+            values = result if isinstance(result, dict) else {(): result}
+        for labels, value in values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # ラベル値のタプル -> [バケットごとの数..., +Inf, 合計]
+
+    def observe(self, value: float, labels=()):
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def samples(self):
+        for labels, data in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data[:-1]):
+                total += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {total}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {data[-1]}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {total}"
+
+
+# --------------------------
+# レジストリ
+# --------------------------
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Cog のリロードで同じ名前が来たら既存のものを返す
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames=(), callback=None) -> Gauge:
+        gauge = self.register(Gauge(name, help, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,185 @@
+import time
+import asyncio
+from collections import deque
+
+from bot.config import OUTBOUND_CONCURRENCY, OUTBOUND_RELAY_QUEUE_LIMIT, GLOBAL_RELAY_CONCURRENCY
+from bot.metrics import registry
+
+# 優先度（小さいほど先）
+MODERATION = 0
+AUTH = 1
+TICKET = 2
+RELAY = 3
+
+CLASS_NAMES = {MODERATION: "moderation", AUTH: "auth", TICKET: "ticket", RELAY: "relay"}
+
+WAIT_SECONDS = registry.histogram("hunya_rest_wait_seconds", "REST 操作のキュー待ち時間", ("class",))
+ACTION_SECONDS = registry.histogram("hunya_rest_action_seconds", "REST 操作の実行時間", ("class", "result"))
+SHED = registry.counter("hunya_rest_shed_total", "キューが一杯で捨てた REST 操作", ("class",))
+
+
+class OutboundShed(Exception):
+    """キューが一杯で捨てられた（優先度の低い送信のみ）"""
+
+
+# --------------------------
+# 優先度クラスごとのキュー
+# --------------------------
+class ClassQueue:
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        # 同時に実行してよい数（None なら制限なし）と、実行中の数
+        self.max_in_flight = None
+        self.in_flight = 0
+        # guild_id -> deque[(func, future, enqueued_at)]。ギルド単位で順番に取り出す
+        self.guilds = {}
+        self.size = 0
+        self.waited = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.shed = 0
+
+    def push(self, guild_id, job):
+        jobs = self.guilds.get(guild_id)
+        if jobs is None:
+            jobs = self.guilds[guild_id] = deque()
+        jobs.append(job)
+        self.size += 1
+
+    def pop(self):
+        # 先頭のギルドから 1 件取り、まだ残っていれば末尾に回す（ラウンドロビン）
+        guild_id = next(iter(self.guilds))
+        jobs = self.guilds.pop(guild_id)
+        job = jobs.popleft()
+        if jobs:
+            self.guilds[guild_id] = jobs
+        self.size -= 1
+        return job
+
+
+# --------------------------
+# 送信スケジューラ
+# --------------------------
+class OutboundScheduler:
+    """
+    全 Cog の REST 操作を優先度順（moderation > auth > ticket > relay）に流す。
+
+    同じ優先度の中ではギルドごとに順番に取り出すので、1 つのギルドの大量送信が
+    他のギルドを待たせない。relay はキューが一杯なら捨てる。
+
+    優先度は取り出すときにしか効かないので、ワーカーは concurrency + relay_concurrency 本
+    用意し、relay が同時に使えるのは relay_concurrency 本までにする。429 待ちの relay が
+    relay の分を全部ふさいでも、残りの concurrency 本でモデレーションなどは流れる。
+
+    relay_concurrency はグローバルチャットの同時送信数（GLOBAL_RELAY_CONCURRENCY）に合わせる。
+    小さくすると 1 メッセージの中継先が relay_concurrency 件ずつしか送れず、一番遅い中継先まで
+    の時間が中継先の数に比例して伸びる。大きくしてもモデレーションの枠は減らない
+    （増えるのはワーカーの数と、Discord に同時に投げる relay の数）。
+    """
+
+    def __init__(self, concurrency: int, relay_limit: int, relay_concurrency: int = None):
+        if relay_concurrency is None:
+            relay_concurrency = concurrency
+        relay_concurrency = max(1, relay_concurrency)
+        self.concurrency = concurrency + relay_concurrency
+        self.queues = {p: ClassQueue() for p in CLASS_NAMES}
+        self.queues[RELAY].limit = relay_limit
+        self.queues[RELAY].max_in_flight = relay_concurrency
+        self.ready = None
+        self.workers = []
+
+    def start(self):
+        if self.workers:
+            return
+        self.ready = asyncio.Event()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    # ---------- 投入 ----------
+    def submit(self, priority: int, guild_id: int, func) -> asyncio.Future:
+        """
+        func はコルーチンを返す引数なしの関数（捨てられたときにコルーチンを作らないため）。
+        結果は返した Future で受け取れる。
+        """
+        self.start()
+        queue = self.queues[priority]
+        future = asyncio.get_running_loop().create_future()
+        if queue.limit is not None and queue.size >= queue.limit:
+            queue.shed += 1
+            SHED.inc(labels=(CLASS_NAMES[priority],))
+            future.set_exception(OutboundShed(CLASS_NAMES[priority]))
+            return future
+
+        queue.push(guild_id, (func, future, time.perf_counter()))
+        self.ready.set()
+        return future
+
+    async def run(self, priority: int, guild_id: int, func):
+        return await self.submit(priority, guild_id, func)
+
+    # ---------- ワーカー ----------
+    def next_job(self):
+        for priority in CLASS_NAMES:
+            queue = self.queues[priority]
+            if queue.size and (queue.max_in_flight is None or queue.in_flight < queue.max_in_flight):
+                return priority, queue, queue.pop()
+        return None, None, None
+
+    async def worker(self):
+        while True:
+            priority, queue, job = self.next_job()
+            if job is None:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            func, future, enqueued_at = job
+            if future.cancelled():
+                continue
+            waited = (time.perf_counter() - enqueued_at) * 1000
+            queue.waited += 1
+            queue.wait_ms += waited
+            queue.max_wait_ms = max(queue.max_wait_ms, waited)
+            name = CLASS_NAMES[priority]
+            WAIT_SECONDS.observe(waited / 1000, (name,))
+
+            started = time.perf_counter()
+            queue.in_flight += 1
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                ACTION_SECONDS.observe(time.perf_counter() - started, (name, "error"))
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                ACTION_SECONDS.observe(time.perf_counter() - started, (name, "ok"))
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                queue.in_flight -= 1
+                if queue.size and queue.max_in_flight is not None:
+                    # 上限で取り出せずに待っていたワーカーを起こす
+                    self.ready.set()
+
+    def stats(self):
+        return {
+            CLASS_NAMES[p]: {
+                "queued": q.size,
+                "in_flight": q.in_flight,
+                "waited": q.waited,
+                "avg_wait_ms": q.wait_ms / q.waited if q.waited else 0.0,
+                "max_wait_ms": q.max_wait_ms,
+                "shed": q.shed,
+            }
+            for p, q in self.queues.items()
+        }
+
+
+outbound = OutboundScheduler(OUTBOUND_CONCURRENCY, OUTBOUND_RELAY_QUEUE_LIMIT, GLOBAL_RELAY_CONCURRENCY)
@@ -0,0 +1,115 @@
+import time
+import bisect
+
+import discord
+
+from bot.metrics import registry
+from bot.log import get_logger
+
+log = get_logger("pipeline")
+
+# ステージの優先度（小さいほど先に実行）
+MODERATION = 100
+RELAY = 500
+
+STAGE_SECONDS = registry.histogram(
+    "hunya_message_stage_seconds", "on_message の各ステージの処理時間", ("stage",)
+)
+MESSAGES = registry.counter("hunya_messages_total", "パイプラインに入ったメッセージ数")
+
+
+# --------------------------
+# メッセージ情報（1 メッセージにつき 1 回だけ作る）
+# --------------------------
+class MessageContext:
+    __slots__ = (
+        "message", "guild_id", "channel_id", "author_id",
+        "content", "has_attachments", "is_reply", "deleted",
+    )
+
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self.guild_id = message.guild.id
+        self.channel_id = message.channel.id
+        self.author_id = message.author.id
+        self.content = message.content
+        self.has_attachments = bool(message.attachments)
+        self.is_reply = message.reference is not None
+        # モデレーションで削除したら True（後のステージは中継しない）
+        self.deleted = False
+
+
+# --------------------------
+# ステージ
+# --------------------------
+class Stage:
+    __slots__ = ("priority", "name", "handler", "applies", "count", "total_ms", "max_ms")
+
+    def __init__(self, priority: int, name: str, handler, applies=None):
+        self.priority = priority
+        self.name = name
+        # handler(ctx) -> True を返すと後続のステージを実行しない
+        self.handler = handler
+        # applies(ctx) -> False ならこのステージは飛ばす（機能を使っていないギルドなど）
+        self.applies = applies
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def __lt__(self, other):
+        return self.priority < other.priority
+
+
+# --------------------------
+# パイプライン
+# --------------------------
+class MessagePipeline:
+    """
+    on_message を 1 か所にまとめる。各 Cog は cog_load で register() し、
+    cog_unload で unregister() する。
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def register(self, priority: int, name: str, handler, applies=None):
+        self.unregister(name)
+        bisect.insort(self.stages, Stage(priority, name, handler, applies))
+
+    def unregister(self, name: str):
+        self.stages = [s for s in self.stages if s.name != name]
+
+    async def dispatch(self, message: discord.Message):
+        MESSAGES.inc()
+        ctx = MessageContext(message)
+        for stage in self.stages:
+            if stage.applies is not None and not stage.applies(ctx):
+                continue
+
+            started = time.perf_counter()
+            try:
+                stop = await stage.handler(ctx)
+            except Exception:
+                log.exception(
+                    "%s で例外", stage.name,
+                    extra={"guild": ctx.guild_id, "channel": ctx.channel_id, "user": ctx.author_id, "handler": stage.name},
+                )
+                stop = False
+            elapsed = (time.perf_counter() - started) * 1000
+            STAGE_SECONDS.observe(elapsed / 1000, (stage.name,))
+            stage.count += 1
+            stage.total_ms += elapsed
+            if elapsed > stage.max_ms:
+                stage.max_ms = elapsed
+
+            if stop:
+                break
+
+    def stats(self):
+        return {
+            s.name: {"count": s.count, "total_ms": s.total_ms, "max_ms": s.max_ms}
+            for s in self.stages
+        }
+
+
+pipeline = MessagePipeline()
@@ -0,0 +1,482 @@
+import time
+import struct
+import asyncio
+from typing import NamedTuple
+
+import discord
+
+from bot.outbound import outbound, OutboundShed, RELAY, MODERATION
+from bot.log import get_logger
+
+WEBHOOK_NAME = "hunyaBOT Global"
+MAX_CONTENT = 2000
+
+log = get_logger("relay")
+
+
+DISCORD_EPOCH = 1420070400000
+# (channel_id, message_id) を 16 バイトで詰める。Bot として送ったものは message_id の最上位ビットを立てる
+COPY = struct.Struct("<QQ")
+VIA_BOT = 1 << 63
+# dict の 1 エントリ（キーの int・bytearray 本体を含む）のおおよそのバイト数
+ENTRY_OVERHEAD = 160
+# まとめた投稿の中身・添付のリンクを覚えておく件数（編集・削除の反映用、古いものから捨てる）
+TRACKED_MAX = 10000
+MERGED_USERNAME = "グローバルチャット"
+
+
+class RelayMessage(NamedTuple):
+    username: str
+    avatar_url: str
+    content: str
+    # 元メッセージの ID（まとめた投稿は 0、中身は parts）
+    source_id: int = 0
+    # 添付ファイル（bot.attachments.SharedAttachment）。中継先で共有し、他の投稿とはまとめない
+    files: tuple = ()
+    # ファイルとして送らない添付の URL（本文の後ろに付ける）
+    links: tuple = ()
+    # まとめた投稿の中身: ((source_id, username, content, links), ...)
+    parts: tuple = ()
+
+
+def with_links(content: str, links) -> str:
+    if not links:
+        return content
+    return "\n".join([content, *links] if content else links)[:MAX_CONTENT]
+
+
+def render_part(part, same_author: bool) -> str:
+    _, username, content, links = part
+    text = with_links(content, links)
+    return text if same_author else f"**{username}**\n{text}"
+
+
+class MergedCopy:
+    """まとめて送ったコピー 1 件の中身（元メッセージの編集・削除で書き直す）"""
+
+    __slots__ = ("username", "same_author", "parts")
+
+    def __init__(self, post: RelayMessage):
+        self.username = post.username
+        self.same_author = all(part[1] == post.username for part in post.parts)
+        self.parts = [list(part) for part in post.parts]
+
+    def edit(self, source_id: int, content: str):
+        for part in self.parts:
+            if part[0] == source_id:
+                part[2] = content
+
+    def remove(self, source_id: int):
+        self.parts = [part for part in self.parts if part[0] != source_id]
+
+    def render(self) -> str:
+        return "\n".join(render_part(part, self.same_author)[:MAX_CONTENT] for part in self.parts)[:MAX_CONTENT]
+
+
+def snowflake_time(snowflake: int) -> float:
+    return ((snowflake >> 22) + DISCORD_EPOCH) / 1000
+
+
+# --------------------------
+# 元メッセージ -> コピーの対応
+# --------------------------
+class CopyMap:
+    """
+    元メッセージ ID -> 中継したコピー。値はコピー 1 件 16 バイトの bytearray。
+
+    古い順（編集されたものは新しい側へ）に並べ、max_bytes を超えた分と
+    ttl 秒より前に送られた元メッセージの分を先頭から捨てる。
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = {}  # source_id -> bytearray
+        self.size = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, source_id: int, channel_id: int, message_id: int, via_bot: bool = False):
+        entry = self.entries.get(source_id)
+        if entry is None:
+            entry = self.entries[source_id] = bytearray()
+            self.size += ENTRY_OVERHEAD
+        entry += COPY.pack(channel_id, (message_id | VIA_BOT) if via_bot else message_id)
+        self.size += COPY.size
+        self.trim()
+
+    def unpack(self, entry):
+        return [(channel_id, message_id & ~VIA_BOT, bool(message_id & VIA_BOT))
+                for channel_id, message_id in COPY.iter_unpack(entry)]
+
+    def get(self, source_id: int):
+        """[(channel_id, message_id, via_bot), ...]"""
+        entry = self.entries.pop(source_id, None)
+        if entry is None:
+            return []
+        self.entries[source_id] = entry
+        return self.unpack(entry)
+
+    def pop(self, source_id: int):
+        entry = self.entries.pop(source_id, None)
+        if entry is None:
+            return []
+        self.size -= ENTRY_OVERHEAD + len(entry)
+        return self.unpack(entry)
+
+    def trim(self):
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            source_id = next(iter(self.entries))
+            if self.size <= self.max_bytes and snowflake_time(source_id) >= cutoff:
+                break
+            self.size -= ENTRY_OVERHEAD + len(self.entries.pop(source_id))
+            self.evicted += 1
+
+
+# --------------------------
+# 中継先ごとのキュー
+# --------------------------
+class RelayTarget:
+    def __init__(self, channel_id: int, queue_size: int):
+        self.channel_id = channel_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.worker = None
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+
+# --------------------------
+# 中継エンジン
+# --------------------------
+class RelayEngine:
+    """
+    グローバルチャットの送信担当。
+
+    中継先チャンネルごとにキューとワーカーを持つため、
+    遅い・レート制限中のサーバーがあっても他のサーバーへの配送は止まらない。
+    """
+
+    def __init__(
+        self,
+        bot,
+        mode: str,
+        concurrency: int,
+        queue_size: int,
+        merge_limit: int,
+        map_bytes: int,
+        map_ttl: float,
+        attachments=None,
+    ):
+        self.bot = bot
+        self.mode = mode
+        self.queue_size = queue_size
+        self.merge_limit = merge_limit
+        self.send_limit = asyncio.Semaphore(concurrency)
+        self.targets = {}   # channel_id -> RelayTarget
+        self.webhooks = {}  # channel_id -> discord.Webhook | None（作成不可）
+        self.copies = CopyMap(map_bytes, map_ttl)
+        self.merged = {}  # (channel_id, message_id) -> MergedCopy
+        self.links = {}   # 元メッセージ ID -> 添付のリンク（リンクで中継したものがあるときだけ）
+        self.attachments = attachments  # bot.attachments.AttachmentRelay（アップロード量の記録用）
+        self.edited = 0
+        self.deleted = 0
+        self.copy_failures = 0
+
+    # ---------- 投入 ----------
+    def submit(self, channel_id: int, item: RelayMessage):
+        target = self.targets.get(channel_id)
+        if target is None:
+            target = self.targets[channel_id] = RelayTarget(channel_id, self.queue_size)
+        if target.worker is None or target.worker.done():
+            target.worker = asyncio.create_task(self.run_target(target))
+
+        if item.links and item.source_id:
+            self.track(self.links, item.source_id, tuple(item.links))
+
+        if target.queue.full():
+            # 溢れたら一番古いものを捨てて新しいものを優先
+            target.queue.get_nowait()
+            target.dropped += 1
+        target.queue.put_nowait(item)
+
+    # ---------- ワーカー ----------
+    async def run_target(self, target: RelayTarget):
+        while True:
+            batch = [await target.queue.get()]
+            # 遅れている分はまとめて 1 回で送る
+            while len(batch) < self.merge_limit and not target.queue.empty():
+                batch.append(target.queue.get_nowait())
+
+            for post in self.merge(batch):
+                async with self.send_limit:
+                    try:
+                        sent = await self.deliver(target.channel_id, post)
+                        target.sent += 1
+                        if sent is not None and post.files and self.attachments is not None:
+                            self.attachments.uploaded(post.files)
+                        if sent is not None:
+                            self.remember(target.channel_id, post, *sent)
+                    except OutboundShed:
+                        # 優先度の高い送信が詰まっているので諦める
+                        target.dropped += 1
+                    except discord.HTTPException as e:
+                        target.failed += 1
+                        log.warning("送信失敗: %s", e, extra={"channel": target.channel_id})
+            target.merged += len(batch) - 1
+
+    def remember(self, channel_id: int, post: RelayMessage, message_id: int, via_bot: bool):
+        if post.parts:
+            # まとめた投稿は中身の元メッセージすべてから引けるようにする
+            for part in post.parts:
+                self.copies.add(part[0], channel_id, message_id, via_bot)
+            self.track(self.merged, (channel_id, message_id), MergedCopy(post))
+        elif post.source_id:
+            self.copies.add(post.source_id, channel_id, message_id, via_bot)
+
+    @staticmethod
+    def track(table: dict, key, value):
+        table[key] = value
+        while len(table) > TRACKED_MAX:
+            del table[next(iter(table))]
+
+    def merge(self, batch):
+        if len(batch) == 1:
+            return batch
+        if not any(item.files for item in batch):
+            return self.merge_text(batch)
+
+        # 添付ファイル付きはそのまま送り、間のテキストだけまとめる（順番は保つ）
+        posts, run = [], []
+        for item in batch:
+            if item.files:
+                if run:
+                    posts += self.merge_text(run) if len(run) > 1 else run
+                    run = []
+                posts.append(item)
+            else:
+                run.append(item)
+        if run:
+            posts += self.merge_text(run) if len(run) > 1 else run
+        return posts
+
+    def merge_text(self, batch):
+        posts = []
+        username, avatar_url = batch[0].username, batch[0].avatar_url
+        same_author = all(item.username == username for item in batch)
+        if not same_author:
+            username, avatar_url = MERGED_USERNAME, None
+
+        lines, parts = [], []
+        size = 0
+        for item in batch:
+            part = (item.source_id, item.username, item.content, tuple(item.links))
+            line = render_part(part, same_author)
+            if lines and size + len(line) + 1 > MAX_CONTENT:
+                posts.append(RelayMessage(username, avatar_url, "\n".join(lines), parts=tuple(parts)))
+                lines, parts, size = [], [], 0
+            lines.append(line[:MAX_CONTENT])
+            parts.append(part)
+            size += len(line) + 1
+        if lines:
+            posts.append(RelayMessage(username, avatar_url, "\n".join(lines), parts=tuple(parts)))
+        return posts
+
+    # ---------- 送信 ----------
+    async def deliver(self, channel_id: int, post: RelayMessage):
+        """送ったら (メッセージ ID, Bot として送ったか) を返す"""
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return None
+
+        content = with_links(post.content, post.links)
+        webhook = await self.get_webhook(channel) if self.mode == "webhook" else None
+        if webhook is None:
+            message = await outbound.run(
+                RELAY,
+                channel.guild.id,
+                lambda: channel.send(
+                    self.bot_content(post.username, content),
+                    files=[f.to_file() for f in post.files],
+                ),
+            )
+            return message.id, True
+
+        try:
+            # wait=True で送ったメッセージを受け取る（編集・削除の反映用）
+            message = await outbound.run(RELAY, channel.guild.id, lambda: webhook.send(
+                content,
+                username=post.username[:80],
+                avatar_url=post.avatar_url,
+                files=[f.to_file() for f in post.files],
+                wait=True,
+            ))
+            return message.id, False
+        except discord.NotFound:
+            # Webhook が削除されていたら次回作り直す
+            self.webhooks.pop(channel_id, None)
+            raise
+
+    @staticmethod
+    def bot_content(username: str, content: str) -> str:
+        return f"**{username}**\n{content}"[:MAX_CONTENT]
+
+    # ---------- 編集・削除の反映 ----------
+    async def edit_copies(self, source_id: int, username: str, content: str):
+        # リンクで中継した添付は元メッセージの本文に無いので付け直す
+        text = with_links(content, self.links.get(source_id, ()))
+        edits = []
+        for channel_id, message_id, via_bot in self.copies.get(source_id):
+            merged = self.merged.get((channel_id, message_id))
+            if merged is None:
+                edits.append(self.edit_copy(channel_id, message_id, via_bot, username, text))
+            else:
+                merged.edit(source_id, content)
+                edits.append(self.edit_copy(channel_id, message_id, via_bot, merged.username, merged.render()))
+        await asyncio.gather(*edits)
+
+    async def edit_copy(
+        self, channel_id: int, message_id: int, via_bot: bool, username: str, content: str, priority: int = RELAY
+    ):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return
+        if via_bot:
+            func = lambda: channel.get_partial_message(message_id).edit(content=self.bot_content(username, content))
+        else:
+            webhook = self.webhooks.get(channel_id)
+            if webhook is None:
+                return
+            func = lambda: webhook.edit_message(message_id, content=content[:MAX_CONTENT])
+        try:
+            await outbound.run(priority, channel.guild.id, func)
+            self.edited += 1
+        except (discord.HTTPException, OutboundShed) as e:
+            self.copy_failures += 1
+            log.debug("コピーの編集失敗: %s", e, extra={"channel": channel_id})
+
+    async def delete_copies(self, source_ids):
+        """チャンネルごとにまとめ、2 件以上なら一括削除する"""
+        by_channel = {}
+        touched = {}  # まとめた投稿: (channel_id, message_id) -> via_bot
+        for source_id in source_ids:
+            self.links.pop(source_id, None)
+            for channel_id, message_id, via_bot in self.copies.pop(source_id):
+                merged = self.merged.get((channel_id, message_id))
+                if merged is None:
+                    by_channel.setdefault(channel_id, []).append((message_id, via_bot))
+                else:
+                    merged.remove(source_id)
+                    touched[(channel_id, message_id)] = via_bot
+
+        # まとめた投稿は、消された元メッセージの分だけ取り除く（全部消えたら削除）
+        edits = []
+        for (channel_id, message_id), via_bot in touched.items():
+            merged = self.merged[(channel_id, message_id)]
+            if merged.parts:
+                edits.append(self.edit_copy(
+                    channel_id, message_id, via_bot, merged.username, merged.render(), MODERATION
+                ))
+            else:
+                del self.merged[(channel_id, message_id)]
+                by_channel.setdefault(channel_id, []).append((message_id, via_bot))
+
+        await asyncio.gather(*edits, *(
+            self.delete_in_channel(channel_id, messages) for channel_id, messages in by_channel.items()
+        ))
+
+    async def delete_in_channel(self, channel_id: int, messages):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return
+
+        # 荒らしの削除を早く広げるため、モデレーションと同じ優先度で流す
+        if len(messages) > 1:
+            try:
+                for i in range(0, len(messages), 100):
+                    objects = [discord.Object(id=message_id) for message_id, _ in messages[i:i + 100]]
+                    await outbound.run(
+                        MODERATION, channel.guild.id, lambda objects=objects: channel.delete_messages(objects)
+                    )
+                self.deleted += len(messages)
+                return
+            except discord.HTTPException:
+                # メッセージの管理権限が無い・14 日より古いなどは 1 件ずつ
+                pass
+            except OutboundShed:
+                return
+
+        await asyncio.gather(*(
+            self.delete_copy(channel, message_id, via_bot) for message_id, via_bot in messages
+        ))
+
+    async def delete_copy(self, channel, message_id: int, via_bot: bool):
+        webhook = None if via_bot else self.webhooks.get(channel.id)
+        if webhook is not None:
+            # Webhook のメッセージは権限が無くても消せる
+            func = lambda: webhook.delete_message(message_id)
+        else:
+            func = channel.get_partial_message(message_id).delete
+        try:
+            await outbound.run(MODERATION, channel.guild.id, func)
+            self.deleted += 1
+        except discord.NotFound:
+            pass
+        except (discord.HTTPException, OutboundShed) as e:
+            self.copy_failures += 1
+            log.debug("コピーの削除失敗: %s", e, extra={"channel": channel.id})
+
+    async def get_webhook(self, channel):
+        if channel.id in self.webhooks:
+            return self.webhooks[channel.id]
+
+        webhook = None
+        try:
+            for wh in await channel.webhooks():
+                if wh.name == WEBHOOK_NAME and wh.user == self.bot.user:
+                    webhook = wh
+                    break
+            if webhook is None:
+                webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+        except (discord.Forbidden, AttributeError):
+            # 権限が無い・Webhook 非対応のチャンネルは通常送信にフォールバック
+            webhook = None
+        except discord.HTTPException as e:
+            log.warning("Webhook 取得失敗: %s", e, extra={"guild": channel.guild.id, "channel": channel.id})
+            return None
+
+        self.webhooks[channel.id] = webhook
+        return webhook
+
+    # ---------- 状態 ----------
+    def stats(self):
+        return {
+            channel_id: {
+                "depth": target.queue.qsize(),
+                "sent": target.sent,
+                "merged": target.merged,
+                "dropped": target.dropped,
+                "failed": target.failed,
+            }
+            for channel_id, target in self.targets.items()
+        }
+
+    def copy_stats(self):
+        return {
+            "sources": len(self.copies),
+            "merged": len(self.merged),
+            "bytes": self.copies.size,
+            "evicted": self.copies.evicted,
+            "edited": self.edited,
+            "deleted": self.deleted,
+            "failures": self.copy_failures,
+        }
+
+    def close(self):
+        for target in self.targets.values():
+            if target.worker:
+                target.worker.cancel()
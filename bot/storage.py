@@ -0,0 +1,731 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.config import DATA_DIR, STORAGE_FLUSH_INTERVAL, STORAGE_BACKEND, SQLITE_PATH
+from bot.metrics import registry
+from bot.log import get_logger
+from bot.cluster import cluster
+from bot.config import CLUSTER_SOCKET
+from bot.ipc import request_sync
+
+log = get_logger("storage")
+
+FLUSH_SECONDS = registry.histogram("hunya_storage_flush_seconds", "ストレージの書き込み時間")
+# 書き込みに失敗したときの再試行の間隔の上限（秒）
+RETRY_MAX_DELAY = 60.0
+
+FLUSH_SIZE = registry.gauge("hunya_storage_last_flush_size", "最後の書き込みサイズ（JSON は文字数、SQLite はキー数）")
+
+
+# --------------------------
+# JSON バックエンド
+# --------------------------
+class JsonBackend:
+    """1 ストア = 1 ファイル。変更があればファイルごと書き直す"""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.data_dir, f"{name}.json")
+
+    def load(self, name: str, default):
+        path = self.path(name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return default
+
+    def names(self):
+        return [f[:-5] for f in os.listdir(self.data_dir) if f.endswith(".json")]
+
+    async def load_all(self):
+        # ファイルの読み込みはループの外で
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: {name: self.load(name, {}) for name in self.names()}
+        )
+
+    def prepare(self, name: str, data, keys):
+        # シリアライズはイベントループ上で行い、書きかけの dict を別スレッドで読まない
+        return json.dumps(data, indent=2, ensure_ascii=False)
+
+    def write(self, payloads):
+        size = 0
+        for name, text in payloads.items():
+            path = self.path(name)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+            size += len(text)
+        return size
+
+    def close(self):
+        pass
+
+
+# --------------------------
+# SQLite テーブル定義
+# --------------------------
+class Table:
+    """
+    ストア（dict）の 1 キーと SQLite の行の対応。
+
+    - key_columns: dict のキー "a:b" を分解して入れる列
+    - value_column: 値を入れる列（None なら値を JSON で data 列に入れる）
+    """
+
+    def __init__(self, table: str, key_columns, value_column=None, value_type="TEXT"):
+        self.table = table
+        self.key_columns = key_columns
+        self.value_column = value_column
+        self.value_type = value_type
+
+    def create(self, conn):
+        cols = ", ".join(f"{c} INTEGER NOT NULL" for c in self.key_columns)
+        value = self.value_column or "data"
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            f"({cols}, {value} {self.value_type}, PRIMARY KEY ({', '.join(self.key_columns)}))"
+        )
+
+    def split_key(self, key: str):
+        return tuple(int(part) for part in key.split(":"))
+
+    def encode(self, value):
+        if self.value_column:
+            return value
+        return json.dumps(value, ensure_ascii=False)
+
+    def decode(self, value):
+        if self.value_column:
+            return value if self.value_type == "TEXT" else str(value)
+        return json.loads(value)
+
+    def rows(self, key: str, value):
+        """ループ上で呼ぶ。(削除条件, 挿入する行のリスト) を返す"""
+        parts = self.split_key(key)
+        if value is None:
+            return parts, []
+        return parts, [parts + (self.encode(value),)]
+
+    def delete(self, conn, parts):
+        where = " AND ".join(f"{c} = ?" for c in self.key_columns)
+        conn.execute(f"DELETE FROM {self.table} WHERE {where}", parts)
+
+    def write(self, conn, parts, rows):
+        self.delete(conn, parts)
+        if not rows:
+            return
+        value = self.value_column or "data"
+        cols = ", ".join(self.key_columns + (value,))
+        marks = ", ".join("?" for _ in range(len(self.key_columns) + 1))
+        conn.executemany(f"INSERT OR REPLACE INTO {self.table} ({cols}) VALUES ({marks})", rows)
+
+    def clear(self, conn):
+        conn.execute(f"DELETE FROM {self.table}")
+
+    def load(self, conn):
+        value = self.value_column or "data"
+        data = {}
+        for row in conn.execute(f"SELECT {', '.join(self.key_columns)}, {value} FROM {self.table}"):
+            key = ":".join(str(part) for part in row[:-1])
+            data[key] = self.decode(row[-1])
+        return data
+
+
+class GlobalTable(Table):
+    """グローバルチャット: {ネットワーク名: ["guild:channel", ...]} をチャンネル単位の行で持つ"""
+
+    def __init__(self):
+        super().__init__("global_channels", ("guild_id", "channel_id"))
+
+    def create(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS global_channels ("
+            "network TEXT NOT NULL, guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, "
+            "position INTEGER NOT NULL, PRIMARY KEY (network, guild_id, channel_id))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS global_channels_channel ON global_channels (guild_id, channel_id)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS global_networks (network TEXT PRIMARY KEY)")
+
+    def rows(self, key: str, value):
+        if value is None:
+            return key, None
+        rows = []
+        for position, identifier in enumerate(value):
+            guild_id, channel_id = self.split_key(identifier)
+            rows.append((key, guild_id, channel_id, position))
+        return key, rows
+
+    def delete(self, conn, network):
+        conn.execute("DELETE FROM global_channels WHERE network = ?", (network,))
+        conn.execute("DELETE FROM global_networks WHERE network = ?", (network,))
+
+    def write(self, conn, network, rows):
+        self.delete(conn, network)
+        if rows is None:
+            return
+        conn.execute("INSERT INTO global_networks (network) VALUES (?)", (network,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO global_channels (network, guild_id, channel_id, position) "
+            "VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+    def clear(self, conn):
+        conn.execute("DELETE FROM global_channels")
+        conn.execute("DELETE FROM global_networks")
+
+    def load(self, conn):
+        data = {name: [] for (name,) in conn.execute("SELECT network FROM global_networks")}
+        for network, guild_id, channel_id in conn.execute(
+            "SELECT network, guild_id, channel_id FROM global_channels ORDER BY network, position"
+        ):
+            data.setdefault(network, []).append(f"{guild_id}:{channel_id}")
+        return data
+
+
+class KeyValueTable(Table):
+    """専用の定義が無いストア用。文字列キー + JSON 値"""
+
+    def __init__(self, table: str):
+        super().__init__(table, ("key",))
+
+    def create(self, conn):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, data TEXT)")
+
+    def split_key(self, key: str):
+        return (key,)
+
+    def load(self, conn):
+        return {key: json.loads(data) for key, data in conn.execute(f"SELECT key, data FROM {self.table}")}
+
+
+TABLES = {
+    "auto_roles": Table("auth_roles", ("guild_id",), "role_id", "INTEGER"),
+    "auth_codes": Table("auth_codes", ("user_id", "guild_id")),
+    "global": GlobalTable(),
+    "invite": Table("invite_settings", ("guild_id",)),
+}
+
+
+# --------------------------
+# SQLite バックエンド
+# --------------------------
+class SqliteBackend:
+    """
+    ギルド・チャンネル単位の行で保存する。変更されたキーの行だけを書き直す。
+
+    接続は専用スレッド 1 本だけで使う（作成・移行・読み込み・書き込みすべて）。
+    読み書きのトランザクションが混ざらず、sqlite3 の同一スレッドチェックもそのまま効く。
+    イベントループからは load_all() / write() をそのスレッドに回して待つだけ。
+    """
+
+    def __init__(self, data_dir: str, path: str):
+        self.data_dir = data_dir
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self.created = set()  # CREATE TABLE 済みのテーブル（専用スレッドだけが触る）
+        self.conn = self.call(self.connect, path)
+
+    def call(self, func, *args):
+        """ループの外（import 時・終了時）用。専用スレッドで実行して結果を待つ"""
+        return self.executor.submit(func, *args).result()
+
+    def connect(self, path: str):
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS migrated (name TEXT PRIMARY KEY)")
+        for table in TABLES.values():
+            table.create(conn)
+            self.created.add(table.table)
+        conn.commit()
+        return conn
+
+    # ---------- 読み込み ----------
+    def load(self, name: str, default):
+        data = self.call(self.read, name)
+        return data if data else default
+
+    async def load_all(self):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.read_all)
+
+    def names(self):
+        return self.call(self.read_names)
+
+    def read_names(self):
+        names = {name for (name,) in self.conn.execute("SELECT name FROM migrated")}
+        # 読み込まずに書いただけのストア（KeyValueTable）
+        names.update(
+            table[3:] for (table,) in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'kv\\_%' ESCAPE '\\'"
+            )
+        )
+        # まだ移行していない JSON ファイルも含める
+        names.update(f[:-5] for f in os.listdir(self.data_dir) if f.endswith(".json"))
+        return sorted(names | set(TABLES))
+
+    def read(self, name: str):
+        table = self.table(name)
+        self.ensure_table(table)
+        self.migrate(name, table)
+        return table.load(self.conn)
+
+    def read_all(self):
+        # 空のストアは入れない（open() の default を使わせる）
+        return {name: data for name in self.read_names() if (data := self.read(name))}
+
+    def table(self, name: str) -> Table:
+        # 定義を作るだけ（接続には触らないので、ループ上の prepare() からも呼べる）
+        if name not in TABLES:
+            TABLES[name] = KeyValueTable(f"kv_{name}")
+        return TABLES[name]
+
+    def ensure_table(self, table: Table):
+        if table.table not in self.created:
+            with self.conn:
+                table.create(self.conn)
+            self.created.add(table.table)
+
+    def migrate(self, name: str, table: Table):
+        """既存の JSON ファイルを 1 回だけ取り込む"""
+        if self.conn.execute("SELECT 1 FROM migrated WHERE name = ?", (name,)).fetchone():
+            return
+        path = os.path.join(self.data_dir, f"{name}.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self.conn:
+                for key, value in data.items():
+                    table.write(self.conn, *table.rows(key, value))
+            os.replace(path, f"{path}.migrated")
+            log.info("%s を SQLite に移行しました（%d 件）", path, len(data))
+        with self.conn:
+            self.conn.execute("INSERT INTO migrated (name) VALUES (?)", (name,))
+
+    # ---------- 書き込み ----------
+    def prepare(self, name: str, data, keys):
+        table = self.table(name)
+        if keys is None:
+            # キー指定なしの変更はストア全体を書き直す
+            return table, None, [table.rows(k, v) for k, v in data.items()]
+        return table, keys, [table.rows(k, data.get(k)) for k in keys]
+
+    def write(self, payloads):
+        """専用スレッドで呼ばれる"""
+        for table, _, _ in payloads.values():
+            self.ensure_table(table)
+        count = 0
+        with self.conn:
+            for name, (table, keys, changes) in payloads.items():
+                if keys is None:
+                    table.clear(self.conn)
+                for target, rows in changes:
+                    table.write(self.conn, target, rows)
+                    count += 1
+        return count
+
+    def write_sync(self, payloads):
+        return self.call(self.write, payloads)
+
+    def close(self):
+        self.call(self.conn.close)
+        self.executor.shutdown(wait=True)
+
+
+# --------------------------
+# クラスタのワーカー用バックエンド
+# --------------------------
+class RemoteBackend:
+    """
+    読み書きをランチャー（ストレージを持つ唯一のプロセス）に頼む。
+    ディスクには触らず、変更したキーの値だけを IPC で送る。
+    """
+
+    # write() はソケットに積むだけなので、スレッドに回さずループ上で呼ぶ
+    inline = True
+
+    def __init__(self, path: str, bus):
+        self.path = path
+        self.bus = bus
+        # ハブとの接続が切れている間の変更。再接続したら順に送る（ループを止めて待たない）
+        self.queue = []
+        self.written = {}  # name -> 送った（ためた）変更の数。resync() で追い越しを見分ける
+        bus.reconnected.append(self.resend)
+
+    def load(self, name: str, default):
+        # preload() していないとき用（ループを使わずに取りに行く）
+        return request_sync(self.path, "store.load", {"name": name, "default": default})
+
+    async def load_all(self):
+        """ランチャーにある全ストア。応答が大きくなりすぎないよう 1 つずつ取る"""
+        data = {}
+        for name in await self.bus.request(None, "store.names"):
+            data[name] = await self.bus.request(None, "store.load", {"name": name, "default": {}})
+        return data
+
+    def prepare(self, name: str, data, keys):
+        if keys is None:
+            return {"name": name, "all": data}
+        return {
+            "name": name,
+            "set": {key: data[key] for key in keys if key in data},
+            "delete": [key for key in keys if key not in data],
+        }
+
+    def write(self, payloads):
+        size = 0
+        for payload in payloads.values():
+            self.written[payload["name"]] = self.written.get(payload["name"], 0) + 1
+            if self.loop_running():
+                # ここで JSON にするので、送った後に dict が変わっても影響しない。
+                # 切断中（または先にためたものがある間）は順番を守ってためる
+                if self.queue or not self.bus.send(None, "store.write", payload):
+                    self.queue.append(encode_payload(payload))
+            else:
+                # 終了時（ループ停止後）は接続し直して送る
+                self.send_queue_sync()
+                request_sync(self.path, "store.write", payload)
+            size += payload_size(payload)
+        return size
+
+    def resend(self):
+        count = len(self.queue)
+        while self.queue and self.bus.send(None, "store.write", json.loads(self.queue[0])):
+            self.queue.pop(0)
+        if count:
+            log.info("切断中の変更 %d 件を送りました", count - len(self.queue))
+
+    def send_queue_sync(self):
+        while self.queue:
+            request_sync(self.path, "store.write", json.loads(self.queue[0]))
+            self.queue.pop(0)
+
+    @staticmethod
+    def loop_running() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def close(self):
+        self.send_queue_sync()
+
+
+def encode_payload(payload: dict) -> str:
+    # ためておく間に元の dict が書き換わらないよう、その時点の値で固める
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def payload_size(payload: dict) -> int:
+    if "all" in payload:
+        return len(payload["all"])
+    if "ops" in payload:
+        return len(payload["ops"])
+    return len(payload["set"]) + len(payload["delete"])
+
+
+# --------------------------
+# リストの値への操作
+# --------------------------
+def apply_op(data: dict, key: str, op: str, value=None) -> bool:
+    """
+    "create": 空のリストを作る / "add": 無ければ追加 / "remove": あれば削除。
+    何度適用しても結果が同じなので、同じ操作が 2 回届いても壊れない。変わったら True
+    """
+    if op == "create":
+        if key in data:
+            return False
+        data[key] = []
+        return True
+    items = data.setdefault(key, [])
+    if op == "add":
+        if value in items:
+            return False
+        items.append(value)
+        return True
+    if op == "remove":
+        if value not in items:
+            return False
+        items.remove(value)
+        return True
+    raise ValueError(f"unknown op: {op}")
+
+
+# --------------------------
+# 共有ストレージ
+# --------------------------
+class Storage:
+    """
+    全 Cog 共通のストレージ。
+
+    データはメモリ上の dict をそのまま使い、変更したら mark_dirty() を呼ぶ。
+    key を渡すと SQLite バックエンドではその行だけを書き直す。
+    ディスクへの書き込みはバックグラウンドでまとめて行う。
+    """
+
+    def __init__(
+        self,
+        data_dir: str = DATA_DIR,
+        interval: float = STORAGE_FLUSH_INTERVAL,
+        backend: str = STORAGE_BACKEND,
+    ):
+        self.data_dir = data_dir
+        self.interval = interval
+        os.makedirs(data_dir, exist_ok=True)
+        if cluster.enabled:
+            self.backend = RemoteBackend(CLUSTER_SOCKET, cluster.bus)
+            # ディスクへの書き込みはランチャーがまとめるので、他のワーカーにはすぐ伝える
+            self.interval = min(interval, 0.1)
+            # 切断中に届かなかった他のワーカーの変更を取り直す（ためた送信を流した後）
+            cluster.bus.reconnected.append(lambda: asyncio.get_running_loop().create_task(self.resync()))
+        elif backend == "sqlite":
+            self.backend = SqliteBackend(data_dir, SQLITE_PATH)
+        else:
+            self.backend = JsonBackend(data_dir)
+        self.stores = {}   # name -> dict
+        self.dirty = {}    # name -> 変更されたキーの set（None ならストア全体）
+        self.watchers = {}  # name -> [callback(keys)]（他のプロセスでの変更の通知）
+        self.task = None
+        self.lock = None
+        self.failures = 0  # 続けて書き込みに失敗した回数
+        # preload() で読んだ、まだ open() されていないストア
+        self.preloaded = None
+        self.backlog = None  # preload() の応答待ちの間に届いた変更
+        # 最後の書き込み結果
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.last_flush_size = 0
+
+    # ---------- 読み込み ----------
+    def open(self, name: str, default):
+        """同じ name なら同じオブジェクトを返す（起動時に 1 回だけディスクを読む）"""
+        if name not in self.stores:
+            if self.preloaded is not None:
+                # 先読みに無い = ランチャーにもまだ無いストア
+                self.stores[name] = self.preloaded.pop(name, default)
+            else:
+                self.stores[name] = self.backend.load(name, default)
+        return self.stores[name]
+
+    async def preload(self):
+        """
+        Cog のロード（import 時の open()）より前に全ストアを非同期で読んでおく。
+        これをしないと open() がループの中でディスクの読み込み（ワーカーなら同期通信）をしてしまう。
+        """
+        self.backlog = []
+        loaded = await self.backend.load_all()
+        # 応答待ちの間に届いた変更を順に重ねる（応答に含まれている変更をもう一度適用しても結果は同じ）
+        for payload in self.backlog:
+            self.merge(loaded.setdefault(payload["name"], {}), payload)
+        self.backlog = None
+        self.preloaded = loaded
+        log.info("ストア先読み %d 個", len(loaded))
+
+    def names(self):
+        """ランチャー用。全ストアの名前（preload() 済みならディスクは読まない）"""
+        if self.preloaded is not None:
+            return sorted(set(self.stores) | set(self.preloaded))
+        return sorted(set(self.backend.names()) | set(self.stores))
+
+    # ---------- 書き込み予約 ----------
+    def mark_dirty(self, name: str, key: str = None):
+        if key is None:
+            self.dirty[name] = None
+        elif name not in self.dirty:
+            self.dirty[name] = {key}
+        elif self.dirty[name] is not None:
+            self.dirty[name].add(key)
+
+        if self.task is None or self.task.done():
+            try:
+                self.task = asyncio.get_running_loop().create_task(self.flush_later())
+            except RuntimeError:
+                # ループ外（起動前など）はその場で書く
+                self.flush_sync()
+
+    def change(self, name: str, key: str, op: str, value=None) -> bool:
+        """
+        リストの値を apply_op() で変更する。複数のワーカーが同じキーを同時に変えうるときに使う。
+        クラスタでは値ではなく操作をランチャーに送り、ランチャーが自分のデータに適用してから
+        他のワーカーに配る（値ごと送ると後から書いた方で上書きされ、先の変更が消える）。
+        """
+        changed = apply_op(self.open(name, {}), key, op, value)
+        if isinstance(self.backend, RemoteBackend):
+            # 変わらなくても送る（ランチャー側ではまだ無いかもしれない）
+            self.backend.write({name: {"name": name, "ops": [[key, op, value]]}})
+        elif changed:
+            self.mark_dirty(name, key)
+        return changed
+
+    async def flush_later(self, delay: float = None):
+        # 少し待って、その間の変更を 1 回の書き込みにまとめる
+        await asyncio.sleep(self.interval if delay is None else delay)
+        ok = await self.flush()
+        if self.dirty:
+            # 書き込み中に変更されたもの・失敗したものを予約し直す（このタスクが動いている間は
+            # mark_dirty() が予約しないため）。失敗が続くときは間隔を延ばす
+            delay = self.interval if ok else min(self.interval * 2 ** self.failures, RETRY_MAX_DELAY)
+            self.task = asyncio.get_running_loop().create_task(self.flush_later(delay))
+
+    async def resync(self):
+        """
+        クラスタのワーカー用。再接続後にランチャーの値を取り直し、違うキーだけ反映する。
+        まだ送っていない変更のあるキーと、取り直している間に書いたストアはそのまま（自分の方が新しい）。
+        """
+        bus = self.backend.bus
+        for name in list(self.stores):
+            written = self.backend.written.get(name, 0)
+            try:
+                remote = await bus.request(None, "store.load", {"name": name, "default": {}})
+            except (ConnectionError, asyncio.TimeoutError):
+                # また切れた。次の再接続でやり直す
+                return
+            dirty = self.dirty.get(name, set())
+            if dirty is None or self.backend.written.get(name, 0) != written:
+                continue
+            local = self.stores[name]
+            keys = [k for k in set(local) | set(remote) if k not in dirty and local.get(k) != remote.get(k)]
+            if keys:
+                self.apply({
+                    "name": name,
+                    "set": {k: remote[k] for k in keys if k in remote},
+                    "delete": [k for k in keys if k not in remote],
+                })
+                log.info("%s を再同期しました（%d キー）", name, len(keys))
+
+    # ---------- 他のプロセスでの変更 ----------
+    def watch(self, name: str, callback):
+        """callback(keys): 変わったキーのリスト（None ならストア全体）"""
+        self.watchers.setdefault(name, []).append(callback)
+
+    def unwatch(self, name: str, callback):
+        callbacks = self.watchers.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def apply(self, payload: dict, mark: bool = False):
+        """
+        RemoteBackend.prepare() / change() の形の変更を反映する。Cog が持っている dict をそのまま書き換える。
+        mark=True（ランチャー）ならディスクへの書き込みも予約する。
+        """
+        name = payload["name"]
+        data = self.stores.get(name)
+        if data is None:
+            if not mark:
+                if self.backlog is not None:
+                    self.backlog.append(payload)
+                elif self.preloaded is not None:
+                    # 先読みしたがまだ open() されていないストア
+                    self.merge(self.preloaded.setdefault(name, {}), payload)
+                # それ以外はこのプロセスでは使っていないストア
+                return
+            data = self.open(name, {})
+
+        keys = self.merge(data, payload)
+
+        if mark:
+            for key in keys if keys is not None else (None,):
+                self.mark_dirty(name, key)
+        for callback in self.watchers.get(name, ()):
+            callback(keys)
+
+    @staticmethod
+    def merge(data: dict, payload: dict):
+        """payload を data に適用して、変わったキーのリスト（None ならストア全体）を返す"""
+        if "all" in payload:
+            data.clear()
+            data.update(payload["all"])
+            return None
+        if "ops" in payload:
+            for key, op, value in payload["ops"]:
+                apply_op(data, key, op, value)
+            return [key for key, _, _ in payload["ops"]]
+        data.update(payload["set"])
+        for key in payload["delete"]:
+            data.pop(key, None)
+        return [*payload["set"], *payload["delete"]]
+
+    # ---------- 書き込み ----------
+    def snapshot(self):
+        dirty, self.dirty = self.dirty, {}
+        return {
+            name: self.backend.prepare(name, self.stores[name], keys)
+            for name, keys in dirty.items() if name in self.stores
+        }
+
+    def record(self, started: float, size: int):
+        self.flush_count += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.last_flush_size = size
+        FLUSH_SECONDS.observe(self.last_flush_ms / 1000)
+        FLUSH_SIZE.set(size)
+
+    async def flush(self) -> bool:
+        """失敗したら False（変更は dirty に戻す）"""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            payloads = self.snapshot()
+            if not payloads:
+                return True
+            started = time.perf_counter()
+            executor = getattr(self.backend, "executor", None)
+            try:
+                if getattr(self.backend, "inline", False):
+                    size = self.backend.write(payloads)
+                else:
+                    size = await asyncio.get_running_loop().run_in_executor(
+                        executor, self.backend.write, payloads
+                    )
+            except (OSError, sqlite3.Error) as e:
+                # 失敗したものは次回ストア全体を書き直す
+                for name in payloads:
+                    self.dirty[name] = None
+                self.failures += 1
+                log.error("書き込み失敗（%d 回目）: %s", self.failures, e)
+                return False
+            self.failures = 0
+            self.record(started, size)
+            return True
+
+    def flush_sync(self):
+        """終了時用。ループが止まった後でも呼べる"""
+        payloads = self.snapshot()
+        if not payloads:
+            return
+        started = time.perf_counter()
+        # SQLite は接続を持つスレッドで書く
+        size = getattr(self.backend, "write_sync", self.backend.write)(payloads)
+        self.record(started, size)
+
+    def close_sync(self):
+        self.flush_sync()
+        self.backend.close()
+
+    async def close(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        await self.flush()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "stores": len(self.stores),
+            "dirty": len(self.dirty),
+            "flush_count": self.flush_count,
+            "last_flush_ms": self.last_flush_ms,
+            # JSON は書き込んだ文字数、SQLite は書き直したキー数
+            "last_flush_size": self.last_flush_size,
+        }
+
+
+storage = Storage()
@@ -0,0 +1,100 @@
+import time
+import heapq
+import asyncio
+
+from bot.storage import storage
+from bot.log import get_logger
+
+log = get_logger("timers")
+
+
+# --------------------------
+# 期限付きタスクのスケジューラ
+# --------------------------
+class DeadlineScheduler:
+    """
+    key ごとに期限を 1 つ持ち、期限が来たものを callback(batch) でまとめて処理する。
+
+    期限はヒープで管理し、動いているタスクは 1 本だけ。
+    エントリは storage に保存するので、再起動後も期限は守られる（過ぎていたら起動直後に処理）。
+    ready を渡すと、最初に取り出す前にそれを待つ（起動直後はギルドがまだキャッシュに無く、
+    取り出した時点で保存からも消えるので、その前に処理すると失われる）。
+    """
+
+    def __init__(self, store_name: str, callback, batch_size: int = 50, owns=None, ready=None):
+        self.store_name = store_name
+        self.callback = callback
+        self.batch_size = batch_size
+        self.ready = ready
+        # key -> {"deadline": unix 時刻, ...任意のデータ}
+        self.entries = storage.open(store_name, {})
+        # owns(key) が False のもの（クラスタで他のワーカーが受け持つ分）は扱わない
+        self.heap = [
+            (entry["deadline"], key) for key, entry in self.entries.items()
+            if owns is None or owns(key)
+        ]
+        heapq.heapify(self.heap)
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    # ---------- 登録・取消 ----------
+    def schedule(self, key: str, deadline: float, **data):
+        self.entries[key] = {"deadline": deadline, **data}
+        heapq.heappush(self.heap, (deadline, key))
+        storage.mark_dirty(self.store_name, key)
+        self.wakeup.set()
+
+    def cancel(self, key: str) -> bool:
+        # ヒープからは消さず、取り出したときに読み飛ばす
+        if self.entries.pop(key, None) is None:
+            return False
+        storage.mark_dirty(self.store_name, key)
+        return True
+
+    # ---------- 実行 ----------
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def pop_due(self, now: float):
+        batch = []
+        while self.heap and len(batch) < self.batch_size:
+            deadline, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is None or entry["deadline"] != deadline:
+                # 取消・再登録済み
+                heapq.heappop(self.heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self.heap)
+            del self.entries[key]
+            storage.mark_dirty(self.store_name, key)
+            batch.append((key, entry))
+        return batch
+
+    async def run(self):
+        if self.ready is not None:
+            await self.ready()
+        while True:
+            self.wakeup.clear()
+            batch = self.pop_due(time.time())
+            if batch:
+                try:
+                    await self.callback(batch)
+                except Exception:
+                    log.exception("%s の処理失敗", self.store_name)
+                continue
+
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
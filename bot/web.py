@@ -0,0 +1,63 @@
+import logging
+
+from aiohttp import web
+
+from bot.config import WEB_HOST, WEB_PORT, WEB_ACCESS_LOG
+from bot.log import get_logger
+
+log = get_logger("web")
+
+
+# --------------------------
+# Web サーバー（OAuth コールバックなど）
+# --------------------------
+class WebServer:
+    """
+    Bot と同じイベントループで動く aiohttp サーバー。
+
+    ルートは add_route() でいつでも追加・削除できる（Cog のリロードに対応するため、
+    aiohttp のルーターではなく自前の dict で振り分ける）。
+    """
+
+    def __init__(self, host: str = WEB_HOST, port: int = WEB_PORT, access_log: bool = WEB_ACCESS_LOG):
+        self.host = host
+        self.port = port
+        self.access_log = access_log
+        self.routes = {}  # (method, path) -> handler
+        self.runner = None
+
+    def add_route(self, method: str, path: str, handler):
+        self.routes[(method.upper(), path)] = handler
+
+    def remove_route(self, method: str, path: str):
+        self.routes.pop((method.upper(), path), None)
+
+    async def dispatch(self, request: web.Request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            raise web.HTTPNotFound()
+        return await handler(request)
+
+    # ---------- 起動・停止 ----------
+    async def start(self):
+        if self.runner is not None:
+            return
+
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.dispatch)
+        self.runner = web.AppRunner(
+            app,
+            access_log=logging.getLogger("aiohttp.access") if self.access_log else None,
+        )
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log.info("サーバー起動 %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self.runner is None:
+            return
+        await self.runner.cleanup()
+        self.runner = None
+
+
+server = WebServer()
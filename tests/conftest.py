@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# bot.storage などは import 時にデータディレクトリを開くので、先に一時ディレクトリへ向ける
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="hunya-test-"))
+os.environ.setdefault("METRICS_PORT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+import time
+import asyncio
+from email.utils import formatdate
+
+import aiohttp
+from aiohttp import web
+
+import bot.cogs.auth as auth
+from bench.fakes import RecordingHTTP, FakeBot
+from bench.run import free_port
+from bot.cogs.auth import AuthCog, retry_after_seconds, TOKEN_FAILURES
+from bot.timers import DeadlineScheduler
+
+
+def test_retry_after_seconds_form():
+    assert retry_after_seconds("3", 0.5) == 3.0
+    assert retry_after_seconds("1.5", 0.5) == 1.5
+
+
+def test_retry_after_http_date_form():
+    delay = retry_after_seconds(formatdate(time.time() + 30, usegmt=True), 0.5)
+    assert 28 <= delay <= 31
+
+
+def test_retry_after_falls_back_to_backoff():
+    assert retry_after_seconds(None, 2.0) == 2.0
+    assert retry_after_seconds("soon", 2.0) == 2.0
+    assert retry_after_seconds("nan", 2.0) == 2.0
+    assert retry_after_seconds("-1", 2.0) == 2.0
+    # 過去の日付
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT", 2.0) == 2.0
+
+
+def test_overdue_expiry_waits_until_ready():
+    async def main():
+        ready = asyncio.Event()
+        handled = []
+
+        async def callback(batch):
+            handled.extend(key for key, _ in batch)
+
+        scheduler = DeadlineScheduler("test_expiry_ready", callback, ready=ready.wait)
+        scheduler.schedule("1:2", time.time() - 10, role=3)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        # 準備ができるまでは取り出さない（保存からも消さない）
+        assert handled == [] and "1:2" in scheduler.entries
+        ready.set()
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        return handled
+
+    assert asyncio.run(main()) == ["1:2"]
+
+
+def test_expiry_for_uncached_guild_is_rescheduled():
+    async def main():
+        cog = AuthCog(FakeBot(RecordingHTTP()))
+        deadline = time.time() - 10
+        await cog.expire_roles([("1:2", {"deadline": deadline, "role": 3})])
+        return cog.expiry.entries
+
+    entries = asyncio.run(main())
+    entry = entries["1:2"]
+    assert entry["deadline"] > time.time()
+    assert entry["due"] < time.time() and entry["role"] == 3
+
+
+def test_non_json_token_response_fails_cleanly(monkeypatch):
+    async def main():
+        async def token(request):
+            # プロキシのエラーページ
+            return web.Response(status=403, text="<html>Access denied</html>", content_type="text/html")
+
+        app = web.Application()
+        app.router.add_post("/token", token)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        monkeypatch.setattr(auth, "TOKEN_URL", f"http://127.0.0.1:{port}/token")
+
+        bot = FakeBot(RecordingHTTP())
+        guild = bot.add_guild()
+        member = guild.add_member()
+        cog = AuthCog(bot)
+        cog.session = aiohttp.ClientSession()
+        failures = TOKEN_FAILURES.values.get((), 0)
+        try:
+            result = await cog.complete_oauth("code", f"{member.id}:{guild.id}")
+            # 失敗したコードは「処理中」のまま残らない
+            status = cog.auth_codes.claim(f"{member.id}:{guild.id}", "code")
+        finally:
+            await cog.session.close()
+            await runner.cleanup()
+        return result, status, TOKEN_FAILURES.values.get((), 0) - failures
+
+    result, status, failures = asyncio.run(main())
+    assert result[0] == "failed"
+    assert status == "new"
+    assert failures == 1
@@ -0,0 +1,132 @@
+import asyncio
+
+from bench.fakes import RecordingHTTP, FakeBot
+from bot.cogs.auth import AuthCog, AuthSweep
+from bot.outbound import outbound
+
+
+class FakeState:
+    """ConnectionState の代わり。チャンクを 1 つずつ間を空けて届ける"""
+
+    def __init__(self, guild, chunk_size=100, delay=0.01):
+        self.guild = guild
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self._chunk_requests = {}
+        self.delivered = 0
+
+    def _get_guild(self, guild_id):
+        return self.guild
+
+    async def chunker(self, guild_id, nonce=None):
+        asyncio.create_task(self.deliver(nonce))
+
+    async def deliver(self, nonce):
+        members = list(self.guild.members.values())
+        request = self._chunk_requests[nonce]
+        for i in range(0, len(members), self.chunk_size):
+            await asyncio.sleep(self.delay)
+            self.delivered += 1
+            request.add_members(members[i:i + self.chunk_size])
+        request.done()
+
+
+def make_guild(bot, members):
+    guild = bot.add_guild()
+    guild.chunked = False
+    guild.shard_id = 0
+    guild.role = guild.add_role("auth")
+    for i in range(members):
+        guild.add_member(f"m{i}")
+    guild.member_count = members
+    guild._state = FakeState(guild)
+    return guild
+
+
+def sweep(cog, guild, dry_run=False, remove=True, page_size=100):
+    state = AuthSweep.new_state(guild.role.id, dry_run, remove)
+    cog.sweep_states[str(guild.id)] = state
+    return AuthSweep(cog, guild, state, concurrency=4, page_size=page_size)
+
+
+def test_first_sweep_records_existing_holders_instead_of_removing():
+    async def main():
+        outbound.start()
+        bot = FakeBot(RecordingHTTP())
+        guild = make_guild(bot, 300)
+        members = list(guild.members.values())
+        for member in members[:200]:
+            member.roles.append(guild.role)
+        cog = AuthCog(bot)
+        cog.record_verified(guild.id, members[250].id)
+
+        first = sweep(cog, guild)
+        await first.run()
+        assert first.state["removed"] == 0
+        assert first.state["recorded"] == 200
+        assert first.state["added"] == 1
+        assert cog.has_verified_history(guild.id)
+
+        # 記録が始まった後にロールだけ持っている人は外す
+        members[260].roles.append(guild.role)
+        second = sweep(cog, guild)
+        await second.run()
+        assert second.state["removed"] == 1
+        assert second.state["recorded"] == 0
+        outbound.stop()
+        return bot.http
+
+    http = asyncio.run(main())
+    assert http.count("add_roles") == 1
+    assert http.count("remove_roles") == 1
+
+
+def test_pages_are_processed_while_chunks_arrive():
+    async def main():
+        bot = FakeBot(RecordingHTTP())
+        guild = make_guild(bot, 1000)
+        cog = AuthCog(bot)
+        job = sweep(cog, guild, dry_run=True)
+        seen = []
+        save = job.save
+
+        def record_progress():
+            seen.append((job.state["checked"], guild._state.delivered))
+            save()
+
+        job.save = record_progress
+        await job.run()
+        return seen, job.state
+
+    seen, state = asyncio.run(main())
+    assert state["checked"] == 1000
+    # 最初のページは最後のチャンクが届く前に処理している
+    assert seen[0][0] == 100 and seen[0][1] < 10
+
+
+def test_sweep_prunes_records_of_departed_members():
+    async def main():
+        outbound.start()
+        bot = FakeBot(RecordingHTTP())
+        guild = make_guild(bot, 50)
+        member = next(iter(guild.members.values()))
+        cog = AuthCog(bot)
+        cog.mark_verified_history(guild.id)
+        present = f"{guild.id}:{member.id}"
+        departed = f"{guild.id}:1"
+        other_guild = "1:1"
+        cog.verified.update({present: 1, departed: 1, other_guild: 1})
+
+        dry = sweep(cog, guild, dry_run=True)
+        await dry.run()
+        assert dry.state["pruned"] == 1 and departed in cog.verified
+
+        job = sweep(cog, guild)
+        await job.run()
+        outbound.stop()
+        return job.state, cog.verified, (present, departed, other_guild)
+
+    state, verified, (present, departed, other_guild) = asyncio.run(main())
+    assert state["pruned"] == 1
+    assert present in verified and other_guild in verified
+    assert departed not in verified
@@ -0,0 +1,33 @@
+import asyncio
+
+from bot import ipc
+from bot.ipc import IpcHub, IpcClient
+
+
+def test_client_reconnects_after_hub_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(ipc, "RECONNECT_MIN_DELAY", 0.01)
+
+    async def main():
+        path = str(tmp_path / "hub.sock")
+        hub = IpcHub(path)
+        hub.on("echo", lambda data, frame: data)
+        await hub.start()
+        client = IpcClient(path, 0)
+        reconnected = asyncio.Event()
+        client.reconnected.append(reconnected.set)
+        await client.connect()
+        assert await client.request(None, "echo", 1) == 1
+
+        await hub.stop()
+        await asyncio.sleep(0.05)
+        assert not client.connected
+        assert not client.send(None, "echo", 2)
+
+        await hub.start()
+        await asyncio.wait_for(reconnected.wait(), 2.0)
+        result = await client.request(None, "echo", 3)
+        client.close()
+        await hub.stop()
+        return result
+
+    assert asyncio.run(main()) == 3
@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+from discord import app_commands
+
+from bot.cogs.metrics import MetricsCog, APP_COMMAND_SECONDS
+
+
+class FakeTree:
+    def __init__(self):
+        self.errors = []
+
+    async def interaction_check(self, interaction):
+        return True
+
+    async def on_error(self, interaction, error):
+        self.errors.append(error)
+
+
+def count(labels):
+    data = APP_COMMAND_SECONDS.values.get(labels)
+    return sum(data[:-1]) if data else 0
+
+
+def test_app_commands_are_timed_with_outcome():
+    async def main():
+        bot = SimpleNamespace(tree=FakeTree())
+        tree = bot.tree
+        cog = MetricsCog(bot)
+        cog.hook_tree()
+        command = SimpleNamespace(name="metrics_test", qualified_name="metrics_test")
+
+        ok = SimpleNamespace(extras={}, command=command)
+        assert await tree.interaction_check(ok)
+        await asyncio.sleep(0.02)
+        await cog.on_app_command_completion(ok, command)
+
+        failed = SimpleNamespace(extras={}, command=command)
+        await tree.interaction_check(failed)
+        await tree.on_error(failed, app_commands.CommandInvokeError(command, RuntimeError("boom")))
+
+        denied = SimpleNamespace(extras={}, command=command)
+        await tree.interaction_check(denied)
+        await tree.on_error(denied, app_commands.CheckFailure())
+        return tree
+
+    tree = asyncio.run(main())
+    assert count(("metrics_test", "ok")) == 1
+    assert count(("metrics_test", "error")) == 1
+    assert count(("metrics_test", "check_failed")) == 1
+    # 処理時間はハンドラの分だけ（作成時刻からではない）
+    assert 0.02 <= APP_COMMAND_SECONDS.values[("metrics_test", "ok")][-1] < 1.0
+    # 元の on_error も呼ばれる
+    assert len(tree.errors) == 2
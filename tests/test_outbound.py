@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from bot.outbound import OutboundScheduler, MODERATION, RELAY
+
+
+def test_moderation_not_blocked_by_slow_relay():
+    async def main():
+        scheduler = OutboundScheduler(concurrency=8, relay_limit=100, relay_concurrency=4)
+        scheduler.start()
+
+        async def slow_relay():
+            # 429 の Retry-After を待っている送信の代わり
+            await asyncio.sleep(2.0)
+
+        async def moderation():
+            return "deleted"
+
+        relays = [scheduler.submit(RELAY, i, slow_relay) for i in range(20)]
+        await asyncio.sleep(0.05)
+        assert scheduler.queues[RELAY].in_flight == 4
+
+        started = time.perf_counter()
+        result = await asyncio.wait_for(scheduler.run(MODERATION, 1, moderation), 0.5)
+        assert result == "deleted"
+        assert time.perf_counter() - started < 0.2
+
+        scheduler.stop()
+        for future in relays:
+            future.cancel()
+
+    asyncio.run(main())
+
+
+def test_relay_cap_releases_workers():
+    async def main():
+        scheduler = OutboundScheduler(concurrency=4, relay_limit=100, relay_concurrency=2)
+        scheduler.start()
+        peak = 0
+
+        async def relay():
+            nonlocal peak
+            peak = max(peak, scheduler.queues[RELAY].in_flight)
+            await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(asyncio.gather(*(scheduler.run(RELAY, i % 3, relay) for i in range(20))), 2.0)
+        assert peak == 2
+        assert scheduler.queues[RELAY].in_flight == 0
+        scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_relay_fan_out_runs_in_parallel():
+    async def main():
+        scheduler = OutboundScheduler(concurrency=8, relay_limit=100, relay_concurrency=16)
+
+        async def send():
+            await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        # 1 メッセージを 16 チャンネルへ: 一番遅い送信が 1 回分の時間で終わる
+        await asyncio.gather(*(scheduler.run(RELAY, i, send) for i in range(16)))
+        elapsed = time.perf_counter() - started
+        scheduler.stop()
+        return elapsed
+
+    assert asyncio.run(main()) < 0.09
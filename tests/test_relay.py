@@ -0,0 +1,88 @@
+import time
+import asyncio
+
+from bench.fakes import RecordingHTTP, FakeBot
+from bot.outbound import outbound
+from bot.relay import RelayEngine, RelayMessage
+
+
+def snowflake(n: int) -> int:
+    # 保持期間で捨てられないよう、今の時刻の ID にする
+    return ((int(time.time() * 1000) - 1420070400000) << 22) | n
+
+
+S1, S2, S3 = snowflake(1), snowflake(2), snowflake(3)
+
+
+def make_engine():
+    bot = FakeBot(RecordingHTTP())
+    channel = bot.add_channel(bot.add_guild())
+    engine = RelayEngine(
+        bot, mode="webhook", concurrency=4, queue_size=100, merge_limit=10,
+        map_bytes=1024 * 1024, map_ttl=86400,
+    )
+    return bot, channel, engine
+
+
+def capture_edits(engine, channel):
+    edits = []
+    webhook = engine.webhooks[channel.id]
+    original = webhook.edit_message
+
+    async def edit_message(message_id, **kwargs):
+        edits.append(kwargs["content"])
+        await original(message_id, **kwargs)
+
+    webhook.edit_message = edit_message
+    return edits
+
+
+def run(coro):
+    async def main():
+        outbound.start()
+        try:
+            return await coro
+        finally:
+            outbound.stop()
+    return asyncio.run(main())
+
+
+def test_merged_copy_follows_every_source():
+    async def main():
+        bot, channel, engine = make_engine()
+        # ワーカーが動く前に積んだ分は 1 件にまとめて送られる
+        for source_id, user, text in [(S1, "a", "spam1"), (S2, "b", "hello"), (S3, "a", "spam2")]:
+            engine.submit(channel.id, RelayMessage(user, "", text, source_id=source_id))
+        await asyncio.sleep(0.05)
+        assert bot.http.count("webhook_send") == 1
+        assert [len(engine.copies.get(i)) for i in (S1, S2, S3)] == [1, 1, 1]
+
+        edits = capture_edits(engine, channel)
+        await engine.delete_copies([S1, S3])
+        assert edits == ["**b**\nhello"]
+        assert bot.http.count("webhook_delete") + bot.http.count("bulk_delete") == 0
+
+        await engine.edit_copies(S2, "b", "hello!")
+        assert edits[-1] == "**b**\nhello!"
+
+        await engine.delete_copies([S2])
+        assert bot.http.count("webhook_delete") == 1
+        assert not engine.merged
+        engine.close()
+
+    run(main())
+
+
+def test_edit_keeps_attachment_links():
+    async def main():
+        bot, channel, engine = make_engine()
+        link = "https://cdn.discordapp.com/attachments/1/2/big.zip"
+        engine.submit(channel.id, RelayMessage("a", "", "see this", source_id=S1, links=(link,)))
+        await asyncio.sleep(0.05)
+
+        edits = capture_edits(engine, channel)
+        await engine.edit_copies(S1, "a", "see this (edited)")
+        assert edits == [f"see this (edited)\n{link}"]
+        engine.close()
+
+    run(main())
@@ -0,0 +1,34 @@
+import asyncio
+
+from bench.fakes import RecordingHTTP, FakeBot
+from bot.cogs.role_panel import RoleUpdateBatcher, RolePanelCog
+from bot.metrics import registry
+from bot.outbound import outbound
+
+
+def test_clicks_are_coalesced_and_exported():
+    async def main():
+        http = RecordingHTTP()
+        guild = FakeBot(http).add_guild()
+        member = guild.add_member()
+        roles = [guild.add_role(f"r{i}") for i in range(3)]
+        batcher = RoleUpdateBatcher(0.02)
+        for role in roles:
+            batcher.change(member, add=[role.id])
+        batcher.change(member, remove=[roles[0].id])
+        await asyncio.sleep(0.1)
+        outbound.stop()
+        return http, batcher
+
+    http, batcher = asyncio.run(main())
+    assert http.count("edit_member") == 1
+    assert batcher.stats()["saved"] == 3
+    text = registry.render()
+    assert "hunya_role_panel_changes_total" in text
+    assert 'hunya_role_panel_edits_total{result="ok"}' in text
+    assert "hunya_role_panel_calls_saved" in text
+
+
+def test_role_panel_select_requires_manage_roles():
+    command = RolePanelCog.role_panel_select
+    assert command.checks
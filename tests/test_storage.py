@@ -0,0 +1,204 @@
+import json
+import time
+import asyncio
+
+from bot.storage import Storage, RemoteBackend
+
+
+def slow_write(backend, delay, fail_first=0):
+    """backend.write を遅く（最初の fail_first 回は失敗に）する"""
+    write = backend.write
+    calls = []
+
+    def wrapper(payloads):
+        calls.append(payloads)
+        time.sleep(delay)
+        if len(calls) <= fail_first:
+            raise OSError("disk full")
+        return write(payloads)
+
+    backend.write = wrapper
+    return calls
+
+
+def test_changes_during_write_are_flushed(tmp_path):
+    async def main():
+        storage = Storage(str(tmp_path), interval=0.01, backend="json")
+        data = storage.open("s", {})
+        calls = slow_write(storage.backend, 0.1)
+
+        data["a"] = 1
+        storage.mark_dirty("s", "a")
+        await asyncio.sleep(0.05)  # 1 回目の書き込みの途中
+        data["b"] = 2
+        storage.mark_dirty("s", "b")
+        await asyncio.sleep(0.4)
+        return calls
+
+    calls = asyncio.run(main())
+    assert len(calls) == 2
+    assert Storage(str(tmp_path), backend="json").open("s", {}) == {"a": 1, "b": 2}
+
+
+def test_failed_write_is_retried(tmp_path):
+    async def main():
+        storage = Storage(str(tmp_path), interval=0.01, backend="json")
+        data = storage.open("s", {})
+        calls = slow_write(storage.backend, 0, fail_first=2)
+
+        data["a"] = 1
+        storage.mark_dirty("s", "a")
+        await asyncio.sleep(0.3)
+        return storage, calls
+
+    storage, calls = asyncio.run(main())
+    assert len(calls) == 3
+    assert storage.failures == 0
+    assert not storage.dirty
+    assert Storage(str(tmp_path), backend="json").open("s", {}) == {"a": 1}
+
+
+class FakeBus:
+    """ランチャーの storage に直接つなぐ IpcClient の代わり"""
+
+    def __init__(self, launcher, during_request=None):
+        self.launcher = launcher
+        self.sent = []
+        self.during_request = during_request
+        self.reconnected = []
+
+    def send(self, to, op, data=None):
+        self.sent.append((op, json.loads(json.dumps(data))))
+        return True
+
+    async def request(self, to, op, data=None, timeout=10.0):
+        if self.during_request:
+            self.during_request()
+            self.during_request = None
+        if op == "store.names":
+            return self.launcher.names()
+        return json.loads(json.dumps(self.launcher.open(data["name"], data["default"])))
+
+
+def worker(tmp_path, bus):
+    storage = Storage(str(tmp_path / "worker"), backend="json")
+    # ソケットは無いので、同期通信をすれば失敗する
+    storage.backend = RemoteBackend(str(tmp_path / "missing.sock"), bus)
+    return storage
+
+
+def test_concurrent_list_changes_are_not_lost(tmp_path):
+    async def main():
+        launcher = Storage(str(tmp_path), interval=0.01, backend="json")
+        launcher.open("global", {})["net"] = []
+        buses = [FakeBus(launcher), FakeBus(launcher)]
+        workers = [worker(tmp_path, bus) for bus in buses]
+        for w in workers:
+            await w.preload()
+
+        # 2 つのワーカーが同じネットワークにほぼ同時に参加する
+        workers[0].change("global", "net", "add", "1:10")
+        workers[1].change("global", "net", "add", "2:20")
+        for i, bus in enumerate(buses):
+            for op, payload in bus.sent:
+                launcher.apply(payload, mark=True)
+                # ランチャーは送り主以外に配る
+                workers[1 - i].apply(payload)
+        await asyncio.sleep(0.1)
+        return launcher, workers
+
+    launcher, workers = asyncio.run(main())
+    assert sorted(launcher.stores["global"]["net"]) == ["1:10", "2:20"]
+    for w in workers:
+        assert sorted(w.stores["global"]["net"]) == ["1:10", "2:20"]
+    assert Storage(str(tmp_path), backend="json").open("global", {})["net"] == launcher.stores["global"]["net"]
+
+
+def test_preload_opens_without_blocking_request(tmp_path):
+    launcher = Storage(str(tmp_path), backend="json")
+    launcher.open("global", {})["net"] = ["1:10"]
+    launcher.mark_dirty("global", "net")
+
+    def update_during_preload():
+        w.apply({"name": "global", "ops": [["net", "add", "2:20"]]})
+
+    w = worker(tmp_path, FakeBus(launcher, update_during_preload))
+    asyncio.run(w.preload())
+    assert w.open("global", {}) == {"net": ["1:10", "2:20"]}
+    assert w.open("new_store", {"x": 1}) == {"x": 1}
+
+
+def test_sqlite_connection_stays_on_storage_thread(tmp_path):
+    # 接続は check_same_thread のまま。他のスレッドから触れば ProgrammingError になる
+    async def main():
+        storage = Storage(str(tmp_path), interval=0.01, backend="sqlite")
+        await storage.preload()
+        storage.open("auto_roles", {})["1"] = "2"
+        storage.mark_dirty("auto_roles", "1")
+        storage.open("notes", {})["k"] = {"v": 1}
+        storage.mark_dirty("notes", "k")
+        await asyncio.sleep(0.1)
+        storage.close_sync()
+
+    from bot import storage as module
+    path = str(tmp_path / "test.db")
+    original = module.SQLITE_PATH
+    module.SQLITE_PATH = path
+    try:
+        asyncio.run(main())
+
+        async def reload():
+            storage = Storage(str(tmp_path), backend="sqlite")
+            await storage.preload()
+            result = storage.open("auto_roles", {}), storage.open("notes", {})
+            storage.close_sync()
+            return result
+
+        assert asyncio.run(reload()) == ({"1": "2"}, {"k": {"v": 1}})
+    finally:
+        module.SQLITE_PATH = original
+
+
+def test_writes_are_queued_while_disconnected(tmp_path):
+    async def main():
+        bus = FakeBus(None)
+        connected = False
+        send = bus.send
+        bus.send = lambda to, op, data=None: connected and send(to, op, data)
+        w = worker(tmp_path, bus)
+        w.preloaded = {}
+        data = w.open("s", {})
+        data["a"] = [1]
+        w.backend.write({"s": w.backend.prepare("s", data, ["a"])})
+        data["a"].append(2)  # ためた値はその時点のまま
+        w.backend.write({"s": w.backend.prepare("s", data, ["b"])})
+        assert bus.sent == [] and len(w.backend.queue) == 2
+
+        connected = True
+        for callback in bus.reconnected:
+            callback()
+        return bus.sent, w.backend.queue
+
+    sent, queue = asyncio.run(main())
+    assert queue == []
+    assert [payload for _, payload in sent] == [
+        {"name": "s", "set": {"a": [1]}, "delete": []},
+        {"name": "s", "set": {}, "delete": ["b"]},
+    ]
+
+
+def test_resync_after_reconnect_keeps_unsent_changes(tmp_path):
+    async def main():
+        launcher = Storage(str(tmp_path), backend="json")
+        launcher.open("s", {}).update({"a": 1, "b": 2, "c": 3})
+        bus = FakeBus(launcher)
+        w = worker(tmp_path, bus)
+        w.preloaded = {}
+        local = w.open("s", {})
+        local.update({"a": 1, "b": 0, "c": 0, "gone": 1})
+        # c はまだ送っていない自分の変更
+        w.dirty["s"] = {"c"}
+        await w.resync()
+        return local
+
+    assert asyncio.run(main()) == {"a": 1, "b": 2, "c": 0}
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from bench.fakes import RecordingHTTP, FakeBot, FakeUser
+from bot.cogs.ticket import TicketCog
+from bot.outbound import outbound
+
+
+class FakeResponse:
+    def __init__(self):
+        self.deferred = False
+
+    async def defer(self, **kwargs):
+        self.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+def test_failed_channel_creation_sends_followup():
+    async def main():
+        bot = FakeBot(RecordingHTTP())
+        guild = bot.add_guild()
+        guild.categories = []
+
+        async def create_category(name):
+            raise discord.HTTPException(SimpleNamespace(status=403, reason="Forbidden"), "Missing Permissions")
+
+        guild.create_category = create_category
+        interaction = SimpleNamespace(
+            guild=guild, user=FakeUser(), response=FakeResponse(), followup=FakeFollowup()
+        )
+        cog = TicketCog(bot)
+        view = cog.TicketView(cog)
+        await view.open.callback(interaction)
+        outbound.stop()
+        return cog, interaction
+
+    cog, interaction = asyncio.run(main())
+    assert interaction.response.deferred
+    assert len(interaction.followup.sent) == 1
+    assert "作成できませんでした" in interaction.followup.sent[0]
+    assert not cog.creating
+
+
+def test_failed_welcome_message_rolls_back_ticket():
+    async def main():
+        bot = FakeBot(RecordingHTTP())
+        guild = bot.add_guild()
+        guild.categories = []
+        guild.default_role = object()
+        deleted = []
+
+        async def create_category(name):
+            return SimpleNamespace(id=1)
+
+        async def create_text_channel(name, **kwargs):
+            async def send(*args, **kwargs):
+                raise discord.HTTPException(SimpleNamespace(status=500, reason="Server Error"), "boom")
+
+            async def delete():
+                deleted.append(channel.id)
+
+            channel = SimpleNamespace(id=2, guild=guild, mention="#ticket", send=send, delete=delete)
+            return channel
+
+        guild.create_category = create_category
+        guild.create_text_channel = create_text_channel
+        user = FakeUser()
+        user.mention = "@user"
+        interaction = SimpleNamespace(guild=guild, user=user, response=FakeResponse(), followup=FakeFollowup())
+        cog = TicketCog(bot)
+        view = cog.TicketView(cog)
+        await view.open.callback(interaction)
+        outbound.stop()
+        return cog, interaction, deleted, f"{guild.id}:{user.id}"
+
+    cog, interaction, deleted, key = asyncio.run(main())
+    assert key not in cog.owners.values()
+    assert deleted == [2]
+    assert 2 not in cog.owners
+    assert interaction.followup.sent and "作成できませんでした" in interaction.followup.sent[0]